@@ -44,8 +44,9 @@ export const HistoryList = ({
           <Card className={styles.historyCard}>
             <Box className={styles.imageContainer}>
               <img
-                src={recognitionApi.getImageUrl(item.imagePath)}
+                src={recognitionApi.getThumbnailUrl(item.id)}
                 alt={`Recognition ${item.id}`}
+                loading="lazy"
                 className={styles.historyImage}
               />
             </Box>
@@ -22,14 +22,8 @@ export const apiClient = axios.create({
 // Request interceptor
 apiClient.interceptors.request.use(
   (config: InternalAxiosRequestConfig) => {
-    // Add timestamp to prevent caching
-    if (config.method === "get") {
-      config.params = {
-        ...config.params,
-        _t: Date.now(),
-      };
-    }
-
+    // No cache-busting params: the API sends "Cache-Control: no-cache" with an
+    // ETag, so the browser revalidates (If-None-Match) and gets 304 when unchanged
     return config;
   },
   (error: AxiosError) => {
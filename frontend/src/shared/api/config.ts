@@ -9,6 +9,8 @@ export const API_ENDPOINTS = {
   DETECT_BY_ID: (id: number) => `/detect/${id}`,
   DETECT_DELETE: (id: number) => `/detect/${id}`,
   DETECT_STATS: "/detect/stats/summary",
+  DETECT_THUMBNAIL: (id: number) => `/detect/${id}/thumbnail`,
+  DETECT_PREVIEW: (id: number) => `/detect/${id}/preview`,
 
   // Video
   VIDEO_ANALYZE: "/video/analyze",
@@ -29,6 +29,10 @@ export const recognitionApi = {
     return `${API_BASE_URL}${API_ENDPOINTS.UPLOADS(filename)}`;
   },
 
+  getThumbnailUrl(id: number): string {
+    return `${API_BASE_URL}${API_ENDPOINTS.DETECT_THUMBNAIL(id)}`;
+  },
+
   async analyzeVideo(
     file: File,
     sampleInterval: number = 1.0,
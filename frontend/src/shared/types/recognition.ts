@@ -17,6 +17,8 @@ export interface Recognition {
   cowsCount: number;
   result: Detection[];
   createdAt: string;
+  thumbnailUrl?: string;
+  previewUrl?: string;
 }
 
 export interface DetectionResult {
@@ -25,4 +27,6 @@ export interface DetectionResult {
   cowsCount: number;
   result: Detection[];
   createdAt: string;
+  thumbnailUrl?: string;
+  previewUrl?: string;
 }
@@ -0,0 +1,140 @@
+"""
+Admin endpoints - runtime diagnostics, storage and camera regions of interest
+Enabled only when ADMIN_TOKEN is set; requests must send it in X-Admin-Token
+"""
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from typing import List, Optional
+import os
+import re
+import secrets
+
+from .profiling import profiler
+from .roi import rois
+from .schemas import MessageResponse, RoiRequest, RoiResponse
+from .storage_gc import collector
+from . import storage
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+PROFILE_NAME = re.compile(r"^profile-[\d-]+\.folded$")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Dependency: check admin token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin API is disabled")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+# Create router
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+@router.post("/profile", status_code=202)
+async def start_profile(
+    requests: int = Query(10, ge=1, le=1000, description="Number of requests to profile"),
+    interval_ms: float = Query(5.0, ge=1.0, le=1000.0, description="Sampling interval in milliseconds")
+):
+    """
+    Profile the next N requests with a stack sampler
+
+    Output is written in collapsed-stack format (flamegraph.pl / speedscope)
+    once the last profiled request finishes.
+    """
+    try:
+        profiler.arm(requests, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+
+@router.get("/profile")
+async def get_profile_status():
+    """
+    Get profiler state and written profiles
+    """
+    return {**profiler.status(), "profiles": profiler.list_profiles()}
+
+
+@router.delete("/profile")
+async def cancel_profile():
+    """
+    Stop profiling early and write samples collected so far
+    """
+    profiler.cancel()
+    return profiler.status()
+
+
+@router.get("/profile/{name}")
+async def download_profile(name: str):
+    """
+    Download profile in collapsed-stack format
+    """
+    path = profiler.profile_dir / name
+    if not PROFILE_NAME.match(name) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
+
+
+@router.get("/storage")
+async def get_storage_status():
+    """
+    Get upload volume usage and report of the last storage collection
+    """
+    return {
+        "disk": storage.disk_usage(collector.upload_dir),
+        "last_collection": collector.last_report
+    }
+
+
+@router.post("/storage/gc")
+async def collect_storage(
+    dry_run: bool = Query(False, description="Only report what would be deleted")
+):
+    """
+    Run storage collection now (retention, orphan files and rows)
+    """
+    report = await run_in_threadpool(collector.run, dry_run)
+    if "skipped" in report:
+        raise HTTPException(status_code=409, detail=report["skipped"])
+    return report
+
+
+@router.get("/roi", response_model=List[RoiResponse])
+async def list_rois():
+    """
+    List stored regions of interest
+    """
+    return await run_in_threadpool(rois.list)
+
+
+@router.get("/roi/{name}", response_model=RoiResponse)
+async def get_roi(name: str):
+    """
+    Get stored region of interest
+    """
+    return await run_in_threadpool(rois.get, name)
+
+
+@router.put("/roi/{name}", response_model=RoiResponse)
+async def save_roi(name: str, body: RoiRequest):
+    """
+    Create or replace region of interest of a camera / stream
+
+    Ingestion sources use the region with their own name; stream sessions and
+    video analyses pick one with `roi=<name>`. Other API processes see the
+    change within ROI_CACHE_SECONDS.
+    """
+    return await run_in_threadpool(rois.save, name, body.polygon)
+
+
+@router.delete("/roi/{name}", response_model=MessageResponse)
+async def delete_roi(name: str):
+    """
+    Delete region of interest (frames are analyzed whole again)
+    """
+    await run_in_threadpool(rois.delete, name)
+    return {"message": "ROI deleted successfully"}
@@ -0,0 +1,133 @@
+"""
+Load-aware admission control for inference requests
+
+Per-IP rate limits do not protect the model when many clients each stay under
+their limit. Every request that runs inference is admitted with its cost in
+model runs it keeps in flight: 1 for an image or stream frame, the pipeline
+window (not the whole video) for a video analysis. A cost is never more than
+ADMISSION_MAX_PENDING.
+
+Admitted cost is tracked per priority class (scheduling.py). Each class has a
+reserved part of ADMISSION_MAX_PENDING in proportion to its INFERENCE_SHARES
+and may use whatever is left of the total. A request is rejected with 503 and
+Retry-After only when its class is over its reservation and the total is full,
+so batch analyses cannot lock out interactive or realtime requests. A class
+with nothing pending always gets one request in. Retry-After is estimated
+from the class backlog and the measured time per model run.
+
+Accounting is per API process. Each process can only push its own backlog
+onto the model (local or the shared inference server), so size
+ADMISSION_MAX_PENDING to the share of model capacity one process may use.
+"""
+from contextlib import contextmanager
+from fastapi import HTTPException
+from typing import Dict, Optional
+import math
+import os
+import threading
+import time
+
+from . import metrics, scheduling
+
+# Model runs admitted but not finished (per process) before requests are shed
+ADMISSION_MAX_PENDING = int(os.getenv("ADMISSION_MAX_PENDING", "64"))
+
+# Bounds of Retry-After header (seconds)
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class AdmissionController:
+    """
+    Tracks admitted inference cost per priority class and sheds requests beyond capacity
+    """
+
+    def __init__(
+        self,
+        capacity: int = ADMISSION_MAX_PENDING,
+        seconds_per_run: float = 0.1,
+        shares: Dict[str, float] = scheduling.INFERENCE_SHARES
+    ):
+        self.capacity = max(1, capacity)
+        self.pending = 0
+        self.pending_by_priority = {priority: 0 for priority in scheduling.PRIORITIES}
+        # Runs each class can always get, whatever the other classes hold
+        total_share = sum(shares[priority] for priority in scheduling.PRIORITIES)
+        self.reserved = {
+            priority: max(1, int(self.capacity * shares[priority] / total_share))
+            for priority in scheduling.PRIORITIES
+        }
+        # Moving average of request time per model run (initial guess until measured)
+        self.seconds_per_run = seconds_per_run
+        self._lock = threading.Lock()
+
+    def retry_after(self, priority: Optional[str] = None) -> int:
+        """Seconds until the backlog of the class (current one by default) is expected to be processed"""
+        priority = priority or scheduling.current_priority()
+        estimate = math.ceil(self.pending_by_priority[priority] * self.seconds_per_run)
+        return max(MIN_RETRY_AFTER, min(MAX_RETRY_AFTER, estimate))
+
+    def _fits(self, priority: str, cost: int) -> bool:
+        pending = self.pending_by_priority[priority]
+        return (
+            pending == 0
+            or pending + cost <= self.reserved[priority]
+            or self.pending + cost <= self.capacity
+        )
+
+    def saturated(self, priority: Optional[str] = None) -> bool:
+        """True when the class (current one by default) should not accept more work"""
+        return not self._fits(priority or scheduling.current_priority(), 1)
+
+    def _shed(self, endpoint: str, priority: str) -> HTTPException:
+        metrics.REQUESTS_SHED.labels(endpoint).inc()
+        return HTTPException(
+            status_code=503,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": str(self.retry_after(priority))}
+        )
+
+    def check(self, endpoint: str) -> None:
+        """Reject early (before reading uploads) when already saturated"""
+        priority = scheduling.current_priority()
+        if self.saturated(priority):
+            raise self._shed(endpoint, priority)
+
+    @contextmanager
+    def admit(self, cost: int, endpoint: str, runs: Optional[int] = None):
+        """
+        Reserve `cost` in-flight model runs for the block (current priority class), 503 if over capacity
+        `runs`: model runs the block does in total (default `cost`), for the time per run estimate
+        """
+        priority = scheduling.current_priority()
+        cost = min(max(1, cost), self.capacity)
+        with self._lock:
+            if not self._fits(priority, cost):
+                raise self._shed(endpoint, priority)
+            self.pending += cost
+            self.pending_by_priority[priority] += cost
+            metrics.ADMISSION_PENDING.set(self.pending)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.pending -= cost
+                self.pending_by_priority[priority] -= cost
+                metrics.ADMISSION_PENDING.set(self.pending)
+                self.seconds_per_run = 0.8 * self.seconds_per_run + 0.2 * (elapsed / max(1, runs or cost))
+
+    def status(self) -> Dict:
+        return {
+            "pending": self.pending,
+            "pending_by_priority": dict(self.pending_by_priority),
+            "capacity": self.capacity,
+            "reserved": self.reserved,
+            "seconds_per_run": round(self.seconds_per_run, 4),
+            "saturated": self.pending >= self.capacity,
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,198 @@
+"""
+In-process response cache for read-heavy endpoints
+
+Cached entries hold the serialized JSON body, so repeated reads skip both the
+database and serialization. Responses carry a content ETag, answer
+conditional GETs (If-None-Match) with 304 and are compressed (brotli / gzip)
+once per entry. Writes invalidate a whole namespace (e.g. all recognition
+reads). There is no Last-Modified: writes of other processes are only seen
+when entries expire, so a date kept per process would go stale.
+"""
+from collections import OrderedDict
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Register brotli if available
+try:
+    import brotli
+except ImportError:
+    brotli = None  # brotli compression is optional
+
+# Cache configuration
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+
+class CachedBody:
+    """
+    Serialized response body with validators and lazily built compressed variants
+    """
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.encoded: Dict[str, bytes] = {}
+
+    def encode(self, encoding: str) -> bytes:
+        """Get body compressed with given content encoding (cached)"""
+        if encoding not in self.encoded:
+            if encoding == "br":
+                self.encoded[encoding] = brotli.compress(self.body, quality=5)
+            elif encoding == "gzip":
+                self.encoded[encoding] = gzip.compress(self.body, compresslevel=6)
+            else:
+                raise ValueError(f"Unsupported content encoding: {encoding}")
+        return self.encoded[encoding]
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry TTL
+    Keys are tuples whose first item is a namespace used for invalidation
+    """
+
+    def __init__(self, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generations: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[Any]:
+        """Get value, or None if missing or expired"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Tuple[Hashable, ...], value: Any, generation: Optional[int] = None) -> None:
+        """
+        Store value
+        If generation is given and the namespace was invalidated since, value is dropped
+        """
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key[0], 0):
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, namespace: Hashable) -> int:
+        """Current generation of namespace (changes on every invalidation)"""
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def invalidate(self, namespace: Hashable) -> None:
+        """Drop all entries of namespace"""
+        with self._lock:
+            for key in [key for key in self._data if key[0] == namespace]:
+                del self._data[key]
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def clear(self) -> None:
+        """Drop all entries of all namespaces"""
+        with self._lock:
+            namespaces = {key[0] for key in self._data} | set(self._generations)
+        for namespace in namespaces:
+            self.invalidate(namespace)
+
+
+# Shared cache for recognition reads (history, detail, stats)
+RECOGNITIONS = "recognitions"
+response_cache = TTLCache()
+
+
+def _choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick content encoding from Accept-Encoding header"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        fields = part.strip().split(";")
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(fields[0].strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _not_modified(request: Request, cached: CachedBody) -> bool:
+    """Evaluate If-None-Match against cached body"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or cached.etag in tags or f"W/{cached.etag}" in tags
+
+
+def cached_json_response(
+    request: Request,
+    key: Tuple[Hashable, ...],
+    build: Callable[[], Any],
+    cache: TTLCache = response_cache,
+    vary: str = "Accept-Encoding"
+) -> Response:
+    """
+    Serve JSON for key from cache, building it with build() on a miss
+    Supports conditional GET (304) and brotli/gzip compression
+    Endpoints negotiating other media types pass vary="Accept, Accept-Encoding"
+    """
+    namespace = key[0]
+    cached = cache.get(key)
+    if cached is None:
+        generation = cache.generation(namespace)
+        body = json.dumps(jsonable_encoder(build()), separators=(",", ":")).encode()
+        cached = CachedBody(body)
+        cache.set(key, cached, generation=generation)
+
+    headers = {
+        "ETag": cached.etag,
+        # Allow storing, but always revalidate (cheap thanks to 304)
+        "Cache-Control": "no-cache",
+        "Vary": vary,
+    }
+
+    if _not_modified(request, cached):
+        return Response(status_code=304, headers=headers)
+
+    body = cached.body
+    encoding = _choose_encoding(request.headers.get("accept-encoding")) if len(body) >= MIN_COMPRESS_SIZE else None
+    if encoding:
+        body = cached.encode(encoding)
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,263 @@
+"""
+Annotated video clips of stored analyses
+
+    decoder --frames--> draw pool (threads) --in order--> encoder (ffmpeg) --> response
+
+Boxes come from the stored detections (DetectionStore); the model is not run
+again. Frames between two analyzed frames show the boxes of the earlier one.
+The decoder seeks to the clip start, drawing runs on a small thread pool
+(OpenCV releases the GIL), and at most CLIP_PREFETCH_FRAMES frames are in
+flight, so memory stays flat for long clips.
+
+Frames are piped into ffmpeg, which writes fragmented MP4 to stdout: the
+response streams each fragment as soon as it is encoded, and the video plays
+before it is complete. Without an ffmpeg executable, OpenCV encodes into a
+temporary file that is sent once finished.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from fastapi import HTTPException
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+import logging
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+
+import cv2
+import numpy as np
+
+from .detection_store import DetectionColumns
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Encoder executable (path or name on PATH) and video codec
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+CLIP_CODEC = os.getenv("CLIP_CODEC", "libx264")
+
+# Threads drawing annotations / frames decoded ahead of the encoder
+CLIP_DRAW_WORKERS = int(os.getenv("CLIP_DRAW_WORKERS", "2"))
+CLIP_PREFETCH_FRAMES = int(os.getenv("CLIP_PREFETCH_FRAMES", "8"))
+
+# Clips rendered at the same time (encoding is CPU heavy); more get 503
+CLIP_MAX_CONCURRENT = int(os.getenv("CLIP_MAX_CONCURRENT", "2"))
+
+# Longest clip (seconds)
+CLIP_MAX_SECONDS = float(os.getenv("CLIP_MAX_SECONDS", "600"))
+
+# Bytes per response chunk
+CHUNK_SIZE = 64 * 1024
+
+BOX_COLOR = (0, 200, 0)
+TEXT_COLOR = (255, 255, 255)
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+_slots = threading.BoundedSemaphore(max(1, CLIP_MAX_CONCURRENT))
+
+
+def ffmpeg_path() -> Optional[str]:
+    """ffmpeg executable, None if not installed"""
+    return shutil.which(FFMPEG_BINARY)
+
+
+def hold_frames(sample_interval: float, fps: int) -> int:
+    """Frames after an analyzed frame that still show its boxes"""
+    return max(1, math.ceil(sample_interval * fps)) + 1
+
+
+def draw_annotations(frame: np.ndarray, boxes: np.ndarray, timestamp: float) -> np.ndarray:
+    """Draw boxes (confidence, x1, y1, x2, y2), cow count and time onto frame (in place)"""
+    for confidence, x1, y1, x2, y2 in boxes.tolist():
+        top_left = (int(x1), int(y1))
+        cv2.rectangle(frame, top_left, (int(x2), int(y2)), BOX_COLOR, 2)
+        cv2.putText(frame, f"cow {confidence:.2f}", (int(x1), max(int(y1) - 5, 12)), FONT, 0.5, BOX_COLOR, 1, cv2.LINE_AA)
+    label = f"{timestamp:7.2f}s  cows: {len(boxes)}"
+    (width, height), _ = cv2.getTextSize(label, FONT, 0.6, 1)
+    cv2.rectangle(frame, (0, 0), (width + 12, height + 12), (0, 0, 0), -1)
+    cv2.putText(frame, label, (6, height + 6), FONT, 0.6, TEXT_COLOR, 1, cv2.LINE_AA)
+    return frame
+
+
+class ClipRenderer:
+    """
+    Annotated clip [start, end] of an analyzed video
+    """
+
+    def __init__(
+        self,
+        video_path: Path,
+        columns: DetectionColumns,
+        fps: int,
+        sample_interval: float,
+        start: float,
+        end: float,
+        workers: int = CLIP_DRAW_WORKERS,
+        prefetch: int = CLIP_PREFETCH_FRAMES
+    ):
+        self.video_path = video_path
+        self.columns = columns
+        # Frame rate the analysis used for timestamps (frame_number / fps)
+        self.fps = fps
+        # Analyzed frames keep their boxes on screen until the next one (one frame of slack for rounding)
+        self.hold_frames = hold_frames(sample_interval, fps)
+        self.start = start
+        self.end = end
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self._stop = threading.Event()
+
+    def _boxes(self, frame_number: int) -> np.ndarray:
+        """Boxes of the latest analyzed frame at or before frame_number"""
+        frame_numbers = self.columns.frames["frame_number"]
+        i = int(np.searchsorted(frame_numbers, frame_number, side="right")) - 1
+        if i < 0 or frame_number - frame_numbers[i] >= self.hold_frames:
+            return np.empty((0, 5), dtype=np.float32)
+        lo, hi = self.columns.frames["offset"][i:i + 2]
+        detections = self.columns.detections
+        return np.stack(
+            [detections[name][lo:hi] for name in ("confidence", "x1", "y1", "x2", "y2")], axis=1
+        )
+
+    def _decode(self, cap: cv2.VideoCapture) -> Iterator[Tuple[int, np.ndarray]]:
+        """(frame number, BGR frame) of the clip; frame numbers count from 1 like the analysis"""
+        first = max(1, math.ceil(self.start * self.fps))
+        last = max(first, math.floor(self.end * self.fps))
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first - 1)
+        frame_number = int(cap.get(cv2.CAP_PROP_POS_FRAMES)) + 1
+        while frame_number <= last and not self._stop.is_set():
+            with metrics.stage(metrics.DECODE):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            if frame_number >= first:
+                yield frame_number, frame
+            frame_number += 1
+
+    def _annotate(self, frame_number: int, frame: np.ndarray) -> np.ndarray:
+        return draw_annotations(frame, self._boxes(frame_number), frame_number / self.fps)
+
+    def frames(self, cap: cv2.VideoCapture) -> Iterator[np.ndarray]:
+        """Annotated frames in order, drawn on a thread pool with bounded look-ahead"""
+        pending = deque()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="clip-draw") as pool:
+            try:
+                for frame_number, frame in self._decode(cap):
+                    pending.append(pool.submit(self._annotate, frame_number, frame))
+                    if len(pending) >= self.prefetch:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _open(self) -> Tuple[cv2.VideoCapture, float, int, int]:
+        cap = cv2.VideoCapture(str(self.video_path))
+        if not cap.isOpened():
+            raise HTTPException(status_code=404, detail="Cannot open video file")
+        fps = cap.get(cv2.CAP_PROP_FPS) or float(self.fps)
+        return cap, fps, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def _feed(self, cap: cv2.VideoCapture, stdin) -> None:
+        # Thread: decode, draw and pipe raw frames into ffmpeg
+        try:
+            for frame in self.frames(cap):
+                if self._stop.is_set():
+                    break
+                stdin.write(memoryview(np.ascontiguousarray(frame)))
+                metrics.CLIP_FRAMES.inc()
+        except (BrokenPipeError, ValueError):
+            # Encoder exited (client gone or encode error, logged by the reader)
+            pass
+        except Exception as e:
+            logger.error(f"Clip rendering failed: {str(e)}")
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _stream_ffmpeg(self, ffmpeg: str) -> Iterator[bytes]:
+        cap, fps, width, height = self._open()
+        command = [
+            ffmpeg, "-hide_banner", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", f"{fps:g}", "-i", "-",
+            "-an", "-c:v", CLIP_CODEC, "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            # yuv420p needs even dimensions
+            "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+            # Fragmented MP4: playable while it is being written, no seek back to the header
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4", "-"
+        ]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        feeder = threading.Thread(
+            target=copy_context().run, args=(self._feed, cap, process.stdin), name="clip-feeder", daemon=True
+        )
+        feeder.start()
+        try:
+            while True:
+                chunk = process.stdout.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            if process.wait() != 0:
+                logger.error(f"Clip encoder failed: {process.stderr.read().decode(errors='replace').strip()}")
+        finally:
+            self._stop.set()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            feeder.join()
+            process.stdout.close()
+            process.stderr.close()
+            cap.release()
+
+    def _stream_file(self) -> Iterator[bytes]:
+        cap, fps, width, height = self._open()
+        with tempfile.NamedTemporaryFile(suffix=".mp4") as tmp:
+            try:
+                writer = cv2.VideoWriter(tmp.name, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+                try:
+                    for frame in self.frames(cap):
+                        writer.write(frame)
+                        metrics.CLIP_FRAMES.inc()
+                finally:
+                    writer.release()
+            finally:
+                cap.release()
+            while True:
+                chunk = tmp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def stream(self) -> Iterator[bytes]:
+        """
+        Encoded MP4, chunk by chunk (blocking; StreamingResponse runs it in a worker thread)
+        Takes a render slot; 503 if all are in use
+        """
+        if not _slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=503,
+                detail="Too many clips are being rendered, try again later",
+                headers={"Retry-After": "10"}
+            )
+        ffmpeg = ffmpeg_path()
+
+        def chunks() -> Iterator[bytes]:
+            try:
+                yield from self._stream_ffmpeg(ffmpeg) if ffmpeg else self._stream_file()
+            finally:
+                self._stop.set()
+                release()
+
+        generator = chunks()
+        # Also frees the slot if the response is dropped before streaming starts
+        release = weakref.finalize(generator, _slots.release)
+        return generator
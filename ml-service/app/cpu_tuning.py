@@ -0,0 +1,262 @@
+"""
+CPU thread and affinity settings for inference, and an autotuner
+
+Torch, OpenCV and BLAS libraries each size their own thread pools to the whole
+machine. With several model instances per host (inference workers, uvicorn
+workers) that oversubscribes the CPU. Settings come from the tuning file
+written by `python manage.py autotune` (CPU_TUNING_FILE, profile selected with
+CPU_TUNING_PROFILE: "throughput" or "latency") and can be overridden per value:
+
+    TORCH_INTRA_OP_THREADS   threads per inference (torch.set_num_threads)
+    TORCH_INTER_OP_THREADS   torch inter-op pool size
+    OPENCV_THREADS           cv2.setNumThreads (0 disables OpenCV threading)
+    CPU_AFFINITY             "none", "auto" (split allowed CPUs between inference
+                             workers) or a CPU list such as "0-3,8-11"
+    INFERENCE_WORKERS        worker processes of the inference server
+
+Unset values keep the library defaults.
+"""
+from pathlib import Path
+from typing import Dict, List, Optional
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CPU_TUNING_FILE = Path(os.getenv("CPU_TUNING_FILE", "./data/cpu_tuning.json"))
+CPU_TUNING_PROFILE = os.getenv("CPU_TUNING_PROFILE", "throughput")
+
+PROFILES = ("throughput", "latency")
+
+# BLAS / OpenMP pools read these when first initialised
+_BLAS_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else None
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """"0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class CPUSettings:
+    """
+    Thread counts and CPU pinning for one inference worker (None = library default)
+    """
+
+    FIELDS = ("intra_op_threads", "inter_op_threads", "opencv_threads", "affinity", "workers")
+
+    def __init__(
+        self,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        opencv_threads: Optional[int] = None,
+        affinity: str = "none",
+        workers: Optional[int] = None
+    ):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.opencv_threads = opencv_threads
+        self.affinity = affinity
+        self.workers = workers
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CPUSettings":
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+    def to_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self) -> str:
+        return f"CPUSettings({', '.join(f'{k}={v}' for k, v in self.to_dict().items())})"
+
+    def cpus_for(self, worker_index: Optional[int], workers: int) -> Optional[List[int]]:
+        """CPUs to pin worker to, or None to leave affinity alone"""
+        if self.affinity in ("", "none"):
+            return None
+        cpus = available_cpus() if self.affinity == "auto" else parse_cpu_list(self.affinity)
+        if worker_index is None or workers <= 1:
+            return cpus
+        # Contiguous share per worker (neighbouring CPUs usually share caches)
+        share = max(1, len(cpus) // workers)
+        start = (worker_index * share) % len(cpus)
+        return cpus[start:start + share]
+
+    def apply(self, worker_index: Optional[int] = None, workers: int = 1) -> None:
+        """Apply settings to current process (call before the model is loaded)"""
+        if self.intra_op_threads:
+            for name in _BLAS_ENV_VARS:
+                os.environ.setdefault(name, str(self.intra_op_threads))
+
+        cpus = self.cpus_for(worker_index, workers)
+        if cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+
+        if self.opencv_threads is not None:
+            import cv2
+            cv2.setNumThreads(self.opencv_threads)
+
+        if self.intra_op_threads or self.inter_op_threads:
+            try:
+                import torch
+            except ImportError:
+                torch = None
+            if torch is not None:
+                if self.intra_op_threads:
+                    torch.set_num_threads(self.intra_op_threads)
+                if self.inter_op_threads:
+                    try:
+                        torch.set_num_interop_threads(self.inter_op_threads)
+                    except RuntimeError:
+                        # Only possible before torch runs any parallel work
+                        logger.warning("Cannot change torch inter-op threads after parallel work has started")
+
+        logger.info(f"CPU settings applied: {self}" + (f" on CPUs {cpus}" if cpus else ""))
+
+
+def load_settings(profile: str = CPU_TUNING_PROFILE, path: Path = CPU_TUNING_FILE) -> CPUSettings:
+    """Settings from tuning file profile, overridden by environment variables"""
+    settings = CPUSettings()
+    if path.is_file():
+        try:
+            tuned = json.loads(path.read_text()).get(profile)
+            if tuned:
+                settings = CPUSettings.from_dict(tuned["settings"])
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring invalid CPU tuning file {path}: {str(e)}")
+
+    overrides = {
+        "intra_op_threads": _env_int("TORCH_INTRA_OP_THREADS"),
+        "inter_op_threads": _env_int("TORCH_INTER_OP_THREADS"),
+        "opencv_threads": _env_int("OPENCV_THREADS"),
+        "affinity": os.getenv("CPU_AFFINITY") or None,
+        "workers": _env_int("INFERENCE_WORKERS"),
+    }
+    for field, value in overrides.items():
+        if value is not None:
+            setattr(settings, field, value)
+    return settings
+
+
+# Autotuning
+
+def _benchmark_worker(weights, settings_dict, worker_index, workers, size, barrier, deadline_queue, results):
+    """Benchmark process: load model with settings, run inference until deadline"""
+    from .services import YOLOService
+
+    settings = CPUSettings.from_dict(settings_dict)
+    settings.apply(worker_index, workers)
+    yolo_service = YOLOService(weights)
+    frame = np.random.default_rng(worker_index).integers(0, 255, size=(size, size, 3), dtype=np.uint8)
+    yolo_service.warmup(size)
+    yolo_service.detect_array(frame)
+
+    barrier.wait()
+    deadline = deadline_queue.get()
+    latencies = []
+    while time.time() < deadline:
+        start = time.perf_counter()
+        yolo_service.detect_array(frame)
+        latencies.append(time.perf_counter() - start)
+    results.put(latencies)
+
+
+def benchmark(weights: str, settings: CPUSettings, workers: int, seconds: float, size: int) -> Dict:
+    """Aggregate throughput and per-inference latency of `workers` processes with settings"""
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers + 1)
+    deadline_queue = context.Queue()
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_benchmark_worker,
+            args=(weights, settings.to_dict(), index, workers, size, barrier, deadline_queue, results)
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        # All models loaded and warm: start measuring together
+        barrier.wait(timeout=600)
+        for _ in processes:
+            deadline_queue.put(time.time() + seconds)
+        latencies = []
+        for _ in processes:
+            latencies.extend(results.get(timeout=seconds + 120))
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+    ms = np.asarray(latencies) * 1000
+    return {
+        "throughput_fps": round(len(latencies) / seconds, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+    }
+
+
+def candidate_settings(cpus: int) -> List[CPUSettings]:
+    """Worker x thread combinations that fit on `cpus` CPUs, plus library defaults"""
+    powers = [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= cpus]
+    candidates = [CPUSettings(workers=1)]
+    for workers in powers:
+        for threads in powers:
+            if workers * threads > cpus:
+                continue
+            for affinity in ("none", "auto") if workers > 1 else ("none",):
+                candidates.append(CPUSettings(
+                    intra_op_threads=threads,
+                    inter_op_threads=1,
+                    opencv_threads=1 if workers > 1 else None,
+                    affinity=affinity,
+                    workers=workers
+                ))
+    return candidates
+
+
+def autotune(weights: str, seconds: float = 10.0, size: int = 640, output: Path = CPU_TUNING_FILE) -> Dict:
+    """Benchmark candidate settings, write best per profile to output"""
+    cpus = len(available_cpus())
+    rows = []
+    for settings in candidate_settings(cpus):
+        logger.info(f"Benchmarking {settings}")
+        result = benchmark(weights, settings, settings.workers or 1, seconds, size)
+        logger.info(f"  {result}")
+        rows.append({"settings": settings.to_dict(), **result})
+
+    report = {
+        "cpus": cpus,
+        "image_size": size,
+        "seconds_per_candidate": seconds,
+        "throughput": max(rows, key=lambda row: row["throughput_fps"]),
+        "latency": min(rows, key=lambda row: row["p50_ms"]),
+        "results": rows,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    return report
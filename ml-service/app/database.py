@@ -43,3 +43,7 @@ def init_db():
     Initialize database tables
     """
     Base.metadata.create_all(bind=engine)
+    # create_all skips existing tables; add indexes introduced since they were created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -0,0 +1,186 @@
+"""
+Columnar storage for per-frame video detections
+"""
+from pathlib import Path
+from typing import Dict, List, Optional
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+# Database lives in ./data, keep analysis columns next to it
+ANALYSIS_DIR = Path(os.getenv("ANALYSIS_DIR", "./data/analyses"))
+
+# One value per analyzed frame; "offset" has one extra trailing entry
+FRAME_COLUMNS = {
+    "timestamp": np.float64,
+    "frame_number": np.int32,
+    "cows_count": np.int32,
+    "offset": np.int64,
+}
+
+# One value per detection; rows of frame i are offset[i]:offset[i + 1]
+DETECTION_COLUMNS = {
+    "confidence": np.float32,
+    "x1": np.float32,
+    "y1": np.float32,
+    "x2": np.float32,
+    "y2": np.float32,
+}
+
+
+class DetectionColumns:
+    """
+    Detections of a (slice of a) video analysis in columnar form
+    """
+
+    def __init__(self, frames: Dict[str, np.ndarray], detections: Dict[str, np.ndarray]):
+        self.frames = frames
+        self.detections = detections
+
+    @classmethod
+    def from_arrays(
+        cls,
+        timestamps: List[float],
+        frame_numbers: List[int],
+        boxes: List[np.ndarray]
+    ) -> "DetectionColumns":
+        """
+        Build columns from per-frame detection arrays
+        boxes[i] is (N, 5) float32 array (confidence, x1, y1, x2, y2) of frame i
+        """
+        counts = [len(frame_boxes) for frame_boxes in boxes]
+        offset = np.zeros(len(counts) + 1, dtype=FRAME_COLUMNS["offset"])
+        np.cumsum(counts, out=offset[1:])
+
+        frames = {
+            "timestamp": np.array(timestamps, dtype=FRAME_COLUMNS["timestamp"]),
+            "frame_number": np.array(frame_numbers, dtype=FRAME_COLUMNS["frame_number"]),
+            "cows_count": np.array(counts, dtype=FRAME_COLUMNS["cows_count"]),
+            "offset": offset,
+        }
+
+        flat = np.concatenate(boxes) if boxes else np.empty((0, 5), dtype=np.float32)
+        detections = {
+            name: np.ascontiguousarray(flat[:, i], dtype=dtype)
+            for i, (name, dtype) in enumerate(DETECTION_COLUMNS.items())
+        }
+
+        return cls(frames, detections)
+
+    def __len__(self) -> int:
+        return len(self.frames["timestamp"])
+
+    def flat_columns(self) -> Dict[str, np.ndarray]:
+        """All frame and detection columns in one mapping (for compact encodings)"""
+        return {**self.frames, **self.detections}
+
+    def to_records(self) -> List[dict]:
+        """Convert columns back to the "detections_by_time" record format"""
+        timestamps = self.frames["timestamp"].tolist()
+        frame_numbers = self.frames["frame_number"].tolist()
+        cows_counts = self.frames["cows_count"].tolist()
+        offset = self.frames["offset"].tolist()
+        confidence = self.detections["confidence"].tolist()
+        x1 = self.detections["x1"].tolist()
+        y1 = self.detections["y1"].tolist()
+        x2 = self.detections["x2"].tolist()
+        y2 = self.detections["y2"].tolist()
+
+        records = []
+        for i in range(len(timestamps)):
+            records.append({
+                "timestamp": timestamps[i],
+                "frame_number": frame_numbers[i],
+                "cows_count": cows_counts[i],
+                "detections": [
+                    {
+                        "confidence": confidence[j],
+                        "bbox": {"x1": x1[j], "y1": y1[j], "x2": x2[j], "y2": y2[j]}
+                    }
+                    for j in range(offset[i], offset[i + 1])
+                ]
+            })
+        return records
+
+
+class DetectionStore:
+    """
+    Stores detections of each video analysis as one .npy file per column
+    Files are memory-mapped on read, so a time window is sliced without
+    loading the whole analysis
+    """
+
+    def __init__(self, base_dir: Path = ANALYSIS_DIR):
+        self.base_dir = base_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    def _analysis_dir(self, analysis_id: int) -> Path:
+        return self.base_dir / str(analysis_id)
+
+    def exists(self, analysis_id: int) -> bool:
+        """Check whether columns for analysis are stored"""
+        return self._analysis_dir(analysis_id).is_dir()
+
+    def save(self, analysis_id: int, columns: DetectionColumns) -> None:
+        """Write columns atomically (temporary directory + rename)"""
+        tmp_dir = self.base_dir / f".tmp-{analysis_id}-{uuid.uuid4().hex}"
+        tmp_dir.mkdir(parents=True)
+        try:
+            for name, dtype in FRAME_COLUMNS.items():
+                np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(columns.frames[name], dtype=dtype))
+            for name, dtype in DETECTION_COLUMNS.items():
+                np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(columns.detections[name], dtype=dtype))
+            os.replace(tmp_dir, self._analysis_dir(analysis_id))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def frame_counts(self, analysis_id: int) -> Optional[np.ndarray]:
+        """Cows per analyzed frame (memory-mapped), None if not stored"""
+        path = self._analysis_dir(analysis_id) / "cows_count.npy"
+        return np.load(path, mmap_mode="r") if path.exists() else None
+
+    def load_window(
+        self,
+        analysis_id: int,
+        start: Optional[float] = None,
+        end: Optional[float] = None
+    ) -> DetectionColumns:
+        """
+        Load frames with start <= timestamp <= end (open bounds if None)
+        Only the requested rows are read from disk
+        """
+        analysis_dir = self._analysis_dir(analysis_id)
+
+        def column(name: str) -> np.ndarray:
+            return np.load(analysis_dir / f"{name}.npy", mmap_mode="r")
+
+        timestamps = column("timestamp")
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="right"))
+        hi = max(lo, hi)
+
+        offset = np.array(column("offset")[lo:hi + 1])
+        det_lo, det_hi = int(offset[0]), int(offset[-1])
+
+        frames = {
+            "timestamp": np.array(timestamps[lo:hi]),
+            "frame_number": np.array(column("frame_number")[lo:hi]),
+            "cows_count": np.array(column("cows_count")[lo:hi]),
+            "offset": offset - det_lo,
+        }
+        detections = {
+            name: np.array(column(name)[det_lo:det_hi])
+            for name in DETECTION_COLUMNS
+        }
+        return DetectionColumns(frames, detections)
+
+    def delete(self, analysis_id: int) -> bool:
+        """Delete stored columns of analysis"""
+        analysis_dir = self._analysis_dir(analysis_id)
+        if analysis_dir.exists():
+            shutil.rmtree(analysis_dir)
+            return True
+        return False
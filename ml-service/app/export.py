@@ -0,0 +1,195 @@
+"""
+Bulk export of recognition history as CSV or Parquet
+
+Rows are read from the database in chunks (see
+RecognitionRepository.iter_export) and each chunk is encoded and sent before
+the next one is fetched, so memory stays flat however large the history is.
+With detections, there is one row per detection (recognitions without cows
+get one row with empty detection fields).
+
+Rows come in id order. An interrupted export is resumed with
+`cursor=<id of the last complete recognition received>`.
+
+Parquet needs pyarrow; without it only CSV is offered.
+"""
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+import csv
+import io
+import os
+
+# Optional Parquet support
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None  # Parquet export is optional
+
+from .database import SessionLocal
+from .repositories import RecognitionRepository
+
+CSV = "csv"
+PARQUET = "parquet"
+
+MEDIA_TYPES = {
+    CSV: "text/csv",
+    PARQUET: "application/vnd.apache.parquet",
+}
+
+# Rows per database fetch / encoded chunk
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+# Rows per query (bounds how long one read transaction stays open)
+EXPORT_WINDOW_ROWS = int(os.getenv("EXPORT_WINDOW_ROWS", "50000"))
+
+RECOGNITION_FIELDS = ["id", "created_at", "image_path", "cows_count"]
+DETECTION_FIELDS = ["detection_index", "class", "confidence", "x1", "y1", "x2", "y2"]
+
+
+def available_formats() -> List[str]:
+    """Export formats this server can produce"""
+    return [CSV, PARQUET] if pa is not None else [CSV]
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC; convert aware filter values"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def fields(detections: bool) -> List[str]:
+    return RECOGNITION_FIELDS + DETECTION_FIELDS if detections else RECOGNITION_FIELDS
+
+
+def flatten(chunk: list, detections: bool) -> List[tuple]:
+    """Export rows of a chunk of (id, created_at, image_path, cows_count[, result]) tuples"""
+    if not detections:
+        return [tuple(row) for row in chunk]
+    rows = []
+    empty = (None,) * len(DETECTION_FIELDS)
+    for recognition_id, created_at, image_path, cows_count, result in chunk:
+        base = (recognition_id, created_at, image_path, cows_count)
+        if not result:
+            rows.append(base + empty)
+            continue
+        for i, det in enumerate(result):
+            bbox = det["bbox"]
+            rows.append(base + (
+                i, det.get("class"), det["confidence"], bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"]
+            ))
+    return rows
+
+
+def encode_csv(chunks: Iterator[list], detections: bool) -> Iterator[bytes]:
+    """CSV with header row, one encoded piece per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields(detections))
+    for chunk in chunks:
+        for row in flatten(chunk, detections):
+            writer.writerow(
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in row
+            )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object collecting bytes until taken"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _parquet_schema(detections: bool):
+    schema = [
+        ("id", pa.int64()),
+        ("created_at", pa.timestamp("us")),
+        ("image_path", pa.string()),
+        ("cows_count", pa.int32()),
+    ]
+    if detections:
+        schema += [
+            ("detection_index", pa.int32()),
+            ("class", pa.string()),
+            ("confidence", pa.float32()),
+            ("x1", pa.float32()),
+            ("y1", pa.float32()),
+            ("x2", pa.float32()),
+            ("y2", pa.float32()),
+        ]
+    return pa.schema(schema)
+
+
+def encode_parquet(chunks: Iterator[list], detections: bool) -> Iterator[bytes]:
+    """Parquet file written as one row group per chunk"""
+    schema = _parquet_schema(detections)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for chunk in chunks:
+            rows = flatten(chunk, detections)
+            columns = list(zip(*rows)) if rows else [[] for _ in schema.names]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def export_recognitions(
+    export_format: str,
+    detections: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cursor: int = 0
+) -> Iterator[bytes]:
+    """
+    Encoded export of recognitions with id > cursor in [start, end)
+    Uses its own session: the body is produced after the request handler returns
+    """
+    db = SessionLocal()
+    try:
+        chunks = RecognitionRepository(db).iter_export(
+            start=naive_utc(start),
+            end=naive_utc(end),
+            after_id=cursor,
+            with_result=detections,
+            chunk_size=EXPORT_CHUNK_ROWS,
+            window=EXPORT_WINDOW_ROWS
+        )
+        encode = encode_parquet if export_format == PARQUET else encode_csv
+        yield from encode(chunks, detections)
+    finally:
+        db.close()
@@ -0,0 +1,255 @@
+"""
+File responses with full HTTP Range support
+
+- single, suffix (bytes=-N), open-ended (bytes=N-) and multi-range requests
+  (multipart/byteranges), 416 for unsatisfiable ranges
+- ETag / Last-Modified validators, If-Range, If-None-Match (304)
+- content type from file extension
+- zero-copy: uses the ASGI "http.response.zerocopysend" extension (sendfile)
+  when the server offers it, otherwise large pread() chunks in a worker thread
+"""
+from email.utils import formatdate, parsedate_to_datetime
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from typing import List, Optional, Tuple
+import mimetypes
+import os
+import uuid
+
+# Read size for the fallback (non-sendfile) path
+CHUNK_SIZE = 1024 * 1024
+
+# More ranges than this are answered with the whole file (abuse protection)
+MAX_RANGES = 16
+
+# Video types missing from some platform mimetypes tables
+mimetypes.add_type("video/mp4", ".mp4")
+mimetypes.add_type("video/webm", ".webm")
+mimetypes.add_type("video/x-matroska", ".mkv")
+mimetypes.add_type("video/quicktime", ".mov")
+mimetypes.add_type("video/x-msvideo", ".avi")
+
+
+def guess_media_type(path: str) -> str:
+    """Content type from file extension"""
+    media_type, _ = mimetypes.guess_type(path)
+    return media_type or "application/octet-stream"
+
+
+def parse_range(header: str, file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse Range header into sorted, merged list of inclusive (start, end) pairs
+    Returns None if header is malformed (range is ignored),
+    empty list if no range is satisfiable (416)
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start_text, dash, end_text = part.partition("-")
+        if not dash:
+            return None
+        try:
+            if not start_text:
+                # Suffix range: last N bytes
+                suffix = int(end_text)
+                if suffix <= 0:
+                    continue
+                start, end = max(0, file_size - suffix), file_size - 1
+            else:
+                start = int(start_text)
+                if end_text:
+                    end = int(end_text)
+                    if start > end:
+                        return None
+                    end = min(end, file_size - 1)
+                else:
+                    end = file_size - 1
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start < file_size:
+            ranges.append((start, end))
+
+    # Merge overlapping / adjacent ranges
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    Response serving a file with Range / conditional request support
+    Status and headers are decided per request when the response is sent
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        request_headers: Headers,
+        method: str = "GET",
+        media_type: Optional[str] = None,
+        cache_control: Optional[str] = None
+    ):
+        # Like starlette's FileResponse, the base initializer is not used: there is no in-memory body
+        self.status_code = 200
+        self.background = None
+        self.path = os.fspath(path)
+        self.request_headers = request_headers
+        self.send_body = method != "HEAD"
+        self.media_type = media_type or guess_media_type(self.path)
+        self.cache_control = cache_control
+
+        stat = os.stat(self.path)
+        self.file_size = stat.st_size
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.mtime = int(stat.st_mtime)
+
+    def _base_headers(self) -> List[Tuple[bytes, bytes]]:
+        headers = [
+            (b"accept-ranges", b"bytes"),
+            (b"etag", self.etag.encode()),
+            (b"last-modified", self.last_modified.encode()),
+        ]
+        if self.cache_control:
+            headers.append((b"cache-control", self.cache_control.encode()))
+        return headers
+
+    def _if_range_matches(self) -> bool:
+        """If-Range holds an ETag or a date; Range applies only if it still matches"""
+        if_range = self.request_headers.get("if-range")
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # Weak validators never match for ranges
+            return if_range == self.etag
+        try:
+            return int(parsedate_to_datetime(if_range).timestamp()) == self.mtime
+        except (TypeError, ValueError):
+            return False
+
+    def _not_modified(self) -> bool:
+        if_none_match = self.request_headers.get("if-none-match")
+        if if_none_match is None:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags or f"W/{self.etag}" in tags
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self._respond(scope, send)
+        if self.background is not None:
+            await self.background()
+
+    async def _respond(self, scope: Scope, send: Send) -> None:
+        headers = self._base_headers()
+
+        if self._not_modified():
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        ranges = None
+        range_header = self.request_headers.get("range")
+        if range_header and self._if_range_matches():
+            ranges = parse_range(range_header, self.file_size)
+            if ranges is not None and len(ranges) > MAX_RANGES:
+                ranges = None
+
+        if ranges == []:
+            headers += [
+                (b"content-range", f"bytes */{self.file_size}".encode()),
+                (b"content-length", b"0"),
+            ]
+            await send({"type": "http.response.start", "status": 416, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if not ranges:
+            await self._send_parts(scope, send, 200, headers, [(None, 0, self.file_size)])
+            return
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers.append((b"content-range", f"bytes {start}-{end}/{self.file_size}".encode()))
+            await self._send_parts(scope, send, 206, headers, [(None, start, end - start + 1)])
+            return
+
+        # Several ranges: multipart/byteranges
+        boundary = uuid.uuid4().hex
+        parts = []
+        for start, end in ranges:
+            part_header = (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{self.file_size}\r\n\r\n"
+            ).encode()
+            parts.append((part_header, start, end - start + 1))
+        parts.append((f"\r\n--{boundary}--\r\n".encode(), 0, 0))
+        await self._send_parts(scope, send, 206, headers, parts, f"multipart/byteranges; boundary={boundary}")
+
+    async def _send_parts(
+        self,
+        scope: Scope,
+        send: Send,
+        status: int,
+        headers: List[Tuple[bytes, bytes]],
+        parts: List[Tuple[Optional[bytes], int, int]],
+        content_type: Optional[str] = None
+    ) -> None:
+        """Send (prefix, offset, count) parts of file as one response body"""
+        content_length = sum(len(prefix or b"") + count for prefix, _, count in parts)
+        headers = headers + [
+            (b"content-type", (content_type or self.media_type).encode()),
+            (b"content-length", str(content_length).encode()),
+        ]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+
+        if not self.send_body or content_length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        with open(self.path, "rb") as file:
+            fd = file.fileno()
+            for index, (prefix, offset, count) in enumerate(parts):
+                last_part = index == len(parts) - 1
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": not (last_part and count == 0)})
+                if count == 0:
+                    continue
+                if zerocopy:
+                    # Server copies file -> socket in kernel (sendfile)
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": offset,
+                        "count": count,
+                        "more_body": not last_part,
+                    })
+                    continue
+                remaining = count
+                while remaining > 0:
+                    chunk = await run_in_threadpool(os.pread, fd, min(CHUNK_SIZE, remaining), offset)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0 or not last_part})
+                if remaining > 0:
+                    # File shrank while sending; end body so the connection is not left hanging
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+                    return
@@ -0,0 +1,594 @@
+"""
+Multi-process inference server with a shared-memory frame transport
+
+    python manage.py inference-server --workers 4
+    INFERENCE_SERVER=/tmp/cowcount-inference.sock uvicorn main:app --workers 2
+
+The server runs a pool of worker processes, each with its own model, sized to
+the CPU count independently of the API workers. API processes (with
+INFERENCE_SERVER set) load no model: each connects over a Unix socket and
+creates a ring of shared-memory frame slots. A decoded frame is copied once
+into a free slot and only a small header (request id, slot, shape) crosses the
+socket; workers map the same memory and run YOLO on it in place. Results come
+back as packed (N, 5) float32 detections. Frames larger than a slot travel in
+a one-off shared memory segment.
+
+The server hands each frame to the least busy worker and keeps track of the
+frames every worker holds. A worker that dies is restarted, and its frames
+are answered with an error. A client that gives up on a request keeps the
+frame slot out of use until the server answers it or the connection is reset.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from fastapi import HTTPException
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from .services import YOLOService
+from .cpu_tuning import CPUSettings, load_settings
+from .scheduling import PriorityScheduler
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Socket of inference server; API processes use the server when set
+INFERENCE_SERVER = os.getenv("INFERENCE_SERVER")
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/cowcount-inference.sock")
+
+# Frame slots per API process and size of each slot (1080p RGB by default)
+INFERENCE_SLOTS = int(os.getenv("INFERENCE_SLOTS", "8"))
+INFERENCE_SLOT_BYTES = int(os.getenv("INFERENCE_SLOT_BYTES", str(1920 * 1080 * 3)))
+
+# Seconds to wait for a detection result / for a free frame slot (503 after that)
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "60"))
+INFERENCE_SLOT_TIMEOUT = float(os.getenv("INFERENCE_SLOT_TIMEOUT", "10"))
+
+# Shared memory segments kept mapped per worker process
+_ATTACHED_SEGMENTS = 64
+
+# Pause before restarting a dead worker; doubles while it dies before getting ready
+_RESTART_DELAY = 1.0
+_RESTART_DELAY_MAX = 60.0
+
+# Wire format: every message is length-prefixed
+_LENGTH = struct.Struct("<I")
+# request id, slot (-1: one-off segment named in payload), height, width, channels
+_REQUEST = struct.Struct("<IiIIB")
+# request id, status (0 ok, 1 error), detections; payload: float32 (N, 5) or error text
+_RESPONSE = struct.Struct("<IBI")
+
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+
+
+def _frame_message(payload: bytes) -> bytes:
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Inference server closed connection")
+        received += count
+    return bytes(buffer)
+
+
+def _recv_message(sock: socket.socket) -> bytes:
+    (size,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return _recv_exactly(sock, size)
+
+
+async def _read_message(reader: asyncio.StreamReader) -> bytes:
+    (size,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return await reader.readexactly(size)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Map segment created by another process without taking ownership of it"""
+    segment = shared_memory.SharedMemory(name=name)
+    # Creator unlinks the segment; keep the resource tracker from doing it too
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def _close(segment: shared_memory.SharedMemory) -> None:
+    try:
+        segment.close()
+    except BufferError:
+        pass  # a result still references the frame; mapping is released with it
+
+
+# Worker processes
+
+def _worker_main(weights: str, settings: Dict, worker_index: int, workers: int, tasks, results) -> None:
+    """Inference worker: run model on frames referenced by tasks until None is received"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # server process handles Ctrl+C
+    try:
+        CPUSettings.from_dict(settings).apply(worker_index, workers)
+        yolo_service = YOLOService(weights)
+        yolo_service.warmup()
+    except Exception as e:
+        results.put(("error", worker_index, str(e)))
+        return
+    results.put(("ready", worker_index, yolo_service.cow_class_name))
+
+    segments: "OrderedDict[str, shared_memory.SharedMemory]" = OrderedDict()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        conn_id, request_id, name, offset, shape, transient = task
+        segment = None
+        try:
+            segment = segments.get(name) if not transient else None
+            if segment is None:
+                segment = _attach(name)
+                if not transient:
+                    segments[name] = segment
+                    if len(segments) > _ATTACHED_SEGMENTS:
+                        _close(segments.popitem(last=False)[1])
+            else:
+                segments.move_to_end(name)
+            frame = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf, offset=offset)
+            boxes = yolo_service.detect_array(frame)
+            del frame
+            response = _RESPONSE.pack(request_id, _STATUS_OK, len(boxes)) + boxes.astype(np.float32, copy=False).tobytes()
+        except Exception as e:
+            response = _RESPONSE.pack(request_id, _STATUS_ERROR, 0) + str(e).encode()
+        finally:
+            if transient and segment is not None:
+                _close(segment)
+        results.put(("result", worker_index, conn_id, request_id, response))
+
+    for segment in segments.values():
+        _close(segment)
+
+
+class InferenceServer:
+    """
+    Pool of inference worker processes behind a Unix socket
+    """
+
+    def __init__(
+        self,
+        socket_path: str = INFERENCE_SOCKET,
+        workers: int = 0,
+        weights: str = "yolov8n.pt",
+        settings: Optional[CPUSettings] = None
+    ):
+        self.socket_path = socket_path
+        # Worker thread / affinity settings, tuned for throughput unless configured otherwise
+        self.settings = settings or load_settings("throughput")
+        self.workers = workers or self.settings.workers or os.cpu_count() or 1
+        self.weights = weights
+        self._clients: Dict[int, asyncio.StreamWriter] = {}
+        self._conn_ids = itertools.count(1)
+        self._stopping = False
+        # Per worker: process, task queue, ready flag, (conn id, request id) of frames it holds
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * self.workers
+        self._task_queues: List = [None] * self.workers
+        self._ready = [False] * self.workers
+        self._inflight: List[Set[Tuple[int, int]]] = [set() for _ in range(self.workers)]
+        self._restart_delay = [_RESTART_DELAY] * self.workers
+
+    def serve(self) -> None:
+        """Start workers and serve clients until SIGINT / SIGTERM"""
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._loop = asyncio.get_running_loop()
+        # Resolved once every worker has loaded its model
+        self._started = self._loop.create_future()
+        pump = threading.Thread(target=self._pump_results, name="inference-results", daemon=True)
+        pump.start()
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        server = None
+        try:
+            await self._started
+            logger.info(f"{self.workers} inference workers ready")
+
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+            logger.info(f"Inference server listening on {self.socket_path}")
+
+            stop = asyncio.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self._loop.add_signal_handler(signum, stop.set)
+            await stop.wait()
+        finally:
+            self._stopping = True
+            if server is not None:
+                server.close()
+            for writer in list(self._clients.values()):
+                writer.close()
+            if server is not None:
+                await server.wait_closed()
+            for index, process in enumerate(self._processes):
+                if process is not None:
+                    self._loop.remove_reader(process.sentinel)
+                    self._task_queues[index].put(None)
+            for process in self._processes:
+                if process is not None:
+                    process.join(timeout=10)
+                    if process.is_alive():
+                        process.terminate()
+            self._results.put(None)
+            if server is not None and os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _start_worker(self, index: int) -> None:
+        if self._stopping:
+            return
+        tasks = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.weights, self.settings.to_dict(), index, self.workers, tasks, self._results),
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._task_queues[index] = tasks
+        self._ready[index] = False
+        # Sentinel becomes readable when the process ends
+        self._loop.add_reader(process.sentinel, self._worker_exited, index, process)
+
+    def _worker_exited(self, index: int, process: multiprocessing.Process) -> None:
+        """Answer the frames of a dead worker with errors and restart it"""
+        self._loop.remove_reader(process.sentinel)
+        process.join()
+        if self._stopping or self._processes[index] is not process:
+            return
+        delay = self._restart_delay[index]
+        if not self._ready[index]:
+            # Died while loading: back off
+            self._restart_delay[index] = min(delay * 2, _RESTART_DELAY_MAX)
+        logger.error(f"Inference worker {index} exited with code {process.exitcode}, restarting in {delay:g}s")
+        self._ready[index] = False
+        self._processes[index] = None
+        lost, self._inflight[index] = self._inflight[index], set()
+        for conn_id, request_id in lost:
+            self._reply(conn_id, _RESPONSE.pack(request_id, _STATUS_ERROR, 0) + b"Inference worker died")
+        # Unread tasks of the dead worker were answered above
+        self._task_queues[index].cancel_join_thread()
+        self._task_queues[index].close()
+        self._task_queues[index] = None
+        self._loop.call_later(delay, self._start_worker, index)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        conn_id = next(self._conn_ids)
+        try:
+            hello = json.loads(await _read_message(reader))
+            ring, slot_bytes = hello["ring"], hello["slot_bytes"]
+            writer.write(_frame_message(json.dumps({
+                "workers": self.workers,
+                "cow_class_name": self.cow_class_name,
+                "model": Path(self.weights).stem
+            }).encode()))
+            self._clients[conn_id] = writer
+
+            while True:
+                message = await _read_message(reader)
+                request_id, slot, height, width, channels = _REQUEST.unpack_from(message)
+                if slot >= 0:
+                    name, offset = ring, slot * slot_bytes
+                else:
+                    name, offset = message[_REQUEST.size:].decode(), 0
+                self._dispatch((conn_id, request_id, name, offset, (height, width, channels), slot < 0))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.pop(conn_id, None)
+            writer.close()
+
+    def _dispatch(self, task: Tuple) -> None:
+        """Queue task on the ready worker holding the fewest frames"""
+        conn_id, request_id = task[0], task[1]
+        ready = [index for index in range(self.workers) if self._ready[index]]
+        if not ready:
+            self._reply(conn_id, _RESPONSE.pack(request_id, _STATUS_ERROR, 0) + b"No inference worker available")
+            return
+        index = min(ready, key=lambda i: len(self._inflight[i]))
+        self._inflight[index].add((conn_id, request_id))
+        self._task_queues[index].put(task)
+
+    def _pump_results(self) -> None:
+        # Thread: hand worker messages to the event loop
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            self._loop.call_soon_threadsafe(self._on_worker_message, *item)
+
+    def _on_worker_message(self, kind: str, index: int, *args) -> None:
+        if kind == "ready":
+            self.cow_class_name = args[0]
+            self._ready[index] = True
+            self._restart_delay[index] = _RESTART_DELAY
+            if not self._started.done() and all(self._ready):
+                self._started.set_result(None)
+        elif kind == "error":
+            if not self._started.done():
+                self._started.set_exception(RuntimeError(f"Inference worker failed to start: {args[0]}"))
+            else:
+                logger.error(f"Inference worker {index} failed to start: {args[0]}")
+        else:
+            conn_id, request_id, response = args
+            key = (conn_id, request_id)
+            # Not held any more: already answered when the worker was declared dead
+            if key in self._inflight[index]:
+                self._inflight[index].discard(key)
+                self._reply(conn_id, response)
+
+    def _reply(self, conn_id: int, response: bytes) -> None:
+        writer = self._clients.get(conn_id)
+        if writer is not None and not writer.is_closing():
+            writer.write(_frame_message(response))
+
+
+# API side
+
+class RemoteYOLOService(YOLOService):
+    """
+    YOLOService running inference on an InferenceServer
+    Same detection methods and outputs as the in-process model
+    """
+
+    def __init__(
+        self,
+        socket_path: str = INFERENCE_SOCKET,
+        slots: int = INFERENCE_SLOTS,
+        slot_bytes: int = INFERENCE_SLOT_BYTES,
+        timeout: float = INFERENCE_TIMEOUT
+    ):
+        self.socket_path = socket_path
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self.ring = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._free_slots: List[int] = list(range(slots))
+        self._slots_available = threading.Condition()
+        self._pending: Dict[int, Future] = {}
+        # request id -> slot of requests given up on; the slot is free once the server answers
+        self._abandoned: Dict[int, int] = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self.cow_class_name = "cow"
+        self.name = "inference-server"
+        self.server_workers = 1
+        self._connect()
+        # One run per server worker at a time: the backlog waits here, ordered by priority
+        self.scheduler = PriorityScheduler(self.server_workers)
+
+    def _connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        sock.sendall(_frame_message(json.dumps({"ring": self.ring.name, "slot_bytes": self.slot_bytes}).encode()))
+        info = json.loads(_recv_message(sock))
+        self.cow_class_name = info["cow_class_name"]
+        self.name = info.get("model", self.name)
+        self.server_workers = info["workers"]
+        self._sock = sock
+        threading.Thread(target=self._read_responses, args=(sock,), name="inference-client", daemon=True).start()
+        logger.info(f"Connected to inference server {self.socket_path} ({info['workers']} workers)")
+
+    def _read_responses(self, sock: socket.socket) -> None:
+        # Thread: resolve pending requests with results from server
+        try:
+            while True:
+                message = _recv_message(sock)
+                request_id, status, count = _RESPONSE.unpack_from(message)
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                    abandoned_slot = self._abandoned.pop(request_id, None) if future is None else None
+                if future is None:
+                    if abandoned_slot is not None:
+                        self._release_slot(abandoned_slot)
+                    continue
+                payload = message[_RESPONSE.size:]
+                if status == _STATUS_OK:
+                    future.set_result(np.frombuffer(payload, dtype=np.float32).reshape(count, 5))
+                else:
+                    future.set_exception(RuntimeError(f"Inference failed: {payload.decode()}"))
+        except (ConnectionError, OSError) as e:
+            with self._send_lock:
+                if self._sock is sock:
+                    self._sock = None
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+                abandoned, self._abandoned = self._abandoned, {}
+            # The server forgets requests of a closed connection: their slots are free again
+            for slot in abandoned.values():
+                self._release_slot(slot)
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Inference server connection lost: {e}"))
+
+    def _acquire_slot(self) -> int:
+        """Free frame slot; 503 if none frees up within INFERENCE_SLOT_TIMEOUT"""
+        with self._slots_available:
+            if not self._slots_available.wait_for(lambda: self._free_slots, timeout=INFERENCE_SLOT_TIMEOUT):
+                raise HTTPException(
+                    status_code=503,
+                    detail="Inference server is not answering, try again later",
+                    headers={"Retry-After": "10"}
+                )
+            return self._free_slots.pop()
+
+    def _release_slot(self, slot: int) -> None:
+        with self._slots_available:
+            self._free_slots.append(slot)
+            self._slots_available.notify()
+
+    def _submit(self, frame: np.ndarray) -> Tuple[int, int, Future, Optional[shared_memory.SharedMemory]]:
+        """Send frame (H, W, 3 uint8) to server; returns (request id, slot, future, one-off segment) for _wait"""
+        height, width, channels = frame.shape
+        slot, segment = -1, None
+        if frame.nbytes <= self.slot_bytes:
+            slot = self._acquire_slot()
+            target = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.ring.buf, offset=slot * self.slot_bytes)
+            name = b""
+        else:
+            segment = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+            target = np.ndarray(frame.shape, dtype=np.uint8, buffer=segment.buf)
+            name = segment.name.encode()
+
+        request_id = next(self._request_ids) & 0xFFFFFFFF
+        future: Future = Future()
+        if slot >= 0:
+            # Slot is reused only after the server answered (or the connection is gone)
+            future.add_done_callback(lambda _: self._release_slot(slot))
+        try:
+            target[...] = frame
+            del target
+            with self._pending_lock:
+                self._pending[request_id] = future
+            try:
+                with self._send_lock:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(_frame_message(_REQUEST.pack(request_id, slot, height, width, channels) + name))
+            except OSError as e:
+                with self._pending_lock:
+                    self._pending.pop(request_id, None)
+                future.set_exception(ConnectionError(f"Cannot reach inference server: {e}"))
+        except BaseException:
+            # Not sent: free the slot (done callback) and the segment
+            target = None
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            future.cancel()
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            raise
+        return request_id, slot, future, segment
+
+    def _wait(
+        self,
+        request_id: int,
+        slot: int,
+        future: Future,
+        segment: Optional[shared_memory.SharedMemory]
+    ) -> np.ndarray:
+        """Result of a submitted frame (TimeoutError after INFERENCE_TIMEOUT)"""
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._forget(request_id, slot)
+            raise
+        finally:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+
+    def _forget(self, request_id: int, slot: int) -> None:
+        """Stop waiting for a request; the server may yet read its slot, so it stays out of use until answered"""
+        with self._pending_lock:
+            if self._pending.pop(request_id, None) is not None and slot >= 0:
+                self._abandoned[request_id] = slot
+
+    def _run(self, frame: np.ndarray) -> np.ndarray:
+        """Send frame (H, W, 3 uint8) to server and wait for (N, 5) detections"""
+        return self._wait(*self._submit(frame))
+
+    def _remote_boxes(self, frame: np.ndarray) -> np.ndarray:
+        """Inference on server, tracked like local inference"""
+        metrics.INFERENCE_QUEUE_DEPTH.inc()
+        try:
+            with self.scheduler.slot(), metrics.stage(metrics.INFERENCE):
+                return self._run(np.ascontiguousarray(frame, dtype=np.uint8))
+        finally:
+            metrics.INFERENCE_QUEUE_DEPTH.dec()
+
+    def detect_array(self, image) -> np.ndarray:
+        """
+        Detect cows in image (PIL image or RGB numpy array) on inference server
+        Returns: float32 array of shape (N, 5) with columns confidence, x1, y1, x2, y2
+        """
+        if isinstance(image, Image.Image):
+            return self._remote_boxes(self._pil_to_array(image))
+        return self._remote_boxes(image)
+
+    def infer_batch(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        All frames are sent before waiting, so server workers run them in parallel; results are cow boxes
+        Holds one scheduler slot for the batch, like a local batched model run
+        """
+        submitted = []
+        waited = 0
+        metrics.INFERENCE_QUEUE_DEPTH.inc()
+        try:
+            with self.scheduler.slot(), metrics.stage(metrics.INFERENCE):
+                for image in images:
+                    submitted.append(self._submit(np.ascontiguousarray(image, dtype=np.uint8)))
+                results = []
+                for request in submitted:
+                    waited += 1
+                    results.append(self._wait(*request))
+                return results
+        finally:
+            metrics.INFERENCE_QUEUE_DEPTH.dec()
+            # Failed part way: give up on the frames not waited for
+            for request_id, slot, _, segment in submitted[waited:]:
+                self._forget(request_id, slot)
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+
+    def result_boxes(self, result: np.ndarray) -> np.ndarray:
+        return result
+
+    def detect_cows(self, image: Image.Image) -> Tuple[List[dict], int]:
+        """
+        Detect cows in image on inference server
+        Returns: (detections, cows_count)
+        """
+        boxes = self._remote_boxes(self._pil_to_array(image))
+        with metrics.stage(metrics.POSTPROCESS):
+            detections = self.to_dicts(boxes)
+        return detections, len(detections)
+
+    def warmup(self, size: int = 640) -> None:
+        """Round trip through the server (workers warm up their models on start)"""
+        start = time.perf_counter()
+        self._run(np.zeros((size, size, 3), dtype=np.uint8))
+        self.scheduler.record_run(time.perf_counter() - start)
+
+    @staticmethod
+    def _pil_to_array(image: Image.Image) -> np.ndarray:
+        # ultralytics converts PIL images to BGR arrays; do the same so results match
+        return np.asarray(image.convert("RGB"))[:, :, ::-1]
+
+    def close(self) -> None:
+        """Disconnect and free frame ring"""
+        with self._send_lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+        self.ring.close()
+        self.ring.unlink()
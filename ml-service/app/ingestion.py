@@ -0,0 +1,439 @@
+"""
+Server-side ingestion of camera streams
+
+Each configured source (an RTSP/HTTP URL, or a local video file standing in
+for a camera) gets a reader thread and a processing task:
+
+    reader thread --latest sampled frame--> processing task --> subscribers
+    (cv2.VideoCapture)                      (shared model)     (WebSocket, storage)
+
+The reader keeps grabbing frames so the stream buffer never backs up, and
+hands over one frame per 1/fps seconds. Only the newest frame is kept: when
+the model is slower than the sampling rate, older frames are dropped
+("stale") instead of queueing. Files are read at their own frame rate, like
+a live camera, and restart at the end when `loop` is set. Lost connections
+are retried with exponential backoff up to INGEST_BACKOFF_MAX seconds.
+
+Detections go to WebSocket subscribers of /stream/sources/{name}. Every
+`store_interval` seconds a frame is saved as a regular recognition (history,
+stats, rollups). Sources come from INGEST_SOURCES ("yard=rtsp://...,barn=
+/videos/barn.mp4") and/or the JSON list in INGEST_SOURCES_FILE:
+
+    [{"name": "yard", "url": "rtsp://...", "fps": 2, "store_interval": 60, "loop": true}]
+
+A source only analyzes its stored region of interest (roi.py), found under
+the source name or the name given as "roi"; changes apply within
+ROI_CACHE_SECONDS.
+
+Only one API process ingests (file lock); others report it as running elsewhere.
+"""
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .admission import admission
+from .cache import RECOGNITIONS, response_cache
+from .database import SessionLocal
+from .model import current as current_model
+from .roi import rois
+from .write_behind import recognition_writer
+from .repositories import RecognitionRepository
+from . import metrics, scheduling, storage
+
+logger = logging.getLogger(__name__)
+
+INGEST_SOURCES = os.getenv("INGEST_SOURCES", "")
+INGEST_SOURCES_FILE = Path(os.getenv("INGEST_SOURCES_FILE", "./data/ingest_sources.json"))
+
+# Defaults for sources that do not set their own
+INGEST_FPS = float(os.getenv("INGEST_FPS", "2"))
+INGEST_STORE_INTERVAL = float(os.getenv("INGEST_STORE_INTERVAL", "60"))
+
+# Reconnect backoff bounds (seconds)
+INGEST_BACKOFF_MIN = 1.0
+INGEST_BACKOFF_MAX = float(os.getenv("INGEST_BACKOFF_MAX", "30"))
+
+INGEST_LOCK = Path(os.getenv("INGEST_LOCK", "./data/ingest.lock"))
+
+# Messages buffered per subscriber; a slow client loses the oldest
+SUBSCRIBER_QUEUE_SIZE = 8
+
+# Stream open/read timeouts (also bound how long shutdown waits for a reader)
+INGEST_TIMEOUT_MS = int(os.getenv("INGEST_TIMEOUT_MS", "10000"))
+
+# Frame rate assumed for files that do not report one
+DEFAULT_FILE_FPS = 25.0
+
+STARTING = "starting"
+CONNECTED = "connected"
+RECONNECTING = "reconnecting"
+FINISHED = "finished"
+STOPPED = "stopped"
+
+_URL = re.compile(r"^[a-z][a-z0-9+.-]*://", re.IGNORECASE)
+_CREDENTIALS = re.compile(r"(://[^:/@]+):[^@/]*@")
+_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class SourceConfig:
+    """
+    One ingestion source
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        fps: float = INGEST_FPS,
+        store_interval: float = INGEST_STORE_INTERVAL,
+        loop: bool = True,
+        roi: Optional[str] = None
+    ):
+        if not _NAME.match(name):
+            raise ValueError(f"Invalid source name: {name!r}")
+        self.name = name
+        self.url = url
+        self.fps = max(0.01, fps)
+        self.store_interval = store_interval
+        self.loop = loop
+        # Stored region of interest (defaults to the source name)
+        self.roi = roi or name
+
+    @property
+    def is_file(self) -> bool:
+        return not _URL.match(self.url)
+
+    @property
+    def display_url(self) -> str:
+        """URL with password masked"""
+        return _CREDENTIALS.sub(r"\1:***@", self.url)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SourceConfig":
+        return cls(
+            name=data["name"],
+            url=data["url"],
+            fps=float(data.get("fps", INGEST_FPS)),
+            store_interval=float(data.get("store_interval", INGEST_STORE_INTERVAL)),
+            loop=bool(data.get("loop", True)),
+            roi=data.get("roi")
+        )
+
+
+def load_sources() -> List[SourceConfig]:
+    """Sources from INGEST_SOURCES_FILE and INGEST_SOURCES (later names win)"""
+    sources: Dict[str, SourceConfig] = {}
+    if INGEST_SOURCES_FILE.exists():
+        for data in json.loads(INGEST_SOURCES_FILE.read_text()):
+            source = SourceConfig.from_dict(data)
+            sources[source.name] = source
+    for part in INGEST_SOURCES.split(","):
+        name, _, url = part.strip().partition("=")
+        if name and url:
+            sources[name] = SourceConfig(name, url)
+    return list(sources.values())
+
+
+class SourceWorker:
+    """
+    Reader thread and processing task of one source
+    """
+
+    def __init__(self, config: SourceConfig):
+        self.config = config
+        self.state = STARTING
+        self.frame_number = 0
+        self.last_cows_count: Optional[int] = None
+        self.last_processed_at: Optional[float] = None
+        self._frame_interval = 0.0
+        self.reconnects = 0
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._latest: Optional[Tuple[float, np.ndarray]] = None
+        self._ready = asyncio.Event()
+        self._stop = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_store = 0.0
+        name = config.name
+        self._captured = metrics.INGEST_FRAMES.labels(name, "captured")
+        self._sampled = metrics.INGEST_FRAMES.labels(name, "sampled")
+        self._processed = metrics.INGEST_FRAMES.labels(name, "processed")
+        self._connected = metrics.INGEST_CONNECTED.labels(name)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._read, name=f"ingest-{self.config.name}", daemon=True)
+        self._thread.start()
+        self._task = asyncio.create_task(self._process())
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._thread:
+            await run_in_threadpool(self._thread.join)
+        self._set_state(STOPPED)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self._connected.set(1 if state == CONNECTED else 0)
+
+    def _read(self) -> None:
+        # Thread: connect, grab and sample frames, reconnect with backoff
+        backoff = INGEST_BACKOFF_MIN
+        while not self._stop.is_set():
+            cap = self._open()
+            if not cap.isOpened():
+                cap.release()
+                self._reconnect_wait(backoff, "cannot open source")
+                backoff = min(backoff * 2, INGEST_BACKOFF_MAX)
+                continue
+
+            self._set_state(CONNECTED)
+            try:
+                got_frames = self._read_frames(cap)
+            finally:
+                cap.release()
+            if self._stop.is_set():
+                return
+            if got_frames:
+                backoff = INGEST_BACKOFF_MIN
+            if self.config.is_file:
+                if not self.config.loop:
+                    self._set_state(FINISHED)
+                    logger.info(f"Ingestion source {self.config.name} finished")
+                    return
+                if got_frames:
+                    # End of file: reopen from the start right away
+                    continue
+            self._reconnect_wait(backoff, "stream ended")
+            backoff = min(backoff * 2, INGEST_BACKOFF_MAX)
+
+    def _open(self) -> cv2.VideoCapture:
+        if self.config.is_file:
+            return cv2.VideoCapture(self.config.url)
+        return cv2.VideoCapture(self.config.url, cv2.CAP_FFMPEG, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, INGEST_TIMEOUT_MS,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, INGEST_TIMEOUT_MS,
+        ])
+
+    def _reconnect_wait(self, backoff: float, reason: str) -> None:
+        self._set_state(RECONNECTING)
+        self.reconnects += 1
+        metrics.INGEST_RECONNECTS.labels(self.config.name).inc()
+        logger.warning(f"Ingestion source {self.config.name}: {reason}, retrying in {backoff:.0f}s")
+        self._stop.wait(backoff)
+
+    def _read_frames(self, cap: cv2.VideoCapture) -> bool:
+        """Grab frames until the stream ends; returns whether any frame was read"""
+        interval = 1 / self.config.fps
+        file_fps = (cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FILE_FPS) if self.config.is_file else None
+        started = time.monotonic()
+        grabbed = 0
+        next_sample = started
+        while not self._stop.is_set():
+            if not cap.grab():
+                return grabbed > 0
+            grabbed += 1
+            self._captured.inc()
+            now = time.monotonic()
+            if file_fps:
+                # Play files in real time, like a camera
+                delay = started + grabbed / file_fps - now
+                if delay > 0:
+                    self._stop.wait(delay)
+                    now = time.monotonic()
+            if now < next_sample:
+                continue
+            next_sample = max(next_sample + interval, now)
+            ok, frame = cap.retrieve()
+            if ok:
+                self._sampled.inc()
+                try:
+                    self._loop.call_soon_threadsafe(self._offer, time.time(), frame)
+                except RuntimeError:
+                    # Event loop closed (shutdown)
+                    return True
+        return grabbed > 0
+
+    def _offer(self, captured_at: float, frame: np.ndarray) -> None:
+        if self._latest is not None:
+            metrics.INGEST_FRAMES_DROPPED.labels(self.config.name, "stale").inc()
+        self._latest = (captured_at, frame)
+        self._ready.set()
+
+    def _drop(self, reason: str) -> None:
+        metrics.INGEST_FRAMES_DROPPED.labels(self.config.name, reason).inc()
+
+    @staticmethod
+    def _detect(yolo_service, frame: np.ndarray, roi_name: str) -> np.ndarray:
+        roi = rois.mask(roi_name)
+        with metrics.stage(metrics.DECODE):
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if roi is not None:
+            with metrics.stage(metrics.ROI_CROP):
+                rgb_frame = roi.crop(rgb_frame)
+        boxes = yolo_service.detect_array(rgb_frame)
+        return roi.to_frame(boxes, frame.shape) if roi is not None else boxes
+
+    async def _process(self) -> None:
+        metrics.set_endpoint("ingest")
+        scheduling.set_priority(scheduling.REALTIME)
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            captured_at, frame = self._latest
+            self._latest = None
+
+            yolo_service = current_model()
+            if yolo_service is None:
+                self._drop("model_not_loaded")
+                continue
+            try:
+                with admission.admit(1, "ingest"):
+                    boxes = await run_in_threadpool(self._detect, yolo_service, frame, self.config.roi)
+            except HTTPException:
+                self._drop("busy")
+                continue
+            except Exception as e:
+                self._drop("error")
+                logger.warning(f"Ingestion source {self.config.name}: detection failed: {str(e)}")
+                continue
+
+            self._processed.inc()
+            self.frame_number += 1
+            self.last_cows_count = len(boxes)
+            now = time.time()
+            if self.last_processed_at is not None:
+                # Moving average of time between processed frames
+                elapsed = now - self.last_processed_at
+                self._frame_interval = 0.8 * self._frame_interval + 0.2 * elapsed if self._frame_interval else elapsed
+            self.last_processed_at = now
+
+            self._publish({
+                "type": "detection",
+                "source": self.config.name,
+                "frame_number": self.frame_number,
+                "cows_count": len(boxes),
+                "model": yolo_service.name,
+                "timestamp": captured_at
+            }, boxes)
+
+            if self.config.store_interval > 0 and now >= self._next_store:
+                self._next_store = now + self.config.store_interval
+                try:
+                    await run_in_threadpool(self._store, yolo_service, frame, boxes)
+                except Exception as e:
+                    logger.warning(f"Ingestion source {self.config.name}: cannot store frame: {str(e)}")
+
+    def _store(self, yolo_service, frame: np.ndarray, boxes: np.ndarray) -> None:
+        """Save frame and detections as a recognition"""
+        ok, encoded = cv2.imencode(".jpg", frame)
+        if not ok:
+            raise ValueError("cannot encode frame")
+        filename, file_path = storage.allocate(storage.UPLOAD_DIR, storage.IMAGES, ".jpg")
+        file_path.write_bytes(encoded.tobytes())
+        if recognition_writer.active:
+            recognition_writer.submit(filename, yolo_service.to_dicts(boxes), len(boxes))
+            return
+        with metrics.stage(metrics.DB_WRITE), SessionLocal() as db:
+            RecognitionRepository(db).create(filename, yolo_service.to_dicts(boxes), len(boxes))
+        response_cache.invalidate(RECOGNITIONS)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def _publish(self, meta: Dict, boxes: np.ndarray) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((meta, boxes))
+
+    def status(self) -> Dict:
+        return {
+            "name": self.config.name,
+            "url": self.config.display_url,
+            "state": self.state,
+            "fps": self.config.fps,
+            "processed_fps": round(1 / self._frame_interval, 2) if self._frame_interval else 0.0,
+            "frames_processed": self.frame_number,
+            "last_cows_count": self.last_cows_count,
+            "reconnects": self.reconnects,
+            "subscribers": len(self._subscribers),
+            "store_interval": self.config.store_interval,
+            "roi": self.config.roi,
+        }
+
+
+class IngestionManager:
+    """
+    Runs workers of all configured sources in one API process
+    """
+
+    def __init__(self):
+        self.workers: Dict[str, SourceWorker] = {}
+        self.active = False
+        self._lock_file = None
+
+    async def start(self, sources: Optional[List[SourceConfig]] = None) -> None:
+        sources = load_sources() if sources is None else sources
+        if not sources:
+            return
+        # Several API workers: the first one to start ingests
+        INGEST_LOCK.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(INGEST_LOCK, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            logger.info("Ingestion runs in another process")
+            return
+        self._lock_file = lock_file
+        self.active = True
+        for config in sources:
+            worker = SourceWorker(config)
+            worker.start()
+            self.workers[config.name] = worker
+        logger.info(f"Ingesting {len(self.workers)} source(s): {', '.join(self.workers)}")
+
+    async def stop(self) -> None:
+        for worker in self.workers.values():
+            await worker.stop()
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+        self.active = False
+
+    def get(self, name: str) -> Optional[SourceWorker]:
+        return self.workers.get(name)
+
+    def status(self) -> Dict:
+        return {
+            "active": self.active,
+            "sources": [worker.status() for worker in self.workers.values()],
+        }
+
+
+ingestion = IngestionManager()
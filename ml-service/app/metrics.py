@@ -0,0 +1,209 @@
+"""
+Prometheus metrics for the inference pipeline
+
+Stage latencies are recorded with `stage("inference")` blocks. The endpoint
+label comes from a context variable set once per request/session with
+`set_endpoint(...)`, so services deeper in the call chain need no extra
+arguments. Label children are resolved once and cached to keep the hot path
+to a perf_counter() pair and one histogram observe. Stages are also recorded
+as spans of the current request trace (see tracing.py).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+from time import perf_counter
+import os
+
+from . import tracing
+
+# Pipeline stages
+UPLOAD_READ = "upload_read"
+DECODE = "decode"
+# Cropping / masking to the region of interest (roi.py)
+ROI_CROP = "roi_crop"
+QUEUE_WAIT = "queue_wait"
+INFERENCE = "inference"
+POSTPROCESS = "postprocess"
+DB_WRITE = "db_write"
+SERIALIZE = "serialize"
+
+_endpoint: ContextVar[str] = ContextVar("metrics_endpoint", default="other")
+
+STAGE_SECONDS = Histogram(
+    "cowcount_stage_seconds",
+    "Latency of pipeline stages",
+    ["endpoint", "stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "cowcount_inference_queue_wait_seconds",
+    "Time model runs wait for a slot, by priority class",
+    ["priority"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+INFERENCE_LATENCY_SECONDS = Histogram(
+    "cowcount_inference_latency_seconds",
+    "Queue wait plus model run, by priority class",
+    ["priority"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "cowcount_inference_queue_depth",
+    "Inference calls waiting for or running on the model",
+    multiprocess_mode="livesum"
+)
+FRAMES_PROCESSED = Counter(
+    "cowcount_frames_processed_total",
+    "Frames run through the model (rate() gives frames per second)",
+    ["source"]
+)
+FRAMES_DROPPED = Counter(
+    "cowcount_frames_dropped_total",
+    "Frames received but not processed",
+    ["source", "reason"]
+)
+CLIP_FRAMES = Counter(
+    "cowcount_clip_frames_total",
+    "Annotated frames rendered into exported clips"
+)
+WEBSOCKET_SESSIONS = Gauge(
+    "cowcount_websocket_sessions_active",
+    "Open /stream/video WebSocket sessions",
+    multiprocess_mode="livesum"
+)
+ADMISSION_PENDING = Gauge(
+    "cowcount_admission_pending_runs",
+    "Model runs admitted and not yet finished (see admission.py)",
+    multiprocess_mode="livesum"
+)
+REQUESTS_SHED = Counter(
+    "cowcount_requests_shed_total",
+    "Requests rejected with 503 because the server was saturated",
+    ["endpoint"]
+)
+MODEL_SELECTED = Counter(
+    "cowcount_model_selected_total",
+    "Requests served per model (see model_router.py)",
+    ["model"]
+)
+PIPELINE_IDLE_SECONDS = Counter(
+    "cowcount_pipeline_idle_seconds",
+    "Time video pipeline stages wait for input (starved) or for downstream room (blocked)",
+    ["stage", "reason"]
+)
+STORAGE_BYTES = Gauge(
+    "cowcount_storage_bytes",
+    "Bytes of stored uploads by kind, as of the last storage collection",
+    ["kind"],
+    multiprocess_mode="max"
+)
+STORAGE_FILES = Gauge(
+    "cowcount_storage_files",
+    "Stored upload files by kind, as of the last storage collection",
+    ["kind"],
+    multiprocess_mode="max"
+)
+STORAGE_FREE_BYTES = Gauge(
+    "cowcount_storage_free_bytes",
+    "Free space on the upload volume",
+    multiprocess_mode="min"
+)
+STORAGE_DELETED = Counter(
+    "cowcount_storage_deleted_files_total",
+    "Files removed by the storage collector",
+    ["reason"]
+)
+INGEST_FRAMES = Counter(
+    "cowcount_ingest_frames_total",
+    "Frames of ingestion sources by stage: captured, sampled (sent to the model), processed",
+    ["source", "stage"]
+)
+INGEST_FRAMES_DROPPED = Counter(
+    "cowcount_ingest_frames_dropped_total",
+    "Sampled ingestion frames not processed",
+    ["source", "reason"]
+)
+INGEST_RECONNECTS = Counter(
+    "cowcount_ingest_reconnects_total",
+    "Failed connection attempts to ingestion sources",
+    ["source"]
+)
+INGEST_CONNECTED = Gauge(
+    "cowcount_ingest_connected",
+    "1 while an ingestion source is connected",
+    ["source"],
+    multiprocess_mode="max"
+)
+WRITE_BEHIND_PENDING = Gauge(
+    "cowcount_write_behind_pending",
+    "Recognitions acknowledged but not yet committed to the database",
+    multiprocess_mode="livesum"
+)
+WRITE_BEHIND_LAG_SECONDS = Gauge(
+    "cowcount_write_behind_lag_seconds",
+    "Age of the oldest uncommitted recognition (0 when the queue is empty)",
+    multiprocess_mode="max"
+)
+WRITE_BEHIND_COMMIT_DELAY_SECONDS = Histogram(
+    "cowcount_write_behind_commit_delay_seconds",
+    "Time from acknowledging a recognition to committing it",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+WRITE_BEHIND_BATCH_ROWS = Histogram(
+    "cowcount_write_behind_batch_rows",
+    "Recognitions per write-behind transaction",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+WRITE_BEHIND_FAILURES = Counter(
+    "cowcount_write_behind_failures_total",
+    "Write-behind transactions that failed and were retried"
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "cowcount_model_load_seconds",
+    "Time spent loading model weights",
+    ["model"],
+    multiprocess_mode="max"
+)
+
+
+def set_endpoint(endpoint: str) -> None:
+    """Set endpoint label for stages recorded in current request/session"""
+    _endpoint.set(endpoint)
+
+
+@lru_cache(maxsize=None)
+def _stage_histogram(endpoint: str, name: str):
+    return STAGE_SECONDS.labels(endpoint, name)
+
+
+@contextmanager
+def stage(name: str):
+    """Record duration of block as pipeline stage of current endpoint"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        _stage_histogram(_endpoint.get(), name).observe(elapsed)
+        tracing.record(name, elapsed)
+
+
+def render_latest():
+    """
+    Metrics in Prometheus text format
+    Aggregates all workers when PROMETHEUS_MULTIPROC_DIR is set
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,115 @@
+"""
+Shared YOLO model of this process
+
+Loaded once by the application lifespan from a local weights file
+(MODEL_WEIGHTS; never downloaded), then warmed up with one inference so the
+first real request does not pay for lazy initialisation. Routers get the
+service from here instead of building their own models. With INFERENCE_SERVER
+set, inference runs in the worker pool of inference_pool.py instead.
+
+MODEL_WEIGHTS may list several weights files (fastest first), which are all
+loaded; requests then choose between them by latency budget or quality tier
+(see model_router.py).
+"""
+from fastapi import HTTPException, Query
+from typing import List, Optional
+import os
+
+from .services import YOLOService
+from .model_router import ModelRouter
+from .cpu_tuning import load_settings
+from .inference_pool import INFERENCE_SERVER, RemoteYOLOService
+from .startup import StartupReport, startup_report
+
+# Path of model weights (bundle the file with the deployment); comma separated, fastest first
+MODEL_WEIGHTS = os.getenv("MODEL_WEIGHTS", "yolov8n.pt")
+
+# Run one inference on a blank image after loading
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Seconds clients are asked to wait while the model is loading
+RETRY_AFTER_SECONDS = 5
+
+_router: Optional[ModelRouter] = None
+
+
+def load(
+    weights: str = MODEL_WEIGHTS,
+    warmup: bool = MODEL_WARMUP,
+    report: StartupReport = startup_report
+) -> YOLOService:
+    """
+    Load (and warm up) shared models; blocking, run in a worker thread
+    With INFERENCE_SERVER set, connects to the inference server instead (one model)
+    Returns: default model
+    """
+    global _router
+    with report.phase("model_load"):
+        if INFERENCE_SERVER:
+            models = [RemoteYOLOService(INFERENCE_SERVER)]
+        else:
+            load_settings().apply()
+            models = [YOLOService(path.strip()) for path in weights.split(",") if path.strip()]
+    if warmup:
+        with report.phase("warmup"):
+            for yolo_service in models:
+                yolo_service.warmup()
+    _router = ModelRouter(models)
+    return _router.default
+
+
+def unload(report: StartupReport = startup_report) -> None:
+    """Release shared models (disconnects from inference server)"""
+    global _router
+    router, _router = _router, None
+    report.ready = False
+    for yolo_service in router.models if router else []:
+        if isinstance(yolo_service, RemoteYOLOService):
+            yolo_service.close()
+
+
+def current() -> Optional[YOLOService]:
+    """Default shared model, or None while it is not loaded"""
+    return _router.default if _router else None
+
+
+def models() -> List[YOLOService]:
+    """All loaded models, fastest first"""
+    return _router.models if _router else []
+
+
+def router() -> Optional[ModelRouter]:
+    return _router
+
+
+def require_model() -> YOLOService:
+    """Dependency: default shared model, 503 while it is not loaded"""
+    if _router is None:
+        if startup_report.error:
+            raise HTTPException(status_code=503, detail=f"Model failed to load: {startup_report.error}")
+        raise HTTPException(
+            status_code=503,
+            detail="Model is not loaded yet",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    return _router.default
+
+
+def select(latency_budget_ms: Optional[float] = None, quality: Optional[str] = None) -> Optional[YOLOService]:
+    """Model for a request's latency budget / quality tier, None while not loaded"""
+    if _router is None:
+        return None
+    return _router.select(latency_budget_ms / 1000 if latency_budget_ms else None, quality)
+
+
+def routed_model(
+    latency_budget_ms: Optional[float] = Query(
+        None, gt=0, description="Inference time the request can afford; picks the most accurate model that fits"
+    ),
+    quality: Optional[str] = Query(
+        None, description="Most accurate model to use: fast, balanced, accurate or a model name"
+    )
+) -> YOLOService:
+    """Dependency: model picked by model_router.py, 503 while not loaded"""
+    require_model()
+    return select(latency_budget_ms, quality)
@@ -0,0 +1,89 @@
+"""
+Routing requests across model sizes
+
+Several weights files can be loaded side by side (MODEL_WEIGHTS is a comma
+separated list, fastest model first). A request picks a model with
+
+    quality=fast|balanced|accurate   tier (or a model name) to use at most
+    latency_budget_ms=<ms>           end-to-end inference time it can afford
+
+With a budget, the router takes the most accurate model (up to the tier)
+whose expected latency fits: the measured seconds per run of that model
+times its current queue depth (see PriorityScheduler.expected_latency). If
+none fits, the model expected to finish first is used. Without either
+parameter the default model serves the request. Responses report the model
+in "model".
+"""
+from fastapi import HTTPException
+from typing import Dict, List, Optional
+import os
+
+from .services import YOLOService
+from . import metrics
+
+QUALITY_TIERS = ("fast", "balanced", "accurate")
+
+# Model used when a request sets neither quality nor budget (name, default: fastest)
+MODEL_DEFAULT = os.getenv("MODEL_DEFAULT", "")
+
+
+class ModelRouter:
+    """
+    Picks one of the loaded models per request
+    """
+
+    def __init__(self, models: List[YOLOService], default: str = MODEL_DEFAULT):
+        if not models:
+            raise ValueError("At least one model is required")
+        # Fastest (least accurate) first
+        self.models = models
+        self.default = self._by_name(default) if default else models[0]
+        if self.default is None:
+            raise ValueError(f"Default model {default!r} is not loaded")
+
+    def _by_name(self, name: str) -> Optional[YOLOService]:
+        return next((service for service in self.models if service.name == name), None)
+
+    def _ceiling(self, quality: str) -> int:
+        """Index of the most accurate model a quality tier allows"""
+        service = self._by_name(quality)
+        if service is not None:
+            return self.models.index(service)
+        if quality not in QUALITY_TIERS:
+            names = ", ".join(list(QUALITY_TIERS) + [service.name for service in self.models])
+            raise HTTPException(status_code=400, detail=f"Unknown quality. Available: {names}")
+        # Tiers spread over the loaded models (one model serves all tiers)
+        return round(QUALITY_TIERS.index(quality) * (len(self.models) - 1) / (len(QUALITY_TIERS) - 1))
+
+    def select(self, latency_budget: Optional[float] = None, quality: Optional[str] = None) -> YOLOService:
+        """Model for a request; latency_budget in seconds"""
+        service = self._select(latency_budget, quality)
+        metrics.MODEL_SELECTED.labels(service.name).inc()
+        return service
+
+    def _select(self, latency_budget: Optional[float], quality: Optional[str]) -> YOLOService:
+        if latency_budget is None:
+            return self.models[self._ceiling(quality)] if quality else self.default
+
+        candidates = self.models[:self._ceiling(quality) + 1] if quality else self.models
+        expected = [service.scheduler.expected_latency() for service in candidates]
+        # Most accurate model that fits the budget
+        for service, latency in reversed(list(zip(candidates, expected))):
+            if latency is not None and latency <= latency_budget:
+                return service
+        # Nothing fits: whichever finishes first (unmeasured models count as slowest)
+        return min(
+            zip(candidates, expected),
+            key=lambda item: float("inf") if item[1] is None else item[1]
+        )[0]
+
+    def status(self) -> List[Dict]:
+        return [
+            {
+                "name": service.name,
+                "default": service is self.default,
+                "expected_latency_ms": round(latency * 1000, 1) if latency is not None else None,
+                "scheduler": service.scheduler.status()
+            }
+            for service, latency in ((service, service.scheduler.expected_latency()) for service in self.models)
+        ]
@@ -1,10 +1,31 @@
 """
 Database models (ORM)
 """
-from sqlalchemy import Column, Integer, String, DateTime, JSON
-from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Float, UniqueConstraint
+from datetime import datetime, timedelta
 from .database import Base
 
+# Rollup resolutions, finest first; each bucket lies inside one bucket of the next
+ROLLUP_RESOLUTIONS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+
+# Rollup sources: one sample per image / per analyzed video frame
+IMAGE_SOURCE = "image"
+VIDEO_SOURCE = "video"
+
+
+def bucket_start(timestamp: datetime, resolution: str) -> datetime:
+    """Start of rollup bucket containing timestamp (weeks start on Monday)"""
+    if resolution == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if resolution == "day":
+        return day
+    return day - timedelta(days=day.weekday())
+
 
 class Recognition(Base):
     """
@@ -16,7 +37,7 @@ class Recognition(Base):
     image_path = Column(String, nullable=False)
     result = Column(JSON, nullable=False)
     cows_count = Column(Integer, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     def to_dict(self):
         """Convert model to dictionary"""
@@ -25,7 +46,9 @@ class Recognition(Base):
             "imagePath": self.image_path,
             "cowsCount": self.cows_count,
             "result": self.result,
-            "createdAt": self.created_at.isoformat() if self.created_at else None
+            "createdAt": self.created_at.isoformat() if self.created_at else None,
+            "thumbnailUrl": f"/detect/{self.id}/thumbnail",
+            "previewUrl": f"/detect/{self.id}/preview"
         }
     
     def to_dict_short(self):
@@ -34,5 +57,110 @@ class Recognition(Base):
             "id": self.id,
             "imagePath": self.image_path,
             "cowsCount": self.cows_count,
-            "createdAt": self.created_at.isoformat() if self.created_at else None
+            "createdAt": self.created_at.isoformat() if self.created_at else None,
+            "thumbnailUrl": f"/detect/{self.id}/thumbnail",
+            "previewUrl": f"/detect/{self.id}/preview"
+        }
+
+
+class VideoAnalysis(Base):
+    """
+    Video analysis model - stores summary of an analyzed video
+    Per-frame detections are kept as columnar arrays on disk (see DetectionStore)
+    """
+    __tablename__ = "video_analyses"
+    # Ids key the detection columns on disk: never reuse the id of a deleted analysis
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    id = Column(Integer, primary_key=True, index=True)
+    video_filename = Column(String, nullable=False)
+    sample_interval = Column(Float, nullable=False)
+    duration = Column(Float, nullable=False)
+    fps = Column(Integer, nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    total_frames = Column(Integer, nullable=False)
+    analyzed_frames = Column(Integer, nullable=False)
+    total_cows_detected = Column(Integer, nullable=False)
+    max_cows_in_frame = Column(Integer, nullable=False)
+    average_cows_per_frame = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        """Convert model to dictionary (summary without detections)"""
+        return {
+            "id": self.id,
+            "video_filename": self.video_filename,
+            "sample_interval": self.sample_interval,
+            "duration": self.duration,
+            "fps": self.fps,
+            "width": self.width,
+            "height": self.height,
+            "total_frames": self.total_frames,
+            "analyzed_frames": self.analyzed_frames,
+            "total_cows_detected": self.total_cows_detected,
+            "max_cows_in_frame": self.max_cows_in_frame,
+            "average_cows_per_frame": self.average_cows_per_frame,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class CountRollup(Base):
+    """
+    Cow count aggregates per time bucket (hour / day / week) and source
+    Kept up to date by the repositories as recognitions and analyses change
+    """
+    __tablename__ = "count_rollups"
+    __table_args__ = (UniqueConstraint("source", "resolution", "bucket_start"),)
+    
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)
+    resolution = Column(String, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    samples = Column(Integer, nullable=False)
+    total_cows = Column(Integer, nullable=False)
+    min_cows = Column(Integer, nullable=False)
+    max_cows = Column(Integer, nullable=False)
+    
+    def to_dict(self):
+        """Convert model to dictionary"""
+        return {
+            "start": self.bucket_start.isoformat(),
+            "samples": self.samples,
+            "totalCows": self.total_cows,
+            "minCows": self.min_cows,
+            "maxCows": self.max_cows,
+            "averageCows": round(self.total_cows / self.samples, 2) if self.samples else 0
+        }
+
+
+class RegionOfInterest(Base):
+    """
+    Region of interest of a camera / stream: polygon in fractions of frame width and height
+    Only the region is run through the model (see roi.py)
+    """
+    __tablename__ = "regions_of_interest"
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+    polygon = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert model to dictionary"""
+        return {
+            "name": self.name,
+            "polygon": self.polygon,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
+
+
+class IdSequence(Base):
+    """
+    Next free id of a table, for ids handed out before rows are written
+    (write-behind, see write_behind.py); processes reserve blocks of ids
+    """
+    __tablename__ = "id_sequences"
+    
+    name = Column(String, primary_key=True)
+    next_id = Column(Integer, nullable=False)
@@ -0,0 +1,185 @@
+"""
+On-demand sampling profiler
+
+Armed at runtime (see admin_routers.py) to profile the next N HTTP requests.
+While at least one of those requests is in flight, a background thread samples
+the stacks of all threads every few milliseconds. When the last one finishes,
+samples are written in collapsed-stack format ("frame;frame;frame count"),
+ready for flamegraph.pl, speedscope or inferno:
+
+    flamegraph.pl data/profiles/profile-20240101-120000.folded > profile.svg
+"""
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from starlette.types import ASGIApp, Receive, Scope, Send
+from typing import List, Optional
+import logging
+import os
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "./data/profiles"))
+
+# Requests to these paths are never profiled
+EXCLUDED_PREFIXES = ("/admin", "/metrics")
+
+
+class StackSampler:
+    """
+    Stack sampling profiler for a fixed number of requests
+    """
+
+    def __init__(self, profile_dir: Path = PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._samples: Counter = Counter()
+        self.interval = 0.005
+        self.requested = 0
+        self.remaining = 0
+        self.active = 0
+        self.completed = 0
+        self.last_profile: Optional[str] = None
+
+    @property
+    def armed(self) -> bool:
+        """Whether a profile is being collected"""
+        return self.requested > 0
+
+    def arm(self, requests: int, interval: float) -> None:
+        """Profile next `requests` requests, sampling every `interval` seconds"""
+        with self._lock:
+            if self.armed:
+                raise RuntimeError("Profiler is already armed")
+            self.interval = interval
+            self.requested = requests
+            self.remaining = requests
+            self.active = 0
+            self.completed = 0
+            self._samples = Counter()
+
+    def cancel(self) -> None:
+        """Stop profiling early, writing samples collected so far"""
+        with self._lock:
+            if not self.armed:
+                return
+            self.remaining = 0
+            if self.active == 0:
+                self._finish()
+
+    def claim(self) -> bool:
+        """Claim slot for request about to start; returns False if not profiled"""
+        if self.remaining <= 0:
+            return False
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self.active += 1
+            if self._thread is None:
+                # Fresh event per sampler: a previous sampler may not have seen its stop yet
+                self._stop = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run, args=(self._stop, self._samples), name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+            return True
+
+    def release(self) -> None:
+        """Release slot of finished request"""
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            if self.active == 0 and self.remaining == 0:
+                self._finish()
+
+    def status(self) -> dict:
+        """Current profiler state"""
+        return {
+            "armed": self.armed,
+            "requested": self.requested,
+            "completed": self.completed,
+            "active": self.active,
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": sum(self._samples.values()),
+            "last_profile": self.last_profile,
+        }
+
+    def list_profiles(self) -> List[str]:
+        """Names of written profiles, newest first"""
+        if not self.profile_dir.exists():
+            return []
+        return sorted((path.name for path in self.profile_dir.glob("*.folded")), reverse=True)
+
+    def _finish(self) -> None:
+        # Called with lock held; sampler thread writes the profile on exit
+        self.requested = 0
+        if self._thread is not None:
+            self._stop.set()
+            self._thread = None
+        else:
+            self._write(self._samples)
+
+    def _run(self, stop: threading.Event, samples: Counter) -> None:
+        own_id = threading.get_ident()
+        while not stop.wait(self.interval):
+            if self.active > 0:
+                self._sample(own_id, samples)
+        self._write(samples)
+
+    def _sample(self, own_id: int, samples: Counter) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            samples[";".join(reversed(stack))] += 1
+
+    def _write(self, samples: Counter) -> None:
+        if not samples:
+            logger.info("Profiler finished without samples")
+            return
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        path = self.profile_dir / f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.folded"
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.last_profile = path.name
+        logger.info(f"Profile written to {path} ({sum(samples.values())} samples)")
+
+
+# Shared profiler
+profiler = StackSampler()
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware that puts requests under the profiler while it is armed
+    """
+
+    def __init__(self, app: ASGIApp, sampler: StackSampler = profiler):
+        self.app = app
+        self.sampler = sampler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["path"].startswith(EXCLUDED_PREFIXES)
+            or not self.sampler.claim()
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.sampler.release()
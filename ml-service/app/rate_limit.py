@@ -0,0 +1,25 @@
+"""
+Shared per-IP rate limiter
+
+One Limiter for the whole application (routers decorate their endpoints with
+it). Counters live in RATE_LIMIT_STORAGE_URI, so with several API workers or
+replicas point it at a shared store (e.g. redis://redis:6379/0); the default
+memory:// keeps separate counters per process.
+
+RATE_LIMIT_ENABLED=false turns all limits off (load tests, trusted networks).
+"""
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+import os
+
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=["1000/hour", "100/minute"],  # Global limits for all endpoints
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    enabled=RATE_LIMIT_ENABLED,
+    # Keep serving if the shared store is unreachable (limits apply per process)
+    in_memory_fallback_enabled=RATE_LIMIT_STORAGE_URI != "memory://"
+)
@@ -0,0 +1,104 @@
+"""
+Image rendition service - small WebP thumbnails and previews of uploads
+"""
+from pathlib import Path
+from typing import Dict, Optional
+from PIL import Image, ImageOps
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Rendition name -> longest side in pixels
+RENDITION_SIZES: Dict[str, int] = {
+    "thumbnail": 320,
+    "preview": 1280,
+}
+
+WEBP_QUALITY = 80
+
+
+class RenditionService:
+    """
+    Service for downscaled WebP renditions of uploaded images
+    Renditions are cached on disk under <upload_dir>/renditions/<name>/
+    """
+
+    def __init__(self, upload_dir: Path):
+        self.upload_dir = upload_dir
+        self.rendition_dir = upload_dir / "renditions"
+        for name in RENDITION_SIZES:
+            (self.rendition_dir / name).mkdir(parents=True, exist_ok=True)
+
+    def validate_name(self, name: str) -> None:
+        """Check rendition name"""
+        if name not in RENDITION_SIZES:
+            raise ValueError(f"Unknown rendition: {name}")
+
+    def path_for(self, filename: str, name: str) -> Path:
+        """Path of rendition of uploaded file"""
+        self.validate_name(name)
+        return self.rendition_dir / name / Path(filename).with_suffix(".webp")
+
+    def get(self, filename: str, name: str) -> Optional[Path]:
+        """Get rendition path, generating it on first request"""
+        path = self.path_for(filename, name)
+        if path.exists():
+            return path
+        if not (self.upload_dir / filename).exists():
+            return None
+        self.generate(filename, names=[name])
+        return path
+
+    def generate(self, filename: str, names=None, force: bool = False) -> Dict[str, Path]:
+        """
+        Generate renditions of uploaded file (all by default)
+        Source image is decoded once; each rendition is written atomically
+        """
+        names = list(names or RENDITION_SIZES)
+        targets = {name: self.path_for(filename, name) for name in names}
+        if not force:
+            targets = {name: path for name, path in targets.items() if not path.exists()}
+        if not targets:
+            return {}
+
+        with Image.open(self.upload_dir / filename) as source:
+            # Let JPEG decoder downscale while decoding (much faster for large photos)
+            largest = max(RENDITION_SIZES[name] for name in targets)
+            source.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(source)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+            # Biggest first, so each smaller rendition is resized from the previous one
+            for name in sorted(targets, key=lambda n: RENDITION_SIZES[n], reverse=True):
+                size = RENDITION_SIZES[name]
+                image.thumbnail((size, size), Image.LANCZOS)
+                self._save(image, targets[name])
+
+        return targets
+
+    def generate_safe(self, filename: str) -> None:
+        """Generate renditions, logging instead of raising (for background tasks)"""
+        try:
+            self.generate(filename)
+        except Exception as e:
+            logger.warning(f"Cannot generate renditions for {filename}: {str(e)}")
+
+    def _save(self, image: Image.Image, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            image.save(tmp_path, format="WEBP", quality=WEBP_QUALITY, method=4)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def delete(self, filename: str) -> None:
+        """Delete all renditions of uploaded file"""
+        for name in RENDITION_SIZES:
+            path = self.path_for(filename, name)
+            if path.exists():
+                path.unlink()
@@ -1,9 +1,28 @@
 """
 Repository layer - handles database operations
 """
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from .models import Recognition
+from datetime import datetime
+from typing import Callable, Iterator, List, Optional, Tuple
+import numpy as np
+from .models import (
+    ROLLUP_RESOLUTIONS,
+    IMAGE_SOURCE,
+    VIDEO_SOURCE,
+    CountRollup,
+    IdSequence,
+    Recognition,
+    RegionOfInterest,
+    VideoAnalysis,
+    bucket_start
+)
+
+# (samples, total cows, min cows, max cows) of one bucket
+Aggregate = Tuple[int, int, int, int]
+
+_FINEST = next(iter(ROLLUP_RESOLUTIONS))
 
 
 class RecognitionRepository:
@@ -23,10 +42,39 @@ class RecognitionRepository:
             cows_count=cows_count
         )
         self.db.add(recognition)
+        self.db.flush()
+        RollupRepository(self.db).add(
+            IMAGE_SOURCE, recognition.created_at, (1, cows_count, cows_count, cows_count)
+        )
         self.db.commit()
         self.db.refresh(recognition)
         return recognition
     
+    def create_many(self, rows: List[dict]) -> List[int]:
+        """
+        Insert recognitions with preassigned ids in one transaction
+        Rows whose id exists already are skipped (replays); returns inserted ids
+        """
+        ids = [row["id"] for row in rows]
+        existing = set(self.db.scalars(select(Recognition.id).where(Recognition.id.in_(ids))))
+        rows = [row for row in rows if row["id"] not in existing]
+        if not rows:
+            return []
+        self.db.add_all(Recognition(**row) for row in rows)
+        self.db.flush()
+        # One rollup update per hour bucket (an hour lies inside one day and one week bucket)
+        buckets = {}
+        for row in rows:
+            start = bucket_start(row["created_at"], _FINEST)
+            count = row["cows_count"]
+            samples, total, minimum, maximum = buckets.get(start, (0, 0, count, count))
+            buckets[start] = (samples + 1, total + count, min(minimum, count), max(maximum, count))
+        rollups = RollupRepository(self.db)
+        for start, aggregate in buckets.items():
+            rollups.add(IMAGE_SOURCE, start, aggregate)
+        self.db.commit()
+        return [row["id"] for row in rows]
+    
     def get_by_id(self, recognition_id: int) -> Optional[Recognition]:
         """Get recognition by ID"""
         return self.db.query(Recognition).filter(
@@ -43,11 +91,28 @@ class RecognitionRepository:
         """Delete recognition by ID"""
         recognition = self.get_by_id(recognition_id)
         if recognition:
+            created_at = recognition.created_at
             self.db.delete(recognition)
+            self.db.flush()
+            RollupRepository(self.db).replace(IMAGE_SOURCE, created_at, self.aggregate(created_at))
             self.db.commit()
             return True
         return False
     
+    def aggregate(self, timestamp: datetime) -> Aggregate:
+        """Rollup values of finest bucket containing timestamp, from raw rows"""
+        start = bucket_start(timestamp, _FINEST)
+        samples, total, minimum, maximum = self.db.query(
+            func.count(Recognition.id),
+            func.sum(Recognition.cows_count),
+            func.min(Recognition.cows_count),
+            func.max(Recognition.cows_count)
+        ).filter(
+            Recognition.created_at >= start,
+            Recognition.created_at < start + ROLLUP_RESOLUTIONS[_FINEST]
+        ).one()
+        return samples, total or 0, minimum or 0, maximum or 0
+    
     def count(self) -> int:
         """Count total recognitions"""
         return self.db.query(Recognition).count()
@@ -58,3 +123,315 @@ class RecognitionRepository:
             Recognition.cows_count
         ).all()
         return sum(count[0] for count in result)
+    
+    def iter_export(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        after_id: int = 0,
+        with_result: bool = False,
+        chunk_size: int = 1000,
+        window: int = 50000
+    ) -> Iterator[list]:
+        """
+        Stream recognitions in id order as chunks of row tuples
+        (id, created_at, image_path, cows_count[, result])
+        
+        Rows are fetched `chunk_size` at a time from a server-side cursor.
+        Each query covers at most `window` rows (keyset on id), so no read
+        transaction stays open for the whole export.
+        """
+        columns = [Recognition.id, Recognition.created_at, Recognition.image_path, Recognition.cows_count]
+        if with_result:
+            columns.append(Recognition.result)
+        query = select(*columns).order_by(Recognition.id)
+        if start is not None:
+            query = query.where(Recognition.created_at >= start)
+        if end is not None:
+            query = query.where(Recognition.created_at < end)
+        
+        while True:
+            rows_in_window = 0
+            result = self.db.execute(
+                query.where(Recognition.id > after_id).limit(window),
+                execution_options={"yield_per": chunk_size}
+            )
+            try:
+                for chunk in result.partitions():
+                    rows_in_window += len(chunk)
+                    after_id = chunk[-1][0]
+                    yield chunk
+            finally:
+                result.close()
+                self.db.rollback()
+            if rows_in_window < window:
+                return
+
+
+class VideoAnalysisRepository:
+    """
+    Repository for VideoAnalysis model
+    Stores analysis summaries; detections live in DetectionStore
+    """
+    
+    def __init__(self, db: Session, frame_counts: Optional[Callable[[int], np.ndarray]] = None):
+        self.db = db
+        # Cows per analyzed frame of an analysis (for rollup minimums after deletes)
+        self.frame_counts = frame_counts
+    
+    def create(self, summary: dict, sample_interval: float, frame_counts: Optional[np.ndarray] = None) -> VideoAnalysis:
+        """
+        Create new video analysis record from analyze_video summary
+        frame_counts (cows per analyzed frame) gives the rollup minimum
+        """
+        analysis = VideoAnalysis(
+            video_filename=summary["video_filename"],
+            sample_interval=sample_interval,
+            duration=summary["duration"],
+            fps=summary["fps"],
+            width=summary["width"],
+            height=summary["height"],
+            total_frames=summary["total_frames"],
+            analyzed_frames=summary["analyzed_frames"],
+            total_cows_detected=summary["total_cows_detected"],
+            max_cows_in_frame=summary["max_cows_in_frame"],
+            average_cows_per_frame=summary["average_cows_per_frame"]
+        )
+        self.db.add(analysis)
+        self.db.flush()
+        minimum = int(frame_counts.min()) if frame_counts is not None and len(frame_counts) else 0
+        RollupRepository(self.db).add(VIDEO_SOURCE, analysis.created_at, (
+            analysis.analyzed_frames, analysis.total_cows_detected, minimum, analysis.max_cows_in_frame
+        ))
+        self.db.commit()
+        self.db.refresh(analysis)
+        return analysis
+    
+    def get_by_id(self, analysis_id: int) -> Optional[VideoAnalysis]:
+        """Get video analysis by ID"""
+        return self.db.query(VideoAnalysis).filter(
+            VideoAnalysis.id == analysis_id
+        ).first()
+    
+    def get_all(self, skip: int = 0, limit: int = 100) -> List[VideoAnalysis]:
+        """Get all video analyses with pagination"""
+        return self.db.query(VideoAnalysis).order_by(
+            VideoAnalysis.created_at.desc()
+        ).offset(skip).limit(limit).all()
+    
+    def delete(self, analysis_id: int) -> bool:
+        """Delete video analysis by ID"""
+        analysis = self.get_by_id(analysis_id)
+        if analysis:
+            created_at = analysis.created_at
+            self.db.delete(analysis)
+            self.db.flush()
+            RollupRepository(self.db).replace(VIDEO_SOURCE, created_at, self.aggregate(created_at))
+            self.db.commit()
+            return True
+        return False
+    
+    def min_cows(self, analysis_id: int) -> int:
+        """Fewest cows in an analyzed frame (0 if per-frame counts are unavailable)"""
+        counts = self.frame_counts(analysis_id) if self.frame_counts else None
+        return int(counts.min()) if counts is not None and len(counts) else 0
+    
+    def aggregate(self, timestamp: datetime) -> Aggregate:
+        """Rollup values of finest bucket containing timestamp, from stored analyses"""
+        start = bucket_start(timestamp, _FINEST)
+        rows = self.db.query(
+            VideoAnalysis.id,
+            VideoAnalysis.analyzed_frames,
+            VideoAnalysis.total_cows_detected,
+            VideoAnalysis.max_cows_in_frame
+        ).filter(
+            VideoAnalysis.created_at >= start,
+            VideoAnalysis.created_at < start + ROLLUP_RESOLUTIONS[_FINEST],
+            VideoAnalysis.analyzed_frames > 0
+        ).all()
+        if not rows:
+            return 0, 0, 0, 0
+        return (
+            sum(row[1] for row in rows),
+            sum(row[2] for row in rows),
+            min(self.min_cows(row[0]) for row in rows),
+            max(row[3] for row in rows)
+        )
+
+
+class RollupRepository:
+    """
+    Repository for CountRollup model
+    Callers commit: rollups change in the same transaction as their source rows
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def _insert(self):
+        # INSERT ... ON CONFLICT is dialect specific
+        if self.db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(CountRollup)
+    
+    def add(self, source: str, timestamp: datetime, aggregate: Aggregate) -> None:
+        """Add samples at timestamp to its bucket at every resolution"""
+        samples, total, minimum, maximum = aggregate
+        if samples <= 0:
+            return
+        table = CountRollup.__table__
+        for resolution in ROLLUP_RESOLUTIONS:
+            insert = self._insert().values(
+                source=source,
+                resolution=resolution,
+                bucket_start=bucket_start(timestamp, resolution),
+                samples=samples,
+                total_cows=total,
+                min_cows=minimum,
+                max_cows=maximum
+            )
+            excluded = insert.excluded
+            self.db.execute(insert.on_conflict_do_update(
+                index_elements=[table.c.source, table.c.resolution, table.c.bucket_start],
+                set_={
+                    "samples": table.c.samples + excluded.samples,
+                    "total_cows": table.c.total_cows + excluded.total_cows,
+                    "min_cows": case((excluded.min_cows < table.c.min_cows, excluded.min_cows), else_=table.c.min_cows),
+                    "max_cows": case((excluded.max_cows > table.c.max_cows, excluded.max_cows), else_=table.c.max_cows),
+                }
+            ))
+    
+    def add_bucket(self, source: str, resolution: str, start: datetime, aggregate: Aggregate) -> None:
+        """Insert bucket that does not exist yet"""
+        samples, total, minimum, maximum = aggregate
+        self.db.add(CountRollup(
+            source=source, resolution=resolution, bucket_start=start,
+            samples=samples, total_cows=total, min_cows=minimum, max_cows=maximum
+        ))
+    
+    def _set(self, source: str, resolution: str, start: datetime, aggregate: Aggregate) -> None:
+        self.db.execute(delete(CountRollup).where(
+            CountRollup.source == source,
+            CountRollup.resolution == resolution,
+            CountRollup.bucket_start == start
+        ))
+        if aggregate[0]:
+            self.add_bucket(source, resolution, start, aggregate)
+            self.db.flush()
+    
+    def replace(self, source: str, timestamp: datetime, aggregate: Aggregate) -> None:
+        """
+        Set finest bucket containing timestamp (after deletes: min/max cannot be subtracted)
+        Coarser buckets are recomputed from the finer ones, not from raw rows
+        """
+        self._set(source, _FINEST, bucket_start(timestamp, _FINEST), aggregate)
+        finer = _FINEST
+        for resolution, length in list(ROLLUP_RESOLUTIONS.items())[1:]:
+            start = bucket_start(timestamp, resolution)
+            samples, total, minimum, maximum = self.db.execute(
+                select(
+                    func.sum(CountRollup.samples),
+                    func.sum(CountRollup.total_cows),
+                    func.min(CountRollup.min_cows),
+                    func.max(CountRollup.max_cows)
+                ).where(
+                    CountRollup.source == source,
+                    CountRollup.resolution == finer,
+                    CountRollup.bucket_start >= start,
+                    CountRollup.bucket_start < start + length
+                )
+            ).one()
+            self._set(source, resolution, start, (samples or 0, total or 0, minimum or 0, maximum or 0))
+            finer = resolution
+    
+    def get_range(self, source: str, resolution: str, start: datetime, end: datetime) -> List[CountRollup]:
+        """Buckets of source starting in [start, end), oldest first"""
+        return self.db.query(CountRollup).filter(
+            CountRollup.source == source,
+            CountRollup.resolution == resolution,
+            CountRollup.bucket_start >= start,
+            CountRollup.bucket_start < end
+        ).order_by(CountRollup.bucket_start).all()
+    
+    def clear(self) -> None:
+        """Delete all rollups (before a rebuild)"""
+        self.db.execute(delete(CountRollup))
+
+
+class RoiRepository:
+    """
+    Repository for RegionOfInterest model
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def get(self, name: str) -> Optional[RegionOfInterest]:
+        """Get region by name"""
+        return self.db.query(RegionOfInterest).filter(RegionOfInterest.name == name).first()
+    
+    def get_all(self) -> List[RegionOfInterest]:
+        """Get all regions, by name"""
+        return self.db.query(RegionOfInterest).order_by(RegionOfInterest.name).all()
+    
+    def save(self, name: str, polygon: List[List[float]]) -> RegionOfInterest:
+        """Create or replace region"""
+        roi = self.get(name)
+        if roi is None:
+            roi = RegionOfInterest(name=name, polygon=polygon)
+            self.db.add(roi)
+        else:
+            roi.polygon = polygon
+            roi.updated_at = datetime.utcnow()
+        self.db.commit()
+        self.db.refresh(roi)
+        return roi
+    
+    def delete(self, name: str) -> bool:
+        """Delete region; False if it does not exist"""
+        roi = self.get(name)
+        if roi is None:
+            return False
+        self.db.delete(roi)
+        self.db.commit()
+        return True
+
+
+class IdSequenceRepository:
+    """
+    Repository for IdSequence model
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def reserve(self, name: str, id_column, count: int) -> Tuple[int, int]:
+        """
+        Reserve `count` ids above every id in id_column and every earlier reservation
+        Returns: [first, end) of the block
+        """
+        table = IdSequence.__table__
+        floor_query = select(func.coalesce(func.max(id_column), 0) + 1)
+        floor = floor_query.scalar_subquery()
+        for _ in range(2):
+            # UPDATE first: it takes the write lock, so concurrent reservations serialize
+            updated = self.db.execute(
+                table.update()
+                .where(table.c.name == name)
+                .values(next_id=case((floor > table.c.next_id, floor), else_=table.c.next_id) + count)
+            ).rowcount
+            if updated:
+                end = self.db.scalar(select(table.c.next_id).where(table.c.name == name))
+                self.db.commit()
+                return end - count, end
+            try:
+                self.db.execute(table.insert().values(name=name, next_id=self.db.scalar(floor_query) + count))
+                end = self.db.scalar(select(table.c.next_id).where(table.c.name == name))
+                self.db.commit()
+                return end - count, end
+            except IntegrityError:
+                # Another process created the sequence first
+                self.db.rollback()
+        raise RuntimeError(f"Cannot reserve ids for {name}")
@@ -0,0 +1,234 @@
+"""
+Resumable chunked video uploads (tus-style)
+
+    POST   /video/uploads                    create: {"filename", "size"} -> upload_id
+    PUT    /video/uploads/{id}               chunk: body written at Upload-Offset header
+    HEAD   /video/uploads/{id}               committed offset in Upload-Offset header
+    GET    /video/uploads/{id}               status with missing byte ranges
+    POST   /video/uploads/{id}/analyze       analyze completed upload
+    DELETE /video/uploads/{id}               abort
+
+The target file is created at its final size in a staging directory on the
+upload volume. Chunks are written in place with pwrite() as request bodies
+arrive, so chunks can come in any order and in parallel, and nothing is
+buffered or concatenated. Received byte ranges are kept in a sidecar JSON
+file, updated under a file lock so API workers can share uploads. A dropped
+chunk still keeps the bytes that arrived before the drop. A complete upload
+is renamed into the upload directory and analyzed there, with no copy.
+"""
+from fastapi import HTTPException, Request
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import fcntl
+import json
+import os
+import re
+import secrets
+import shutil
+
+from . import storage
+
+# Staging area for incomplete uploads (on the upload volume, so completion is a rename)
+STAGING_DIRNAME = ".partial"
+
+# Clients should send chunks of about this size (bytes)
+RECOMMENDED_CHUNK_SIZE = 8 * 1024 * 1024
+
+_UPLOAD_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def merge_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Add [start, end) to sorted disjoint ranges, merging touching ones"""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def missing_ranges(ranges: List[List[int]], size: int) -> List[List[int]]:
+    """Byte ranges [start, end) not received yet"""
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+def chunk_offset(request: Request, offset: Optional[int] = None) -> int:
+    """Chunk offset from Upload-Offset header or ?offset= parameter"""
+    value = request.headers.get("upload-offset", offset)
+    if value is None:
+        raise HTTPException(status_code=400, detail="Upload-Offset header is required.")
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Offset must be an integer.")
+
+
+class ResumableUploadService:
+    """
+    Service for chunked uploads into preallocated files
+    """
+
+    def __init__(self, upload_dir: Path, max_size: int):
+        self.upload_dir = upload_dir
+        self.staging_dir = upload_dir / STAGING_DIRNAME
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    def _meta_path(self, upload_id: str) -> Path:
+        if not _UPLOAD_ID.match(upload_id):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return self.staging_dir / f"{upload_id}.json"
+
+    def _data_path(self, meta: Dict) -> Path:
+        # Keeps the video extension, so the staged file can be probed like a finished one
+        return self.staging_dir / f"{meta['upload_id']}{os.path.splitext(meta['filename'])[1].lower()}"
+
+    def create(self, filename: str, size: int) -> Dict:
+        """Start upload of `size` bytes; the data file is allocated up front"""
+        if size <= 0:
+            raise HTTPException(status_code=400, detail="Upload size must be positive.")
+        if size > self.max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Video file size exceeds {self.max_size // (1024 * 1024)}MB limit."
+            )
+
+        upload_id = secrets.token_urlsafe(18)
+        meta = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "size": size,
+            "ranges": [],
+            "created_at": datetime.utcnow().isoformat()
+        }
+        fd = os.open(self._data_path(meta), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            try:
+                # Reserve blocks now: a full disk fails here, not halfway through the upload
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+        self._meta_path(upload_id).write_text(json.dumps(meta))
+        return self.status(meta)
+
+    def _read_meta(self, meta_path: Path) -> Dict:
+        try:
+            return json.loads(meta_path.read_text())
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+    def _update_ranges(self, upload_id: str, start: int, end: int) -> Dict:
+        """Record received bytes (locked: parallel chunks and workers update the same file)"""
+        try:
+            with open(self._meta_path(upload_id), "r+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                meta = json.load(f)
+                meta["ranges"] = merge_range(meta["ranges"], start, end)
+                f.seek(0)
+                f.truncate()
+                json.dump(meta, f)
+                return meta
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+    def get(self, upload_id: str) -> Dict:
+        """Upload metadata (404 if unknown or finished)"""
+        return self._read_meta(self._meta_path(upload_id))
+
+    @staticmethod
+    def status(meta: Dict) -> Dict:
+        """Client view of upload state; offset is the contiguous prefix that arrived"""
+        ranges = meta["ranges"]
+        offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        return {
+            "upload_id": meta["upload_id"],
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "offset": offset,
+            "received": sum(end - start for start, end in ranges),
+            "complete": offset == meta["size"],
+            "missing": missing_ranges(ranges, meta["size"]),
+            "chunk_size": RECOMMENDED_CHUNK_SIZE
+        }
+
+    async def write_chunk(self, upload_id: str, offset: int, request: Request) -> Dict:
+        """Write request body at offset as it arrives"""
+        meta = self.get(upload_id)
+        size = meta["size"]
+        if offset < 0 or offset >= size:
+            raise HTTPException(status_code=416, detail=f"Upload-Offset must be in [0, {size}).")
+        content_length = request.headers.get("content-length")
+        if content_length is not None and offset + int(content_length) > size:
+            raise HTTPException(status_code=413, detail="Chunk extends past the declared upload size.")
+
+        position = offset
+        try:
+            fd = os.open(self._data_path(meta), os.O_WRONLY)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        try:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                if position + len(chunk) > size:
+                    raise HTTPException(status_code=413, detail="Chunk extends past the declared upload size.")
+                view = memoryview(chunk)
+                while view:
+                    written = os.pwrite(fd, view, position)
+                    position += written
+                    view = view[written:]
+        finally:
+            os.close(fd)
+            # Keep what arrived even if the client dropped mid-chunk
+            if position > offset:
+                meta = self._update_ranges(upload_id, offset, position)
+        return self.status(meta)
+
+    def staged_path(self, upload_id: str) -> Path:
+        """Data file of a fully received upload (409 while bytes are missing)"""
+        meta = self.get(upload_id)
+        state = self.status(meta)
+        if not state["complete"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload incomplete: {state['received']} of {state['size']} bytes received."
+            )
+        return self._data_path(meta)
+
+    def complete(self, upload_id: str) -> Tuple[str, str]:
+        """
+        Move finished upload into upload directory (rename, no copy)
+        Returns: (filename, file_path)
+        """
+        data_path = self.staged_path(upload_id)
+        filename, file_path = storage.allocate(self.upload_dir, storage.VIDEOS, data_path.suffix)
+        try:
+            os.rename(data_path, file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        except OSError:
+            # Staging on another filesystem (unusual mount layout)
+            shutil.move(str(data_path), str(file_path))
+        # Rename keeps the mtime of the last chunk; the storage collector must see a new file
+        os.utime(file_path)
+        self._meta_path(upload_id).unlink(missing_ok=True)
+        return filename, str(file_path)
+
+    def abort(self, upload_id: str) -> None:
+        """Discard upload and its data"""
+        meta = self.get(upload_id)
+        self._data_path(meta).unlink(missing_ok=True)
+        self._meta_path(upload_id).unlink(missing_ok=True)
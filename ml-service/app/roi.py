@@ -0,0 +1,182 @@
+"""
+Regions of interest (ROI) of fixed cameras
+
+A region is a polygon in fractions of frame width and height (so it fits any
+resolution of the same view), stored by name: the name of an ingestion
+source, or any name a stream session or video analysis refers to with
+`roi=<name>`. Stream sessions can also send their own polygon.
+
+Before inference, a frame is cropped to the bounding rectangle of the
+polygon and the pixels outside the polygon are blacked out. Fewer pixels go
+through the model, and nothing outside the pen is counted. Boxes are mapped
+back to full-frame coordinates, and boxes whose center lies outside the
+polygon are dropped.
+"""
+from fastapi import HTTPException
+from typing import Dict, List, Optional, Tuple
+import os
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .database import SessionLocal
+from .repositories import RoiRepository
+
+# Seconds a process keeps a stored region before re-reading it (changes made elsewhere)
+ROI_CACHE_SECONDS = float(os.getenv("ROI_CACHE_SECONDS", "5"))
+
+# Most polygon vertices
+ROI_MAX_POINTS = 256
+
+_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# (x, y, width, height) of the bounding rectangle, polygon mask of it (None: whole rectangle)
+Geometry = Tuple[Tuple[int, int, int, int], Optional[np.ndarray]]
+
+
+def validate_polygon(polygon) -> List[List[float]]:
+    """Polygon as [[x, y], ...] fractions in [0, 1]; ValueError if malformed"""
+    try:
+        points = [[float(x), float(y)] for x, y in polygon]
+    except (TypeError, ValueError):
+        raise ValueError("Polygon must be a list of [x, y] points")
+    if not 3 <= len(points) <= ROI_MAX_POINTS:
+        raise ValueError(f"Polygon must have 3 to {ROI_MAX_POINTS} points")
+    if any(not (0.0 <= value <= 1.0) for point in points for value in point):
+        raise ValueError("Polygon coordinates are fractions of frame width / height (0 to 1)")
+    if cv2.contourArea(np.array(points, dtype=np.float32)) <= 0:
+        raise ValueError("Polygon has no area")
+    return points
+
+
+class RoiMask:
+    """
+    Crop / mask of one region, per frame size
+    """
+
+    def __init__(self, polygon: List[List[float]], name: Optional[str] = None):
+        self.polygon = validate_polygon(polygon)
+        self.name = name
+        self._geometry: Dict[Tuple[int, int], Geometry] = {}
+        self._lock = threading.Lock()
+
+    def geometry(self, height: int, width: int) -> Geometry:
+        """Bounding rectangle and mask for a frame size (computed once per size)"""
+        with self._lock:
+            geometry = self._geometry.get((height, width))
+            if geometry is None:
+                points = np.round(np.array(self.polygon) * [width - 1, height - 1]).astype(np.int32)
+                x, y, w, h = cv2.boundingRect(points)
+                mask = np.zeros((h, w), dtype=np.uint8)
+                cv2.fillPoly(mask, [points - [x, y]], 255)
+                geometry = (x, y, w, h), (None if mask.all() else mask)
+                self._geometry[(height, width)] = geometry
+            return geometry
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        """Pixels of the region: bounding rectangle, outside of the polygon black"""
+        (x, y, w, h), mask = self.geometry(*frame.shape[:2])
+        region = frame[y:y + h, x:x + w]
+        if mask is None:
+            return np.ascontiguousarray(region)
+        return cv2.bitwise_and(region, region, mask=mask)
+
+    def to_frame(self, boxes: np.ndarray, frame_shape: Tuple[int, ...]) -> np.ndarray:
+        """Boxes (confidence, x1, y1, x2, y2) of a crop in frame coordinates, inside the polygon only"""
+        (x, y, w, h), mask = self.geometry(*frame_shape[:2])
+        if len(boxes) and mask is not None:
+            centers_x = np.clip(((boxes[:, 1] + boxes[:, 3]) / 2).astype(np.int32), 0, w - 1)
+            centers_y = np.clip(((boxes[:, 2] + boxes[:, 4]) / 2).astype(np.int32), 0, h - 1)
+            boxes = boxes[mask[centers_y, centers_x] > 0]
+        boxes = boxes.copy()
+        boxes[:, [1, 3]] += x
+        boxes[:, [2, 4]] += y
+        return boxes
+
+
+class RoiService:
+    """
+    Service for stored regions, with a short-lived cache of their masks
+    Uses its own sessions: masks are looked up from frame loops outside requests
+    """
+
+    def __init__(self, ttl: float = ROI_CACHE_SECONDS):
+        self.ttl = ttl
+        # name -> (expires at, mask or None if no region is stored)
+        self._masks: Dict[str, Tuple[float, Optional[RoiMask]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _check_name(name: str) -> None:
+        if not _NAME.match(name):
+            raise HTTPException(status_code=400, detail="ROI name may only contain letters, digits, '-' and '_'.")
+
+    def list(self) -> List[Dict]:
+        with SessionLocal() as db:
+            return [roi.to_dict() for roi in RoiRepository(db).get_all()]
+
+    def get(self, name: str) -> Dict:
+        """Stored region (404 if none)"""
+        with SessionLocal() as db:
+            roi = RoiRepository(db).get(name)
+            if roi is None:
+                raise HTTPException(status_code=404, detail="ROI not found")
+            return roi.to_dict()
+
+    def save(self, name: str, polygon) -> Dict:
+        """Create or replace region (400 if the polygon is malformed)"""
+        self._check_name(name)
+        try:
+            polygon = validate_polygon(polygon)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        with SessionLocal() as db:
+            roi = RoiRepository(db).save(name, polygon).to_dict()
+        self.invalidate(name)
+        return roi
+
+    def delete(self, name: str) -> None:
+        """Delete region (404 if none)"""
+        with SessionLocal() as db:
+            deleted = RoiRepository(db).delete(name)
+        self.invalidate(name)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="ROI not found")
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            self._masks.pop(name, None)
+
+    def mask(self, name: str) -> Optional[RoiMask]:
+        """Mask of stored region, None if there is none (cached for ttl seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._masks.get(name)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        with SessionLocal() as db:
+            roi = RoiRepository(db).get(name)
+            polygon = roi.polygon if roi is not None else None
+        mask = None
+        if polygon is not None:
+            # Same polygon: keep the mask and its computed geometry
+            previous = cached[1] if cached is not None else None
+            mask = previous if previous is not None and previous.polygon == polygon else RoiMask(polygon, name)
+        with self._lock:
+            self._masks[name] = (now + self.ttl, mask)
+        return mask
+
+    def require_mask(self, name: str) -> RoiMask:
+        """Mask of stored region named by a request (404 if none)"""
+        mask = self.mask(name)
+        if mask is None:
+            raise HTTPException(status_code=404, detail=f"ROI not found: {name}")
+        return mask
+
+
+# Global instance
+rois = RoiService()
@@ -0,0 +1,126 @@
+"""
+Time-series rollups of cow counts
+
+CountRollup rows hold samples, total, min and max cows per hour, day and
+week bucket, separately for images (one sample per recognition) and videos
+(one sample per analyzed frame, at the time the analysis was stored). The
+repositories keep them current as rows are created and deleted, so a range
+query reads one row per bucket however many raw rows there are.
+
+`python manage.py rebuild-rollups` recomputes everything from raw rows, for
+data stored before rollups existed.
+"""
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from typing import Dict, Optional, Tuple
+import os
+
+from .detection_store import DetectionStore
+from .export import naive_utc
+from .models import ROLLUP_RESOLUTIONS, IMAGE_SOURCE, VIDEO_SOURCE, VideoAnalysis, bucket_start
+from .repositories import Aggregate, RecognitionRepository, RollupRepository, VideoAnalysisRepository
+
+SOURCES = (IMAGE_SOURCE, VIDEO_SOURCE)
+
+# Most buckets one range request may return
+ROLLUP_MAX_BUCKETS = int(os.getenv("ROLLUP_MAX_BUCKETS", "5000"))
+
+# Buckets returned when no start is given
+ROLLUP_DEFAULT_BUCKETS = 168
+
+
+def _merge(a: Aggregate, b: Aggregate) -> Aggregate:
+    return a[0] + b[0], a[1] + b[1], min(a[2], b[2]), max(a[3], b[3])
+
+
+class RollupService:
+    """
+    Service for rollup range queries and rebuilds
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.repository = RollupRepository(db)
+
+    def get_range(
+        self,
+        resolution: str,
+        source: str = IMAGE_SOURCE,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Dict:
+        """Buckets in [start, end); empty buckets are omitted"""
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise HTTPException(status_code=400, detail=f"Resolution must be one of: {', '.join(ROLLUP_RESOLUTIONS)}")
+        if source not in SOURCES:
+            raise HTTPException(status_code=400, detail=f"Source must be one of: {', '.join(SOURCES)}")
+        length = ROLLUP_RESOLUTIONS[resolution]
+        start, end = naive_utc(start), naive_utc(end)
+        end = end or bucket_start(datetime.utcnow(), resolution) + length
+        start = start or end - ROLLUP_DEFAULT_BUCKETS * length
+        if end <= start:
+            raise HTTPException(status_code=400, detail="end must be after start")
+        if (end - start) / length > ROLLUP_MAX_BUCKETS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Range too large: at most {ROLLUP_MAX_BUCKETS} {resolution} buckets per request"
+            )
+
+        return {
+            "source": source,
+            "resolution": resolution,
+            "start": start,
+            "end": end,
+            "buckets": [row.to_dict() for row in self.repository.get_range(source, resolution, start, end)]
+        }
+
+    def rebuild(self, detection_store: DetectionStore, chunk_size: int = 1000) -> Dict[str, int]:
+        """
+        Recompute all rollups from recognitions and video analyses
+        Raw rows are streamed; memory grows with the number of buckets only
+        Returns number of finest buckets per source
+        """
+        finest = next(iter(ROLLUP_RESOLUTIONS))
+        buckets: Dict[Tuple[str, datetime], Aggregate] = {}
+
+        def add(source: str, timestamp: datetime, aggregate: Aggregate) -> None:
+            key = (source, bucket_start(timestamp, finest))
+            buckets[key] = _merge(buckets[key], aggregate) if key in buckets else aggregate
+
+        for chunk in RecognitionRepository(self.db).iter_export(chunk_size=chunk_size):
+            for _, created_at, _, cows_count in chunk:
+                if created_at is not None:
+                    add(IMAGE_SOURCE, created_at, (1, cows_count, cows_count, cows_count))
+
+        videos = VideoAnalysisRepository(self.db, frame_counts=detection_store.frame_counts)
+        rows = self.db.query(
+            VideoAnalysis.id,
+            VideoAnalysis.created_at,
+            VideoAnalysis.analyzed_frames,
+            VideoAnalysis.total_cows_detected,
+            VideoAnalysis.max_cows_in_frame
+        ).filter(VideoAnalysis.analyzed_frames > 0).yield_per(chunk_size)
+        for analysis_id, created_at, frames, total, maximum in rows:
+            if created_at is not None:
+                add(VIDEO_SOURCE, created_at, (frames, total, videos.min_cows(analysis_id), maximum))
+
+        # Coarser buckets from the finest ones
+        rollups = {finest: buckets}
+        for resolution in list(ROLLUP_RESOLUTIONS)[1:]:
+            coarse: Dict[Tuple[str, datetime], Aggregate] = {}
+            for (source, start), aggregate in buckets.items():
+                key = (source, bucket_start(start, resolution))
+                coarse[key] = _merge(coarse[key], aggregate) if key in coarse else aggregate
+            rollups[resolution] = coarse
+
+        self.repository.clear()
+        for resolution, resolution_buckets in rollups.items():
+            for (source, start), aggregate in resolution_buckets.items():
+                self.repository.add_bucket(source, resolution, start, aggregate)
+        self.db.commit()
+
+        counts = {source: 0 for source in SOURCES}
+        for source, _ in buckets:
+            counts[source] += 1
+        return counts
@@ -1,29 +1,44 @@
 """
 Routers (Controllers) - handle HTTP requests
 """
-from fastapi import APIRouter, Depends, File, UploadFile, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, UploadFile, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 from pathlib import Path
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 
 from .database import get_db
-from .services import RecognitionService, YOLOService, FileService
+from .services import RecognitionService, FileService, YOLOService
+from .model import current as current_model, routed_model
+from .admission import admission
+from .rate_limit import limiter
+from .cache import RECOGNITIONS, cached_json_response
+from .file_streaming import RangeFileResponse
+from .renditions import RenditionService
+from .rollups import RollupService
+from . import export, metrics, scheduling
+from .serializers import (
+    JSON_MEDIA_TYPE,
+    ColumnarResponse,
+    negotiate,
+    detections_to_array,
+    detection_columns
+)
 from .schemas import (
     RecognitionResponse,
     RecognitionListItem,
     StatsResponse,
+    RollupResponse,
     HealthResponse,
     MessageResponse
 )
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
-
-# Initialize services (singletons)
-yolo_service = YOLOService()
+# Initialize services (singletons; the model is shared, see model.py)
 file_service = FileService(upload_dir=Path("../uploads"))
+rendition_service = RenditionService(upload_dir=Path("../uploads"))
 
 # Create router
 router = APIRouter(prefix="/detect", tags=["Detection"])
@@ -31,30 +46,54 @@ router = APIRouter(prefix="/detect", tags=["Detection"])
 
 def get_recognition_service(db: Session = Depends(get_db)) -> RecognitionService:
     """Dependency injection for RecognitionService"""
-    return RecognitionService(db, yolo_service, file_service)
+    return RecognitionService(db, current_model(), file_service, rendition_service)
+
+
+def get_routed_recognition_service(
+    db: Session = Depends(get_db),
+    yolo_service: YOLOService = Depends(routed_model)
+) -> RecognitionService:
+    """Dependency injection for RecognitionService running detection (model picked per request, 503 until loaded)"""
+    return RecognitionService(db, yolo_service, file_service, rendition_service)
 
 
 @router.post("", response_model=RecognitionResponse, status_code=201)
 @limiter.limit("10/minute")
 async def detect_cows(
     request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    service: RecognitionService = Depends(get_recognition_service)
+    service: RecognitionService = Depends(get_routed_recognition_service)
 ):
     """
     Upload an image and detect cows using YOLO
     
     - **file**: Image file (JPG or PNG, max 5MB)
+    - **latency_budget_ms** / **quality**: model choice when several are loaded
     - **Rate limit**: 10 requests per minute per IP address
+    - **Admission**: 503 with Retry-After while the server is saturated
     
-    Returns detection results with cow count and bounding boxes
+    Returns detection results with cow count and bounding boxes, and the model that served them
     """
-    recognition = await service.detect_and_save(file)
-    return recognition.to_dict()
+    metrics.set_endpoint("detect")
+    scheduling.set_priority(scheduling.INTERACTIVE)
+    with admission.admit(1, "detect"):
+        recognition = await service.detect_and_save(file)
+    
+    # Thumbnail and preview are rendered after the response is sent
+    background_tasks.add_task(rendition_service.generate_safe, recognition.image_path)
+    
+    # JSONResponse renders the body here, so the stage covers encoding (a returned dict is encoded later)
+    with metrics.stage(metrics.SERIALIZE):
+        return JSONResponse(
+            status_code=201,
+            content=jsonable_encoder({**recognition.to_dict(), "model": service.yolo_service.name})
+        )
 
 
 @router.get("/history", response_model=List[RecognitionListItem])
 async def get_history(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     service: RecognitionService = Depends(get_recognition_service)
@@ -67,13 +106,45 @@ async def get_history(
     
     Returns list of all detections, sorted by date (newest first)
     """
-    recognitions = service.get_history(skip=skip, limit=limit)
-    return [rec.to_dict_short() for rec in recognitions]
+    return cached_json_response(
+        request,
+        (RECOGNITIONS, "history", skip, limit),
+        lambda: [rec.to_dict_short() for rec in service.get_history(skip=skip, limit=limit)]
+    )
+
+
+@router.get("/export")
+@limiter.limit("5/minute")
+async def export_history(
+    request: Request,
+    format: str = Query(export.CSV, description="csv or parquet"),
+    detections: bool = Query(False, description="One row per detection instead of per recognition"),
+    start: Optional[datetime] = Query(None, description="Only recognitions created at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only recognitions created before this time"),
+    cursor: int = Query(0, ge=0, description="Resume after this recognition id")
+):
+    """
+    Export whole detection history as CSV or Parquet (streamed)
+    
+    Rows are sorted by id. To resume an interrupted export, pass the id of
+    the last complete recognition received as **cursor**.
+    """
+    if format not in export.available_formats():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported export format. Available: {', '.join(export.available_formats())}"
+        )
+    return StreamingResponse(
+        export.export_recognitions(format, detections=detections, start=start, end=end, cursor=cursor),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="recognitions.{format}"'}
+    )
 
 
 @router.get("/{recognition_id}", response_model=RecognitionResponse)
 async def get_recognition(
     recognition_id: int,
+    request: Request,
     service: RecognitionService = Depends(get_recognition_service)
 ):
     """
@@ -81,10 +152,73 @@ async def get_recognition(
     
     - **recognition_id**: Recognition ID
     
-    Returns full detection details including bounding boxes
+    Returns full detection details including bounding boxes.
+    Send `Accept: application/x-cowcount-f32` or `application/msgpack`
+    to get detections as compact columns instead of JSON.
+    """
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type != JSON_MEDIA_TYPE:
+        recognition = service.get_by_id(recognition_id)
+        return ColumnarResponse(
+            meta=recognition.to_dict_short(),
+            columns=detection_columns(detections_to_array(recognition.result)),
+            media_type=media_type
+        )
+    
+    return cached_json_response(
+        request,
+        (RECOGNITIONS, "detail", recognition_id),
+        lambda: service.get_by_id(recognition_id).to_dict(),
+        vary="Accept, Accept-Encoding"
+    )
+
+
+async def _rendition_response(
+    request: Request,
+    service: RecognitionService,
+    recognition_id: int,
+    name: str
+) -> RangeFileResponse:
+    """
+    Serve rendition, rendering it off the event loop if not cached yet
+    Always revalidated: ids can be reused after a delete, the ETag follows the file
+    """
+    path = await run_in_threadpool(service.get_rendition, recognition_id, name)
+    return RangeFileResponse(
+        path,
+        request.headers,
+        method=request.method,
+        media_type="image/webp",
+        cache_control="no-cache"
+    )
+
+
+@router.get("/{recognition_id}/thumbnail", response_class=FileResponse)
+async def get_thumbnail(
+    recognition_id: int,
+    request: Request,
+    service: RecognitionService = Depends(get_recognition_service)
+):
+    """
+    Get small WebP thumbnail of recognition image (for lists)
+    
+    - **recognition_id**: Recognition ID
+    """
+    return await _rendition_response(request, service, recognition_id, "thumbnail")
+
+
+@router.get("/{recognition_id}/preview", response_class=FileResponse)
+async def get_preview(
+    recognition_id: int,
+    request: Request,
+    service: RecognitionService = Depends(get_recognition_service)
+):
+    """
+    Get medium-size WebP preview of recognition image
+    
+    - **recognition_id**: Recognition ID
     """
-    recognition = service.get_by_id(recognition_id)
-    return recognition.to_dict()
+    return await _rendition_response(request, service, recognition_id, "preview")
 
 
 @router.delete("/{recognition_id}", response_model=MessageResponse)
@@ -103,6 +237,7 @@ async def delete_recognition(
 
 @router.get("/stats/summary", response_model=StatsResponse)
 async def get_stats(
+    request: Request,
     service: RecognitionService = Depends(get_recognition_service)
 ):
     """
@@ -110,4 +245,21 @@ async def get_stats(
     
     Returns total detections, total cows, and average cows per image
     """
-    return service.get_stats()
+    return cached_json_response(request, (RECOGNITIONS, "stats"), service.get_stats)
+
+
+@router.get("/stats/rollups", response_model=RollupResponse)
+async def get_rollups(
+    resolution: str = Query("hour", description="hour, day or week"),
+    source: str = Query("image", description="image (per recognition) or video (per analyzed frame)"),
+    start: Optional[datetime] = Query(None, description="Range start (default: 168 buckets before end)"),
+    end: Optional[datetime] = Query(None, description="Range end, exclusive (default: end of current bucket)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Get cow count time series (samples, total, min, max, average per bucket)
+    
+    Served from precomputed rollups: cost depends on the number of buckets,
+    not on the number of stored detections. Times are UTC.
+    """
+    return RollupService(db).get_range(resolution, source=source, start=start, end=end)
@@ -0,0 +1,145 @@
+"""
+Priority classes for model access
+
+Live stream frames, interactive uploads and batch video analyses share one
+model. Every model run takes a slot from the service's scheduler. While runs
+wait, slots go to the priority classes in proportion to their shares
+(INFERENCE_SHARES, default "realtime=6,interactive=3,batch=1"). This uses
+start-time fair queueing, so an idle class does not bank credit. Idle capacity
+is used by whoever is waiting. A video analysis takes one slot per frame, so
+live frames get in between its frames instead of waiting for the whole video.
+
+Concurrent runs are limited to INFERENCE_CONCURRENCY for an in-process model
+and to the worker count of the inference server. Keeping the backlog here,
+instead of in the model or server queue, is what lets priorities apply.
+
+The class comes from a context variable set once per request/session with
+`set_priority(...)`, like the metrics endpoint label.
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Deque, Dict, Optional
+import os
+import threading
+
+from . import metrics, tracing
+
+REALTIME = "realtime"
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Highest priority first (ties go to the earlier class)
+PRIORITIES = (REALTIME, INTERACTIVE, BATCH)
+
+_priority: ContextVar[str] = ContextVar("inference_priority", default=INTERACTIVE)
+
+
+def parse_shares(spec: str) -> Dict[str, float]:
+    """"realtime=6,interactive=3,batch=1" -> {"realtime": 6.0, ...}"""
+    shares = {REALTIME: 6.0, INTERACTIVE: 3.0, BATCH: 1.0}
+    for part in spec.split(","):
+        name, _, value = part.strip().partition("=")
+        if name not in shares or not value:
+            continue
+        shares[name] = max(float(value), 0.01)
+    return shares
+
+
+INFERENCE_SHARES = parse_shares(os.getenv("INFERENCE_SHARES", ""))
+
+# Concurrent runs on an in-process model (the inference server uses its worker count)
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "1"))
+
+
+def set_priority(priority: str) -> None:
+    """Set priority class for model runs in current request/session"""
+    _priority.set(priority)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+class PriorityScheduler:
+    """
+    Grants `concurrency` model slots to waiting runs by priority share
+    """
+
+    def __init__(self, concurrency: int = 1, shares: Dict[str, float] = INFERENCE_SHARES):
+        self.concurrency = max(1, concurrency)
+        self.shares = shares
+        self.active = 0
+        self._cond = threading.Condition()
+        self._waiting: Dict[str, Deque[object]] = {priority: deque() for priority in PRIORITIES}
+        # Virtual start time per class and of the last granted run
+        self._tags = {priority: 0.0 for priority in PRIORITIES}
+        self._virtual_time = 0.0
+        # Moving average of time a run holds its slot (None until measured)
+        self.seconds_per_run: Optional[float] = None
+
+    def _next_priority(self) -> str:
+        backlogged = [priority for priority in PRIORITIES if self._waiting[priority]]
+        return min(backlogged, key=lambda priority: (self._tags[priority], PRIORITIES.index(priority)))
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None):
+        """Hold one model slot for the block (waits by priority)"""
+        priority = priority or current_priority()
+        ticket = object()
+        start = perf_counter()
+        with self._cond:
+            queue = self._waiting[priority]
+            if not queue:
+                # Class becomes backlogged: start at current virtual time (no banked credit)
+                self._tags[priority] = max(self._tags[priority], self._virtual_time)
+            queue.append(ticket)
+            while not (
+                self.active < self.concurrency
+                and queue[0] is ticket
+                and self._next_priority() == priority
+            ):
+                self._cond.wait()
+            queue.popleft()
+            self.active += 1
+            self._virtual_time = self._tags[priority]
+            self._tags[priority] += 1 / self.shares[priority]
+            # Another slot may still be free for the next class
+            self._cond.notify_all()
+
+        waited = perf_counter() - start
+        metrics.QUEUE_WAIT_SECONDS.labels(priority).observe(waited)
+        tracing.record(metrics.QUEUE_WAIT, waited)
+        try:
+            yield
+        finally:
+            held = perf_counter() - start - waited
+            with self._cond:
+                self.active -= 1
+                self.record_run(held)
+                self._cond.notify_all()
+            metrics.INFERENCE_LATENCY_SECONDS.labels(priority).observe(perf_counter() - start)
+
+    def record_run(self, seconds: float) -> None:
+        """Add measured run time to the moving average"""
+        if self.seconds_per_run is None:
+            self.seconds_per_run = seconds
+        else:
+            self.seconds_per_run = 0.8 * self.seconds_per_run + 0.2 * seconds
+
+    def expected_latency(self) -> Optional[float]:
+        """Seconds a run submitted now would take, queue wait included (None until measured)"""
+        if self.seconds_per_run is None:
+            return None
+        backlog = self.active + sum(len(queue) for queue in self._waiting.values())
+        return (backlog // self.concurrency + 1) * self.seconds_per_run
+
+    def status(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "waiting": {priority: len(queue) for priority, queue in self._waiting.items()},
+            "shares": self.shares,
+            "seconds_per_run": round(self.seconds_per_run, 4) if self.seconds_per_run is not None else None,
+        }
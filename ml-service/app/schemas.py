@@ -42,6 +42,10 @@ class RecognitionResponse(BaseModel):
     cowsCount: int
     result: List[dict]
     createdAt: str
+    thumbnailUrl: str
+    previewUrl: str
+    # Model that ran the detection (only in detection responses)
+    model: Optional[str] = None
     
     class Config:
         json_schema_extra = {
@@ -50,7 +54,10 @@ class RecognitionResponse(BaseModel):
                 "imagePath": "1234567890.jpg",
                 "cowsCount": 3,
                 "result": [],
-                "createdAt": "2026-01-29T12:00:00"
+                "createdAt": "2026-01-29T12:00:00",
+                "thumbnailUrl": "/detect/1/thumbnail",
+                "previewUrl": "/detect/1/preview",
+                "model": "yolov8n"
             }
         }
 
@@ -61,6 +68,8 @@ class RecognitionListItem(BaseModel):
     imagePath: str
     cowsCount: int
     createdAt: str
+    thumbnailUrl: str
+    previewUrl: str
 
 
 class StatsResponse(BaseModel):
@@ -70,6 +79,87 @@ class StatsResponse(BaseModel):
     averageCowsPerImage: float
 
 
+class RollupBucket(BaseModel):
+    """Cow count aggregates of one time bucket"""
+    start: datetime
+    samples: int
+    totalCows: int
+    minCows: int
+    maxCows: int
+    averageCows: float
+
+
+class RollupResponse(BaseModel):
+    """Time series of cow count rollups"""
+    source: str
+    resolution: str
+    start: datetime
+    end: datetime
+    buckets: List[RollupBucket]
+
+
+class VideoAnalysisResponse(BaseModel):
+    """Stored video analysis summary"""
+    id: int
+    video_filename: str
+    sample_interval: float
+    duration: float
+    fps: int
+    width: int
+    height: int
+    total_frames: int
+    analyzed_frames: int
+    total_cows_detected: int
+    max_cows_in_frame: int
+    average_cows_per_frame: float
+    created_at: str
+
+
+class VideoDetectionsResponse(BaseModel):
+    """Detections of stored video analysis for a time window"""
+    analysis_id: int
+    start: Optional[float] = None
+    end: Optional[float] = None
+    detections_by_time: List[dict]
+
+
+class UploadCreateRequest(BaseModel):
+    """Start of a resumable video upload"""
+    filename: str
+    size: int
+
+
+class UploadStatusResponse(BaseModel):
+    """State of a resumable video upload"""
+    upload_id: str
+    filename: str
+    size: int
+    offset: int
+    received: int
+    complete: bool
+    missing: List[List[int]]
+    chunk_size: int
+
+
+class RoiRequest(BaseModel):
+    """Region of interest: polygon points [x, y] as fractions of frame width and height"""
+    polygon: List[List[float]]
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "polygon": [[0.1, 0.4], [0.9, 0.4], [0.95, 1.0], [0.05, 1.0]]
+            }
+        }
+
+
+class RoiResponse(BaseModel):
+    """Stored region of interest"""
+    name: str
+    polygon: List[List[float]]
+    updated_at: Optional[str]
+
+
 class HealthResponse(BaseModel):
     """Health check response"""
     status: str
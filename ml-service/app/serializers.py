@@ -0,0 +1,181 @@
+"""
+Compact response encodings for detection-heavy endpoints
+
+Besides JSON, detection results can be sent as:
+- application/x-cowcount-f32: flat little-endian arrays with a small JSON schema header
+- application/msgpack: the same columnar document packed with msgpack (if installed)
+
+Both carry scalar fields in "meta" and detections as named columns
+(confidence, x1, y1, x2, y2 as float32), so no per-detection dicts are built.
+"""
+from fastapi import Response
+from typing import Dict, List, Optional, Tuple
+import json
+import struct
+
+import numpy as np
+
+# Optional msgpack support
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # msgpack encoding is optional
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+F32_MEDIA_TYPE = "application/x-cowcount-f32"
+
+# Short names accepted by WebSocket "format" query parameter
+FORMATS = {
+    "json": JSON_MEDIA_TYPE,
+    "msgpack": MSGPACK_MEDIA_TYPE,
+    "f32": F32_MEDIA_TYPE,
+}
+
+F32_MAGIC = b"CCF1"
+_ALIGNMENT = 8
+
+# Column order of (N, 5) detection arrays returned by YOLOService.detect_array
+DETECTION_FIELDS = ("confidence", "x1", "y1", "x2", "y2")
+
+
+def available_media_types() -> List[str]:
+    """Media types this server can produce"""
+    media_types = [JSON_MEDIA_TYPE, F32_MEDIA_TYPE]
+    if msgpack is not None:
+        media_types.append(MSGPACK_MEDIA_TYPE)
+    return media_types
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Pick response media type from Accept header
+    Falls back to JSON when nothing compact is explicitly preferred
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+
+    supported = available_media_types()
+    best, best_q = JSON_MEDIA_TYPE, 0.0
+    for part in accept.split(","):
+        fields = part.strip().split(";")
+        media_type = fields[0].strip().lower()
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # Only exact matches select a compact format; wildcards mean JSON
+        if media_type in supported and q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def detections_to_array(detections: List[dict]) -> np.ndarray:
+    """Convert detection dicts (as stored in Recognition.result) to (N, 5) float32 array"""
+    array = np.empty((len(detections), len(DETECTION_FIELDS)), dtype=np.float32)
+    for i, det in enumerate(detections):
+        bbox = det["bbox"]
+        array[i] = (det["confidence"], bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"])
+    return array
+
+
+def detection_columns(array: np.ndarray) -> Dict[str, np.ndarray]:
+    """Split (N, 5) detection array into named columns"""
+    return {name: array[:, i] for i, name in enumerate(DETECTION_FIELDS)}
+
+
+def _little_endian(column: np.ndarray) -> np.ndarray:
+    """Contiguous little-endian copy/view of column"""
+    column = np.asarray(column)
+    return np.ascontiguousarray(column, dtype=column.dtype.newbyteorder("<"))
+
+
+def encode_f32(meta: dict, columns: Dict[str, np.ndarray]) -> bytes:
+    """
+    Encode columnar document:
+    magic (4 bytes) | header length (uint32 LE) | JSON header | aligned column data
+    Header lists name, dtype, length and byte offset of each column
+    """
+    schema = []
+    chunks = []
+    offset = 0
+    for name, column in columns.items():
+        data = _little_endian(column)
+        raw = data.tobytes()
+        schema.append({
+            "name": name,
+            "dtype": data.dtype.str,
+            "length": int(data.shape[0]),
+            "offset": offset
+        })
+        padding = -len(raw) % _ALIGNMENT
+        chunks.append(raw)
+        if padding:
+            chunks.append(b"\0" * padding)
+        offset += len(raw) + padding
+
+    header = json.dumps({"meta": meta, "columns": schema}, separators=(",", ":")).encode()
+    header += b" " * (-(len(F32_MAGIC) + 4 + len(header)) % _ALIGNMENT)
+    return b"".join([F32_MAGIC, struct.pack("<I", len(header)), header, *chunks])
+
+
+def decode_f32(payload: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Decode document produced by encode_f32 (zero-copy views into payload)"""
+    if payload[:4] != F32_MAGIC:
+        raise ValueError("Not a cowcount-f32 payload")
+    (header_len,) = struct.unpack_from("<I", payload, 4)
+    data_start = 8 + header_len
+    header = json.loads(payload[8:data_start])
+    columns = {
+        col["name"]: np.frombuffer(payload, dtype=np.dtype(col["dtype"]), count=col["length"], offset=data_start + col["offset"])
+        for col in header["columns"]
+    }
+    return header["meta"], columns
+
+
+def encode_msgpack(meta: dict, columns: Dict[str, np.ndarray]) -> bytes:
+    """Encode columnar document with msgpack (columns as raw little-endian bytes)"""
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb({
+        "meta": meta,
+        "columns": {
+            name: {"dtype": data.dtype.str, "data": data.tobytes()}
+            for name, data in ((name, _little_endian(column)) for name, column in columns.items())
+        }
+    }, use_bin_type=True)
+
+
+def decode_msgpack(payload: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Decode document produced by encode_msgpack"""
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    document = msgpack.unpackb(payload, raw=False)
+    columns = {
+        name: np.frombuffer(column["data"], dtype=np.dtype(column["dtype"]))
+        for name, column in document["columns"].items()
+    }
+    return document["meta"], columns
+
+
+def encode(media_type: str, meta: dict, columns: Dict[str, np.ndarray]) -> bytes:
+    """Encode columnar document in given compact media type"""
+    if media_type == F32_MEDIA_TYPE:
+        return encode_f32(meta, columns)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return encode_msgpack(meta, columns)
+    raise ValueError(f"Unsupported compact media type: {media_type}")
+
+
+class ColumnarResponse(Response):
+    """
+    Response with columnar document in compact encoding
+    """
+
+    def __init__(self, meta: dict, columns: Dict[str, np.ndarray], media_type: str, **kwargs):
+        super().__init__(content=encode(media_type, meta, columns), media_type=media_type, **kwargs)
+        self.headers["Vary"] = "Accept"
@@ -2,14 +2,16 @@
 Service layer - contains business logic
 """
 from fastapi import UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from PIL import Image
-from ultralytics import YOLO
 from pathlib import Path
-from datetime import datetime
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import io
 import os
+import time
+
+import numpy as np
 
 # Register AVIF plugin if available
 try:
@@ -19,6 +21,12 @@ except ImportError:
 
 from .repositories import RecognitionRepository
 from .models import Recognition
+from .cache import TTLCache, RECOGNITIONS, response_cache
+from .renditions import RenditionService
+from .write_behind import RecognitionWriter, recognition_writer
+from . import storage
+from .scheduling import INFERENCE_CONCURRENCY, PriorityScheduler
+from . import metrics
 
 
 class YOLOService:
@@ -26,10 +34,18 @@ class YOLOService:
     Service for YOLO model operations
     """
     
-    def __init__(self):
+    def __init__(self, weights: str = "yolov8n.pt"):
+        # Only a local file is accepted: ultralytics would otherwise try to download missing weights
+        weights_path = Path(weights)
+        if not weights_path.is_file():
+            raise FileNotFoundError(f"Model weights not found: {weights_path.absolute()} (set MODEL_WEIGHTS)")
+        
+        # Heavy imports are deferred until a model is actually loaded
+        import torch
+        from ultralytics import YOLO
+        
         # Fix for PyTorch 2.6+ weights_only issue
         # Temporarily patch torch.load to use weights_only=False for YOLO
-        import torch
         original_load = torch.load
         
         def patched_load(*args, **kwargs):
@@ -37,46 +53,103 @@ class YOLOService:
             return original_load(*args, **kwargs)
         
         torch.load = patched_load
-        self.model = YOLO("yolov8n.pt")
-        torch.load = original_load  # Restore original
+        load_start = time.perf_counter()
+        try:
+            self.model = YOLO(str(weights_path))
+        finally:
+            torch.load = original_load  # Restore original
+        metrics.MODEL_LOAD_SECONDS.labels(weights_path.name).set(time.perf_counter() - load_start)
+        # Reported with results (model routing, see model_router.py)
+        self.name = weights_path.stem
+        
+        # Class ids for cows (class 19 in COCO dataset is 'cow')
+        self.cow_class_ids = [
+            class_id for class_id, name in self.model.names.items()
+            if name.lower() == 'cow'
+        ]
+        self.cow_class_name = self.model.names[self.cow_class_ids[0]] if self.cow_class_ids else "cow"
+        
+        # Model runs are granted by priority class (see scheduling.py)
+        self.scheduler = PriorityScheduler(INFERENCE_CONCURRENCY)
+    
+    def warmup(self, size: int = 640) -> None:
+        """
+        Run one inference on a blank image (initialises kernels and buffers)
+        Its time is the first latency estimate for model routing
+        """
+        start = time.perf_counter()
+        self.model(np.zeros((size, size, 3), dtype=np.uint8), verbose=False)
+        self.scheduler.record_run(time.perf_counter() - start)
+    
+    def cow_boxes(self, results) -> np.ndarray:
+        """
+        Extract cow detections from YOLO results without building per-box objects
+        Returns: float32 array of shape (N, 5) with columns confidence, x1, y1, x2, y2
+        """
+        arrays = []
+        for result in results:
+            # boxes.data rows are [x1, y1, x2, y2, (track_id,) confidence, class_id]
+            data = result.boxes.data.cpu().numpy()
+            mask = np.isin(data[:, -1].astype(np.int64), self.cow_class_ids)
+            arrays.append(data[mask][:, [-2, 0, 1, 2, 3]])
+        
+        if not arrays:
+            return np.empty((0, 5), dtype=np.float32)
+        return np.concatenate(arrays).astype(np.float32, copy=False)
+    
+    def infer(self, image):
+        """Run YOLO model on image when scheduler grants a slot (tracked as inference stage and queue depth)"""
+        metrics.INFERENCE_QUEUE_DEPTH.inc()
+        try:
+            with self.scheduler.slot(), metrics.stage(metrics.INFERENCE):
+                return self.model(image)
+        finally:
+            metrics.INFERENCE_QUEUE_DEPTH.dec()
+    
+    def infer_batch(self, images: List[np.ndarray]) -> list:
+        """Run YOLO model once on several RGB frames; one raw result per frame"""
+        return list(self.infer(images))
+    
+    def result_boxes(self, result) -> np.ndarray:
+        """Cow boxes of one raw result from infer_batch"""
+        return self.cow_boxes([result])
+    
+    def detect_array(self, image) -> np.ndarray:
+        """
+        Detect cows in image (PIL image or RGB numpy array) using YOLO
+        Returns: float32 array of shape (N, 5) with columns confidence, x1, y1, x2, y2
+        """
+        results = self.infer(image)
+        with metrics.stage(metrics.POSTPROCESS):
+            return self.cow_boxes(results)
     
     def detect_cows(self, image: Image.Image) -> Tuple[List[dict], int]:
         """
         Detect cows in image using YOLO
         Returns: (detections, cows_count)
         """
-        # Run YOLO detection
-        results = self.model(image)
+        results = self.infer(image)
         
-        # Process results
-        detections = []
-        cows_count = 0
+        with metrics.stage(metrics.POSTPROCESS):
+            detections = self.to_dicts(self.cow_boxes(results))
         
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                # Get class name
-                class_id = int(box.cls[0])
-                class_name = self.model.names[class_id]
-                
-                # Filter for cows (class 19 in COCO dataset is 'cow')
-                if class_name.lower() == 'cow':
-                    confidence = float(box.conf[0])
-                    bbox = box.xyxy[0].tolist()  # [x1, y1, x2, y2]
-                    
-                    detections.append({
-                        "class": class_name,
-                        "confidence": confidence,
-                        "bbox": {
-                            "x1": bbox[0],
-                            "y1": bbox[1],
-                            "x2": bbox[2],
-                            "y2": bbox[3]
-                        }
-                    })
-                    cows_count += 1
-        
-        return detections, cows_count
+        return detections, len(detections)
+    
+    def to_dicts(self, boxes: np.ndarray) -> List[dict]:
+        """Convert (N, 5) detection array to detection dicts"""
+        return [
+            {
+                "class": self.cow_class_name,
+                "confidence": confidence,
+                "bbox": {
+                    "x1": x1,
+                    "y1": y1,
+                    "x2": x2,
+                    "y2": y2
+                }
+            }
+            for confidence, x1, y1, x2, y2 in boxes.tolist()
+        ]
 
 
 class FileService:
@@ -130,25 +203,19 @@ class FileService:
                 detail="File size exceeds 20MB limit."
             )
         
-        # Generate unique filename
-        timestamp = int(datetime.now().timestamp() * 1000)
+        # Unique sharded name (see storage.py)
         file_extension = os.path.splitext(file.filename)[1]
-        filename = f"{timestamp}{file_extension}"
-        file_path = self.upload_dir / filename
+        filename, file_path = storage.allocate(self.upload_dir, storage.IMAGES, file_extension)
         
         # Save file
-        with open(file_path, "wb") as f:
+        with open(file_path, "xb") as f:
             f.write(contents)
         
         return filename, contents
     
     def delete_file(self, filename: str) -> bool:
         """Delete file from uploads directory"""
-        file_path = self.upload_dir / filename
-        if file_path.exists():
-            file_path.unlink()
-            return True
-        return False
+        return storage.remove(self.upload_dir, filename) > 0
     
     def load_image(self, contents: bytes) -> Image.Image:
         """Load image from bytes"""
@@ -177,11 +244,17 @@ class RecognitionService:
         self,
         db: Session,
         yolo_service: YOLOService,
-        file_service: FileService
+        file_service: FileService,
+        rendition_service: Optional[RenditionService] = None,
+        cache: TTLCache = response_cache,
+        writer: RecognitionWriter = recognition_writer
     ):
         self.repository = RecognitionRepository(db)
+        self.writer = writer
         self.yolo_service = yolo_service
         self.file_service = file_service
+        self.rendition_service = rendition_service
+        self.cache = cache
     
     async def detect_and_save(self, file: UploadFile) -> Recognition:
         """
@@ -192,20 +265,29 @@ class RecognitionService:
             self.file_service.validate_file(file)
             
             # Save file
-            filename, contents = await self.file_service.save_file(file)
+            with metrics.stage(metrics.UPLOAD_READ):
+                filename, contents = await self.file_service.save_file(file)
             
             # Load image
-            image = self.file_service.load_image(contents)
+            with metrics.stage(metrics.DECODE):
+                image = self.file_service.load_image(contents)
             
-            # Detect cows
-            detections, cows_count = self.yolo_service.detect_cows(image)
+            # Detect cows (off the event loop, so waiting for the model blocks no other request)
+            detections, cows_count = await run_in_threadpool(self.yolo_service.detect_cows, image)
             
-            # Save to database
-            recognition = self.repository.create(
-                image_path=filename,
-                result=detections,
-                cows_count=cows_count
-            )
+            # Save to database (or queue for a batched write, see write_behind.py)
+            with metrics.stage(metrics.DB_WRITE):
+                if self.writer.active:
+                    recognition = await run_in_threadpool(self.writer.submit, filename, detections, cows_count)
+                else:
+                    recognition = self.repository.create(
+                        image_path=filename,
+                        result=detections,
+                        cows_count=cows_count
+                    )
+            
+            # Cached history/detail/stats are stale now
+            self.cache.invalidate(RECOGNITIONS)
             
             return recognition
             
@@ -225,8 +307,8 @@ class RecognitionService:
         return self.repository.get_all(skip=skip, limit=limit)
     
     def get_by_id(self, recognition_id: int) -> Recognition:
-        """Get recognition by ID"""
-        recognition = self.repository.get_by_id(recognition_id)
+        """Get recognition by ID (also while its write-behind batch is pending)"""
+        recognition = self.repository.get_by_id(recognition_id) or self.writer.get(recognition_id)
         if not recognition:
             raise HTTPException(status_code=404, detail="Recognition not found")
         return recognition
@@ -234,12 +316,25 @@ class RecognitionService:
     def delete(self, recognition_id: int) -> None:
         """Delete recognition and its file"""
         recognition = self.get_by_id(recognition_id)
+        if self.writer.get(recognition_id) is not None:
+            raise HTTPException(status_code=409, detail="Recognition is still being saved, try again shortly")
         
-        # Delete file
+        # Delete file and its renditions
         self.file_service.delete_file(recognition.image_path)
+        if self.rendition_service:
+            self.rendition_service.delete(recognition.image_path)
         
         # Delete from database
         self.repository.delete(recognition_id)
+        self.cache.invalidate(RECOGNITIONS)
+    
+    def get_rendition(self, recognition_id: int, name: str) -> Path:
+        """Get path of image rendition (thumbnail/preview), generating it if missing"""
+        recognition = self.get_by_id(recognition_id)
+        path = self.rendition_service.get(recognition.image_path, name) if self.rendition_service else None
+        if path is None:
+            raise HTTPException(status_code=404, detail="Image file not found")
+        return path
     
     def get_stats(self) -> dict:
         """Get statistics"""
@@ -0,0 +1,66 @@
+"""
+Startup timing report and readiness state
+"""
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """
+    Durations of startup phases (imports, database, model load, warm-up)
+    and whether the process is ready to serve detection requests
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+        self.ready_after: Optional[float] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record phase duration"""
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time block as startup phase"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def mark_ready(self) -> None:
+        """All phases done, detection requests can be served"""
+        self.ready = True
+        self.ready_after = perf_counter() - self.started
+
+    def mark_failed(self, error: str) -> None:
+        """Startup failed (process stays live, but never becomes ready)"""
+        self.error = error
+
+    def to_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "ready_after_ms": round(self.ready_after * 1000, 1) if self.ready_after is not None else None,
+        }
+
+    def log(self) -> None:
+        """Log one line per phase"""
+        for name, seconds in self.phases.items():
+            logger.info(f"Startup phase {name}: {seconds * 1000:.0f} ms")
+        if self.ready:
+            logger.info(f"Ready after {self.ready_after * 1000:.0f} ms")
+        elif self.error:
+            logger.error(f"Startup failed: {self.error}")
+
+
+# Report of this process (main.py starts timing before importing the app)
+startup_report = StartupReport()
@@ -0,0 +1,91 @@
+"""
+Upload storage layout
+
+New uploads get random 128-bit names and are spread over two levels of
+directories taken from the name, separately for images and videos:
+
+    images/3f/a2/3fa2c0...e1.jpg
+    videos/9b/07/9b07d4...5c.mp4
+
+The stored name (Recognition.image_path, VideoAnalysis.video_filename) is the
+path relative to the upload directory, so /uploads/<name> keeps working. Names
+cannot collide under concurrency and no directory grows past a few hundred
+entries. Older flat files (<timestamp>.jpg) keep working where they are.
+"""
+from pathlib import Path, PurePosixPath
+from typing import Dict, Optional, Tuple
+import os
+import shutil
+import uuid
+
+# Same upload directory as the routers and the static mount
+UPLOAD_DIR = Path("../uploads")
+
+IMAGES = "images"
+VIDEOS = "videos"
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tiff', '.tif'}
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.webm'}
+
+
+def new_name(kind: str, extension: str) -> str:
+    """Collision-free sharded name relative to upload directory"""
+    name = uuid.uuid4().hex
+    return f"{kind}/{name[:2]}/{name[2:4]}/{name}{extension.lower()}"
+
+
+def allocate(upload_dir: Path, kind: str, extension: str) -> Tuple[str, Path]:
+    """
+    New sharded name for an upload, with its directory created
+    Returns: (stored name, file path)
+    """
+    filename = new_name(kind, extension)
+    file_path = upload_dir / filename
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    return filename, file_path
+
+
+def resolve(upload_dir: Path, filename: str) -> Optional[Path]:
+    """Path of stored name, None if the name points outside the upload directory"""
+    name = PurePosixPath(filename)
+    if not filename or name.is_absolute() or ".." in name.parts or "\\" in filename:
+        return None
+    return upload_dir / name
+
+
+def kind_of(filename: str) -> Optional[str]:
+    """IMAGES / VIDEOS for stored name (by extension, so legacy flat names work too)"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return IMAGES
+    if extension in VIDEO_EXTENSIONS:
+        return VIDEOS
+    return None
+
+
+def is_video_name(filename: str) -> bool:
+    """Name of a stored video: sharded under videos/ or a legacy flat name (not images, renditions, staging)"""
+    if kind_of(filename) != VIDEOS:
+        return False
+    parts = PurePosixPath(filename).parts
+    return len(parts) == 1 or parts[0] == VIDEOS
+
+
+def remove(upload_dir: Path, filename: str) -> int:
+    """Delete stored file; returns bytes freed"""
+    file_path = resolve(upload_dir, filename)
+    if file_path is None:
+        return 0
+    try:
+        size = file_path.stat().st_size
+        file_path.unlink()
+    except FileNotFoundError:
+        return 0
+    # Shard directories are left in place (bounded number; removing them would race with new uploads)
+    return size
+
+
+def disk_usage(upload_dir: Path) -> Dict[str, int]:
+    """Size and free space of the volume holding the upload directory"""
+    usage = shutil.disk_usage(upload_dir)
+    return {"total_bytes": usage.total, "used_bytes": usage.used, "free_bytes": usage.free}
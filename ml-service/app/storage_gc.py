@@ -0,0 +1,423 @@
+"""
+Upload retention and background garbage collection
+
+One collection pass, in order:
+
+    retention by age     recognitions / video analyses older than RETENTION_*_DAYS,
+                         with their files, renditions and detection columns
+    orphan files         uploads no row refers to (failed requests, deleted analyses)
+    retention by size    oldest uploads beyond RETENTION_*_MAX_GB
+    missing files        recognitions whose image is gone
+    renditions           thumbnails/previews whose source is gone
+    partial uploads      resumable uploads idle for UPLOAD_EXPIRE_HOURS
+    detection columns    stored columns of deleted analyses
+
+Rows and files are handled STORAGE_GC_BATCH at a time with a short database
+transaction per batch, so the API is never blocked for long. Files younger
+than STORAGE_GC_GRACE seconds are never treated as orphans: their row may not
+be committed yet. A file lock keeps API workers and the manage.py command
+from collecting at the same time. Retention settings of 0 mean "keep forever".
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_
+
+from .cache import RECOGNITIONS, response_cache
+from .database import SessionLocal
+from .detection_store import DetectionStore
+from .models import ROLLUP_RESOLUTIONS, IMAGE_SOURCE, VIDEO_SOURCE, Recognition, VideoAnalysis, bucket_start
+from .renditions import RENDITION_SIZES, RenditionService
+from .repositories import RecognitionRepository, RollupRepository, VideoAnalysisRepository
+from .resumable_uploads import STAGING_DIRNAME
+from . import metrics, storage
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background passes (0 disables the background collector)
+STORAGE_GC_INTERVAL = float(os.getenv("STORAGE_GC_INTERVAL", "3600"))
+
+# Rows / files per database round trip
+STORAGE_GC_BATCH = int(os.getenv("STORAGE_GC_BATCH", "500"))
+
+# Minimum age (seconds) before an unreferenced file counts as orphan
+STORAGE_GC_GRACE = float(os.getenv("STORAGE_GC_GRACE", "3600"))
+
+RETENTION_IMAGE_DAYS = float(os.getenv("RETENTION_IMAGE_DAYS", "0"))
+RETENTION_VIDEO_DAYS = float(os.getenv("RETENTION_VIDEO_DAYS", "0"))
+RETENTION_IMAGE_MAX_GB = float(os.getenv("RETENTION_IMAGE_MAX_GB", "0"))
+RETENTION_VIDEO_MAX_GB = float(os.getenv("RETENTION_VIDEO_MAX_GB", "0"))
+
+# Resumable uploads without a chunk for this long are discarded
+UPLOAD_EXPIRE_HOURS = float(os.getenv("UPLOAD_EXPIRE_HOURS", "24"))
+
+STORAGE_GC_LOCK = Path(os.getenv("STORAGE_GC_LOCK", "./data/storage_gc.lock"))
+
+RENDITIONS = "renditions"
+
+# Deletion reasons (report keys and metric label)
+EXPIRED = "expired"
+ORPHAN = "orphan"
+OVER_QUOTA = "over_quota"
+MISSING_FILE = "missing_file"
+STALE_RENDITION = "stale_rendition"
+STALE_UPLOAD = "stale_upload"
+STALE_COLUMNS = "stale_columns"
+
+_GB = 1024 ** 3
+
+
+def _batches(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class StorageCollector:
+    """
+    Applies retention and removes orphaned files and rows
+    """
+
+    def __init__(
+        self,
+        upload_dir: Path = storage.UPLOAD_DIR,
+        detection_store: Optional[DetectionStore] = None,
+        rendition_service: Optional[RenditionService] = None,
+        batch_size: int = STORAGE_GC_BATCH
+    ):
+        self.upload_dir = upload_dir
+        self.detection_store = detection_store or DetectionStore()
+        self.rendition_service = rendition_service or RenditionService(upload_dir=upload_dir)
+        self.batch_size = max(1, batch_size)
+        self.last_report: Optional[Dict] = None
+        self._report: Dict = {}
+        self._dry_run = False
+
+    def _count(self, reason: str, files: int = 0, size: int = 0, rows: int = 0) -> None:
+        entry = self._report["deleted"].setdefault(reason, {"files": 0, "bytes": 0, "rows": 0})
+        entry["files"] += files
+        entry["bytes"] += size
+        entry["rows"] += rows
+        if files and not self._dry_run:
+            metrics.STORAGE_DELETED.labels(reason).inc(files)
+
+    def _remove_file(self, filename: str, reason: str) -> None:
+        """Delete upload and its renditions"""
+        if self._dry_run:
+            path = storage.resolve(self.upload_dir, filename)
+            size = path.stat().st_size if path is not None and path.is_file() else 0
+        else:
+            size = storage.remove(self.upload_dir, filename)
+            if storage.kind_of(filename) == storage.IMAGES:
+                self.rendition_service.delete(filename)
+        if size:
+            self._count(reason, files=1, size=size)
+
+    def _delete_recognitions(self, ids: List[int], reason: str) -> None:
+        if not ids:
+            return
+        if not self._dry_run:
+            with SessionLocal() as db:
+                rows = db.query(Recognition).filter(Recognition.id.in_(ids))
+                timestamps = [row[0] for row in rows.with_entities(Recognition.created_at)]
+                rows.delete(synchronize_session=False)
+                self._update_rollups(db, IMAGE_SOURCE, RecognitionRepository(db), timestamps)
+                db.commit()
+            response_cache.invalidate(RECOGNITIONS)
+        self._count(reason, rows=len(ids))
+
+    def _delete_analyses(self, ids: List[int], reason: str) -> None:
+        if not ids:
+            return
+        if not self._dry_run:
+            with SessionLocal() as db:
+                rows = db.query(VideoAnalysis).filter(VideoAnalysis.id.in_(ids))
+                timestamps = [row[0] for row in rows.with_entities(VideoAnalysis.created_at)]
+                rows.delete(synchronize_session=False)
+                repository = VideoAnalysisRepository(db, frame_counts=self.detection_store.frame_counts)
+                self._update_rollups(db, VIDEO_SOURCE, repository, timestamps)
+                # Columns go first: once the rows are gone, a new analysis may get one of these ids
+                for analysis_id in ids:
+                    self.detection_store.delete(analysis_id)
+                db.commit()
+        self._count(reason, rows=len(ids))
+
+    def _update_rollups(self, db, source: str, repository, timestamps: List[datetime]) -> None:
+        """Recompute rollup buckets that contained deleted rows"""
+        rollups = RollupRepository(db)
+        finest = next(iter(ROLLUP_RESOLUTIONS))
+        buckets = {bucket_start(timestamp, finest) for timestamp in timestamps if timestamp}
+        for bucket in buckets:
+            rollups.replace(source, bucket, repository.aggregate(bucket))
+
+    def _stored_files(self) -> Iterator[Tuple[str, str, os.stat_result]]:
+        """(stored name, kind, stat) of every upload, sharded and legacy flat ones"""
+        with os.scandir(self.upload_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    kind = storage.kind_of(entry.name)
+                    if kind:
+                        yield entry.name, kind, entry.stat()
+        for kind in (storage.IMAGES, storage.VIDEOS):
+            root = self.upload_dir / kind
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    path = Path(dirpath) / name
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield path.relative_to(self.upload_dir).as_posix(), kind, stat
+
+    def _referenced(self, kind: str, names: List[str]) -> set:
+        """Subset of names some row refers to"""
+        column = Recognition.image_path if kind == storage.IMAGES else VideoAnalysis.video_filename
+        with SessionLocal() as db:
+            return {row[0] for row in db.query(column).filter(column.in_(names)).distinct()}
+
+    def _expire_by_age(self) -> None:
+        now = datetime.utcnow()
+        if RETENTION_IMAGE_DAYS > 0:
+            cutoff = now - timedelta(days=RETENTION_IMAGE_DAYS)
+            self._expire_rows(Recognition, Recognition.image_path, Recognition.created_at < cutoff)
+        if RETENTION_VIDEO_DAYS > 0:
+            cutoff = now - timedelta(days=RETENTION_VIDEO_DAYS)
+            self._expire_rows(VideoAnalysis, VideoAnalysis.video_filename, VideoAnalysis.created_at < cutoff)
+
+    def _expire_rows(self, model, name_column, condition) -> None:
+        """Delete rows matching condition, then their files once nothing else refers to them"""
+        last_id = 0
+        while True:
+            with SessionLocal() as db:
+                rows = db.query(model.id, name_column).filter(
+                    and_(condition, model.id > last_id)
+                ).order_by(model.id).limit(self.batch_size).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            ids = [row[0] for row in rows]
+            names = sorted({row[1] for row in rows})
+            if model is Recognition:
+                self._delete_recognitions(ids, EXPIRED)
+            else:
+                self._delete_analyses(ids, EXPIRED)
+            kind = storage.IMAGES if model is Recognition else storage.VIDEOS
+            still_used = set() if self._dry_run else self._referenced(kind, names)
+            for name in names:
+                if name not in still_used:
+                    self._remove_file(name, EXPIRED)
+
+    def _scan_files(self) -> Dict[str, List[Tuple[float, int, str]]]:
+        """
+        Remove orphan uploads and record usage
+        Returns referenced files per kind as (mtime, size, name), for size retention
+        """
+        usage = {kind: {"files": 0, "bytes": 0} for kind in (storage.IMAGES, storage.VIDEOS)}
+        referenced: Dict[str, List[Tuple[float, int, str]]] = {storage.IMAGES: [], storage.VIDEOS: []}
+        keep_list = {
+            storage.IMAGES: RETENTION_IMAGE_MAX_GB > 0,
+            storage.VIDEOS: RETENTION_VIDEO_MAX_GB > 0,
+        }
+        cutoff = time.time() - STORAGE_GC_GRACE
+        pending: Dict[str, List[Tuple[str, os.stat_result]]] = {storage.IMAGES: [], storage.VIDEOS: []}
+
+        def flush(kind: str) -> None:
+            batch = pending[kind]
+            pending[kind] = []
+            used = self._referenced(kind, [name for name, _ in batch])
+            for name, stat in batch:
+                if name in used or stat.st_mtime > cutoff:
+                    usage[kind]["files"] += 1
+                    usage[kind]["bytes"] += stat.st_size
+                    if name in used and keep_list[kind]:
+                        referenced[kind].append((stat.st_mtime, stat.st_size, name))
+                else:
+                    self._remove_file(name, ORPHAN)
+
+        for name, kind, stat in self._stored_files():
+            pending[kind].append((name, stat))
+            if len(pending[kind]) >= self.batch_size:
+                flush(kind)
+        for kind in pending:
+            if pending[kind]:
+                flush(kind)
+
+        self._report["usage"].update(usage)
+        return referenced
+
+    def _enforce_quota(self, referenced: Dict[str, List[Tuple[float, int, str]]]) -> None:
+        """Delete oldest uploads (and their rows) until each kind fits its quota"""
+        quotas = {storage.IMAGES: RETENTION_IMAGE_MAX_GB, storage.VIDEOS: RETENTION_VIDEO_MAX_GB}
+        for kind, quota in quotas.items():
+            usage = self._report["usage"][kind]
+            if quota <= 0 or usage["bytes"] <= quota * _GB:
+                continue
+            victims = []
+            for _, size, name in sorted(referenced[kind]):
+                if usage["bytes"] <= quota * _GB:
+                    break
+                victims.append(name)
+                usage["bytes"] -= size
+                usage["files"] -= 1
+            if kind == storage.IMAGES:
+                model, column, delete_rows = Recognition, Recognition.image_path, self._delete_recognitions
+            else:
+                model, column, delete_rows = VideoAnalysis, VideoAnalysis.video_filename, self._delete_analyses
+            for batch in _batches(victims, self.batch_size):
+                with SessionLocal() as db:
+                    ids = [row[0] for row in db.query(model.id).filter(column.in_(batch))]
+                delete_rows(ids, OVER_QUOTA)
+                for name in batch:
+                    self._remove_file(name, OVER_QUOTA)
+
+    def _remove_missing(self) -> None:
+        """Delete recognitions whose image file is gone"""
+        last_id = 0
+        while True:
+            with SessionLocal() as db:
+                rows = db.query(Recognition.id, Recognition.image_path).filter(
+                    Recognition.id > last_id
+                ).order_by(Recognition.id).limit(self.batch_size).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            missing = []
+            for recognition_id, image_path in rows:
+                path = storage.resolve(self.upload_dir, image_path)
+                if path is None or not path.exists():
+                    missing.append(recognition_id)
+            self._delete_recognitions(missing, MISSING_FILE)
+
+    def _remove_stale_renditions(self) -> None:
+        """Delete renditions whose source image is gone"""
+        files, size = 0, 0
+        cutoff = time.time() - STORAGE_GC_GRACE
+        for name in RENDITION_SIZES:
+            root = self.rendition_service.rendition_dir / name
+            for dirpath, _, filenames in os.walk(root):
+                source_dir = self.upload_dir / Path(dirpath).relative_to(root)
+                for filename in filenames:
+                    path = Path(dirpath) / filename
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    files += 1
+                    size += stat.st_size
+                    if stat.st_mtime > cutoff:
+                        continue
+                    # Rendition keeps the source stem with a .webp suffix;
+                    # dot files are temporaries of an interrupted write
+                    if not filename.startswith(".") and any(source_dir.glob(f"{path.stem}.*")):
+                        continue
+                    if not self._dry_run:
+                        path.unlink(missing_ok=True)
+                    self._count(STALE_RENDITION, files=1, size=stat.st_size)
+                    files -= 1
+                    size -= stat.st_size
+        self._report["usage"][RENDITIONS] = {"files": files, "bytes": size}
+
+    def _remove_stale_uploads(self) -> None:
+        """Discard resumable uploads that got no chunk for UPLOAD_EXPIRE_HOURS"""
+        staging_dir = self.upload_dir / STAGING_DIRNAME
+        if not staging_dir.is_dir():
+            return
+        # Upload id -> (latest mtime, files): data file and sidecar share the stem
+        uploads: Dict[str, Tuple[float, List[Path]]] = {}
+        for path in staging_dir.iterdir():
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            latest, paths = uploads.get(path.stem, (0.0, []))
+            uploads[path.stem] = (max(latest, mtime), paths + [path])
+        cutoff = time.time() - UPLOAD_EXPIRE_HOURS * 3600
+        for latest, paths in uploads.values():
+            if latest > cutoff:
+                continue
+            for path in paths:
+                size = path.stat().st_size if path.exists() else 0
+                if not self._dry_run:
+                    path.unlink(missing_ok=True)
+                self._count(STALE_UPLOAD, files=1, size=size)
+
+    def _remove_stale_columns(self) -> None:
+        """Delete stored detection columns of analyses that no longer exist"""
+        base_dir = self.detection_store.base_dir
+        cutoff = time.time() - STORAGE_GC_GRACE
+        ids = []
+        for entry in os.scandir(base_dir):
+            if entry.name.isdigit():
+                ids.append(int(entry.name))
+            elif entry.name.startswith(".tmp-") and entry.stat().st_mtime < cutoff:
+                # Left over from an interrupted save
+                if not self._dry_run:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                self._count(STALE_COLUMNS, files=1)
+        for batch in _batches(sorted(ids), self.batch_size):
+            with SessionLocal() as db:
+                existing = {row[0] for row in db.query(VideoAnalysis.id).filter(VideoAnalysis.id.in_(batch))}
+            for analysis_id in batch:
+                if analysis_id in existing:
+                    continue
+                if not self._dry_run:
+                    self.detection_store.delete(analysis_id)
+                self._count(STALE_COLUMNS, files=1)
+
+    def run(self, dry_run: bool = False) -> Dict:
+        """
+        One collection pass (see module docstring)
+        With dry_run nothing is deleted; the report shows what would be
+        """
+        STORAGE_GC_LOCK.parent.mkdir(parents=True, exist_ok=True)
+        with open(STORAGE_GC_LOCK, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {"skipped": "storage collection already running"}
+
+            start = time.perf_counter()
+            self._dry_run = dry_run
+            self._report = {
+                "started_at": datetime.utcnow().isoformat(),
+                "dry_run": dry_run,
+                "deleted": {},
+                "usage": {},
+            }
+            self._expire_by_age()
+            self._enforce_quota(self._scan_files())
+            self._remove_missing()
+            self._remove_stale_renditions()
+            self._remove_stale_uploads()
+            self._remove_stale_columns()
+            self._report["disk"] = storage.disk_usage(self.upload_dir)
+            self._report["duration_seconds"] = round(time.perf_counter() - start, 3)
+
+        report = self._report
+        if not dry_run:
+            for kind, usage in report["usage"].items():
+                metrics.STORAGE_BYTES.labels(kind).set(usage["bytes"])
+                metrics.STORAGE_FILES.labels(kind).set(usage["files"])
+            metrics.STORAGE_FREE_BYTES.set(report["disk"]["free_bytes"])
+            self.last_report = report
+        logger.info(f"Storage collection{' (dry run)' if dry_run else ''}: {report['deleted'] or 'nothing to delete'}")
+        return report
+
+    async def run_forever(self) -> None:
+        """Background task: collect every STORAGE_GC_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(STORAGE_GC_INTERVAL)
+            try:
+                await run_in_threadpool(self.run)
+            except Exception as e:
+                logger.warning(f"Storage collection failed: {str(e)}")
+
+
+collector = StorageCollector()
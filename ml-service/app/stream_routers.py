@@ -1,37 +1,112 @@
 """
 WebSocket router for real-time video stream processing
 """
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from typing import Dict, Optional
+import asyncio
 import cv2
 import numpy as np
 import base64
 import json
 import logging
 
-from .services import YOLOService
+from .model import current as current_model, select as select_model
+from .admission import admission
+from .ingestion import ingestion
+from .roi import RoiMask, rois
+from .serializers import FORMATS, JSON_MEDIA_TYPE, available_media_types, detection_columns, encode
+from . import metrics, scheduling, tracing
 
 logger = logging.getLogger(__name__)
 
-# Initialize services
-yolo_service = YOLOService()
-
 # Create router
 router = APIRouter(prefix="/stream", tags=["Video Stream"])
 
+_frames_processed = metrics.FRAMES_PROCESSED.labels("stream")
+_frames_dropped_empty = metrics.FRAMES_DROPPED.labels("stream", "empty")
+_frames_dropped_decode = metrics.FRAMES_DROPPED.labels("stream", "decode_error")
+_frames_dropped_busy = metrics.FRAMES_DROPPED.labels("stream", "busy")
+
 
 @router.websocket("/video")
-async def video_stream(websocket: WebSocket):
+async def video_stream(
+    websocket: WebSocket,
+    format: str = "json",
+    latency_budget_ms: Optional[float] = None,
+    quality: Optional[str] = None,
+    roi: Optional[str] = None
+):
     """
     WebSocket endpoint for real-time video stream processing
     
     Client sends base64 encoded video frames
     Server responds with detection results in real-time
+    
+    - **format**: "json" (default), "f32" or "msgpack"; compact formats send
+      detection results as binary messages with detections as columns
+    - **latency_budget_ms** / **quality**: model choice, made per frame from
+      current model latencies (see model_router.py); reported in "model"
+    - **roi**: stored region of interest (see /admin/roi); only the region is
+      analyzed. A session can set its own with {"type": "roi", "polygon":
+      [[x, y], ...]} (fractions of frame size; null polygon goes back to roi)
     """
     await websocket.accept()
     logger.info("WebSocket connection established")
     
+    media_type = FORMATS.get(format)
+    if media_type not in available_media_types():
+        await websocket.send_json({
+            "type": "error",
+            "message": f"Unsupported format: {format}"
+        })
+        await websocket.close(code=1003)
+        return
+    
+    yolo_service = current_model()
+    if yolo_service is None:
+        await websocket.send_json({
+            "type": "error",
+            "message": "Model is not loaded yet"
+        })
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
+    
+    try:
+        select_model(latency_budget_ms, quality)
+    except HTTPException as e:
+        await websocket.send_json({
+            "type": "error",
+            "message": e.detail
+        })
+        await websocket.close(code=1003)
+        return
+    
+    if roi and await run_in_threadpool(rois.mask, roi) is None:
+        await websocket.send_json({
+            "type": "error",
+            "message": f"ROI not found: {roi}"
+        })
+        await websocket.close(code=1003)
+        return
+    
+    if admission.saturated(scheduling.REALTIME):
+        metrics.REQUESTS_SHED.labels("stream_video").inc()
+        await websocket.send_json({
+            "type": "error",
+            "message": "Server is busy, try again later",
+            "retry_after": admission.retry_after(scheduling.REALTIME)
+        })
+        await websocket.close(code=1013)
+        return
+    
+    metrics.set_endpoint("stream_video")
+    scheduling.set_priority(scheduling.REALTIME)
+    metrics.WEBSOCKET_SESSIONS.inc()
     frame_count = 0
+    # Region sent by the client; overrides the stored one
+    session_roi: Optional[RoiMask] = None
     
     try:
         while True:
@@ -48,50 +123,79 @@ async def video_stream(websocket: WebSocket):
                     # Decode base64 image
                     frame_data = message.get("data", "")
                     if not frame_data:
+                        _frames_dropped_empty.inc()
                         continue
                     
-                    # Remove data URL prefix if present
-                    if "base64," in frame_data:
-                        frame_data = frame_data.split("base64,")[1]
-                    
-                    # Decode base64 to bytes
-                    img_bytes = base64.b64decode(frame_data)
-                    
-                    # Convert to numpy array
-                    nparr = np.frombuffer(img_bytes, np.uint8)
+                    # Stored region is re-read when changed (cached, see roi.py)
+                    frame_roi = session_roi
+                    if frame_roi is None and roi:
+                        frame_roi = await run_in_threadpool(rois.mask, roi)
                     
-                    # Decode image
-                    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                    
-                    if frame is None:
-                        await websocket.send_json({
-                            "type": "error",
-                            "message": "Failed to decode frame"
-                        })
-                        continue
-                    
-                    # Convert BGR to RGB for YOLO
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Run YOLO detection
-                    results = yolo_service.model(rgb_frame)
-                    
-                    # Collect detections
-                    detections = []
-                    cows_count = 0
-                    
-                    for result in results:
-                        boxes = result.boxes
-                        for box in boxes:
-                            class_id = int(box.cls[0])
-                            class_name = yolo_service.model.names[class_id]
+                    # Per-frame spans, sent back in "timing" (milliseconds)
+                    with tracing.trace() as frame_trace:
+                        with metrics.stage(metrics.DECODE):
+                            # Remove data URL prefix if present
+                            if "base64," in frame_data:
+                                frame_data = frame_data.split("base64,")[1]
+                            
+                            # Decode base64 to bytes
+                            img_bytes = base64.b64decode(frame_data)
                             
-                            if class_name.lower() == 'cow':
-                                cows_count += 1
-                                confidence = float(box.conf[0])
-                                x1, y1, x2, y2 = map(float, box.xyxy[0].tolist())
-                                
-                                detections.append({
+                            # Convert to numpy array
+                            nparr = np.frombuffer(img_bytes, np.uint8)
+                            
+                            # Decode image
+                            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                            
+                            # Convert BGR to RGB for YOLO
+                            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if frame is not None else None
+                        
+                        # Crop to region of interest
+                        if rgb_frame is not None and frame_roi is not None:
+                            with metrics.stage(metrics.ROI_CROP):
+                                rgb_frame = frame_roi.crop(rgb_frame)
+                        
+                        if frame is None:
+                            _frames_dropped_decode.inc()
+                            await websocket.send_json({
+                                "type": "error",
+                                "message": "Failed to decode frame"
+                            })
+                            continue
+                        
+                        # Run YOLO detection (frame is dropped, not queued, while saturated)
+                        yolo_service = select_model(latency_budget_ms, quality) or yolo_service
+                        try:
+                            with admission.admit(1, "stream_video"):
+                                boxes = await run_in_threadpool(yolo_service.detect_array, rgb_frame)
+                        except HTTPException:
+                            _frames_dropped_busy.inc()
+                            await websocket.send_json({
+                                "type": "error",
+                                "message": "Server is busy, frame dropped",
+                                "retry_after": admission.retry_after()
+                            })
+                            continue
+                        if frame_roi is not None:
+                            boxes = frame_roi.to_frame(boxes, frame.shape)
+                        cows_count = len(boxes)
+                        _frames_processed.inc()
+                    
+                    with metrics.stage(metrics.SERIALIZE):
+                        if media_type != JSON_MEDIA_TYPE:
+                            # Compact path: detections go out as columns, no per-box dicts
+                            meta = {
+                                "type": "detection",
+                                "frame_number": frame_count,
+                                "cows_count": cows_count,
+                                "model": yolo_service.name,
+                                "timestamp": message.get("timestamp", 0),
+                                "timing": frame_trace.to_dict()
+                            }
+                            await websocket.send_bytes(encode(media_type, meta, detection_columns(boxes)))
+                        else:
+                            detections = [
+                                {
                                     "confidence": confidence,
                                     "bbox": {
                                         "x1": x1,
@@ -99,23 +203,39 @@ async def video_stream(websocket: WebSocket):
                                         "x2": x2,
                                         "y2": y2
                                     }
-                                })
-                    
-                    # Send detection results back to client
-                    response = {
-                        "type": "detection",
-                        "frame_number": frame_count,
-                        "cows_count": cows_count,
-                        "detections": detections,
-                        "timestamp": message.get("timestamp", 0)
-                    }
-                    
-                    await websocket.send_json(response)
+                                }
+                                for confidence, x1, y1, x2, y2 in boxes.tolist()
+                            ]
+                        
+                            # Send detection results back to client
+                            response = {
+                                "type": "detection",
+                                "frame_number": frame_count,
+                                "cows_count": cows_count,
+                                "detections": detections,
+                                "model": yolo_service.name,
+                                "timestamp": message.get("timestamp", 0),
+                                "timing": frame_trace.to_dict()
+                            }
+                        
+                            await websocket.send_json(response)
                     
                     # Log every 30 frames
                     if frame_count % 30 == 0:
                         logger.info(f"Processed {frame_count} frames, detected {cows_count} cows in last frame")
                 
+                elif message.get("type") == "roi":
+                    polygon = message.get("polygon")
+                    try:
+                        session_roi = RoiMask(polygon, "session") if polygon is not None else None
+                    except ValueError as e:
+                        await websocket.send_json({
+                            "type": "error",
+                            "message": f"Invalid ROI: {str(e)}"
+                        })
+                        continue
+                    await websocket.send_json({"type": "roi", "polygon": session_roi.polygon if session_roi else None})
+                
                 elif message.get("type") == "ping":
                     # Respond to ping to keep connection alive
                     await websocket.send_json({"type": "pong"})
@@ -140,3 +260,81 @@ async def video_stream(websocket: WebSocket):
             await websocket.close()
         except:
             pass
+    finally:
+        metrics.WEBSOCKET_SESSIONS.dec()
+
+
+@router.get("/sources")
+async def list_sources():
+    """
+    List server-side ingestion sources (RTSP cameras / video files) and their state
+    """
+    return ingestion.status()
+
+
+@router.websocket("/sources/{name}")
+async def source_stream(websocket: WebSocket, name: str, format: str = "json"):
+    """
+    WebSocket subscription to detections of a server-side ingestion source
+    
+    Frames are pulled and analyzed on the server; the client only receives
+    detection messages (same shape as /stream/video responses, plus "source").
+    
+    - **format**: "json" (default), "f32" or "msgpack"
+    """
+    await websocket.accept()
+    
+    media_type = FORMATS.get(format)
+    if media_type not in available_media_types():
+        await websocket.send_json({
+            "type": "error",
+            "message": f"Unsupported format: {format}"
+        })
+        await websocket.close(code=1003)
+        return
+    
+    worker = ingestion.get(name)
+    if worker is None:
+        await websocket.send_json({
+            "type": "error",
+            "message": "Source not found" if ingestion.active else "Ingestion is not running in this process"
+        })
+        await websocket.close(code=1008)
+        return
+    
+    queue = worker.subscribe()
+    metrics.WEBSOCKET_SESSIONS.inc()
+    
+    async def send_detections():
+        while True:
+            meta, boxes = await queue.get()
+            if media_type != JSON_MEDIA_TYPE:
+                await websocket.send_bytes(encode(media_type, meta, detection_columns(boxes)))
+            else:
+                await websocket.send_json({
+                    **meta,
+                    "detections": [
+                        {
+                            "confidence": confidence,
+                            "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+                        }
+                        for confidence, x1, y1, x2, y2 in boxes.tolist()
+                    ]
+                })
+    
+    async def wait_disconnect():
+        # Client messages are ignored; the sender alone would not notice a disconnect
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    
+    tasks = [asyncio.create_task(send_detections()), asyncio.create_task(wait_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.warning(f"Source stream {name} closed: {str(task.exception())}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        worker.unsubscribe(queue)
+        metrics.WEBSOCKET_SESSIONS.dec()
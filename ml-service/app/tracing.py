@@ -0,0 +1,112 @@
+"""
+Per-request timing spans
+
+Every HTTP request runs inside a Trace held in a context variable. Pipeline
+stages recorded with `metrics.stage(...)` are added to it as spans, and the
+middleware returns them in a `Server-Timing` header, e.g.
+
+    Server-Timing: upload_read;dur=1.8, decode;dur=12.4, inference;dur=48.0, db_write;dur=3.1, total;dur=67.2
+
+Stages repeated within one request (e.g. per video frame) are summed and the
+number of calls is given in `desc`.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from time import perf_counter
+from typing import Dict, List, Optional
+import os
+
+# Set SERVER_TIMING=false to stop exposing stage timings to clients
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+
+class Trace:
+    """
+    Timing spans of one request (or one streamed frame)
+    """
+
+    def __init__(self):
+        self.start = perf_counter()
+        # name -> [total seconds, calls], in order of first occurrence
+        self.spans: Dict[str, List[float]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add span duration"""
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            span[0] += seconds
+            span[1] += 1
+
+    def elapsed(self) -> float:
+        """Seconds since trace start"""
+        return perf_counter() - self.start
+
+    def to_dict(self) -> Dict[str, float]:
+        """Span durations in milliseconds"""
+        return {name: round(seconds * 1000, 3) for name, (seconds, _) in self.spans.items()}
+
+    def server_timing(self) -> str:
+        """Spans as Server-Timing header value"""
+        entries = []
+        for name, (seconds, calls) in self.spans.items():
+            entry = f"{name};dur={seconds * 1000:.2f}"
+            if calls > 1:
+                entry += f';desc="x{int(calls)}"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace of current request, if any"""
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Add span to current trace (no-op outside of a trace)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def trace():
+    """Run block in a new trace"""
+    new_trace = Trace()
+    token = _current.set(new_trace)
+    try:
+        yield new_trace
+    finally:
+        _current.reset(token)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that traces HTTP requests and adds a Server-Timing header
+    Spans recorded after the response has started (e.g. background tasks) are not reported
+    """
+
+    def __init__(self, app: ASGIApp, enabled: bool = SERVER_TIMING_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        with trace() as request_trace:
+            async def send_with_timing(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", request_trace.server_timing().encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
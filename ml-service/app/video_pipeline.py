@@ -0,0 +1,217 @@
+"""
+Pipelined frame analysis for videos
+
+    decoder thread --frames--> inference thread --results--> caller (postprocess)
+
+The decoder reads the video, picks the sampled frames and converts them to
+RGB while the model runs on earlier frames. The inference stage takes up to
+VIDEO_BATCH_SIZE already-decoded frames per model call. Queues are bounded
+(VIDEO_PREFETCH_FRAMES), so memory stays flat for long videos. Frames are
+sampled exactly as before and results come out in frame order, so the
+analysis is unchanged. With a region of interest (roi.py), the decoder crops
+frames to it and boxes are mapped back to frame coordinates in postprocess.
+
+Each stage records how long it sat idle waiting for input ("starved") or for
+room downstream ("blocked"). The totals are logged per video and exported as
+cowcount_pipeline_idle_seconds_total.
+"""
+from contextvars import copy_context
+from queue import Empty, Full, Queue
+from time import perf_counter
+from typing import Dict, Iterator, Optional, Tuple
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from .services import YOLOService
+from .roi import RoiMask
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Sampled frames decoded ahead of inference
+VIDEO_PREFETCH_FRAMES = int(os.getenv("VIDEO_PREFETCH_FRAMES", "8"))
+
+# Frames per model call; 1 keeps boxes bit-identical to per-frame inference
+# (batched kernels may round differently on some backends)
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "1"))
+
+# Sampled frames a pipeline holds at most (decoded ahead + in the model call)
+VIDEO_IN_FLIGHT_FRAMES = max(1, VIDEO_PREFETCH_FRAMES) + max(1, VIDEO_BATCH_SIZE)
+
+DECODER = "decoder"
+INFERENCE = "inference"
+POSTPROCESS = "postprocess"
+
+# Queue markers
+_END = object()
+
+# Seconds between checks for cancellation while waiting on a queue
+_POLL = 0.1
+
+
+class _Failed:
+    """Exception raised in a stage, passed downstream to the caller"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class VideoPipeline:
+    """
+    Decode, inference and postprocess stages of one video analysis
+    """
+
+    def __init__(
+        self,
+        yolo_service: YOLOService,
+        batch_size: int = VIDEO_BATCH_SIZE,
+        prefetch: int = VIDEO_PREFETCH_FRAMES,
+        roi: Optional[RoiMask] = None
+    ):
+        self.yolo_service = yolo_service
+        self.batch_size = max(1, batch_size)
+        self.roi = roi
+        # Size of decoded frames (set by the decoder before the first frame is queued)
+        self._frame_shape: Tuple[int, ...] = ()
+        self._frames: Queue = Queue(maxsize=max(1, prefetch))
+        self._results: Queue = Queue(maxsize=max(1, prefetch))
+        self._stop = threading.Event()
+        # stage -> {"starved": seconds, "blocked": seconds}
+        self.idle: Dict[str, Dict[str, float]] = {
+            stage: {"starved": 0.0, "blocked": 0.0} for stage in (DECODER, INFERENCE, POSTPROCESS)
+        }
+
+    def _put(self, queue: Queue, item, stage: str) -> bool:
+        """Put item, waiting for room; False if pipeline was stopped"""
+        start = perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    queue.put(item, timeout=_POLL)
+                    return True
+                except Full:
+                    continue
+            return False
+        finally:
+            self.idle[stage]["blocked"] += perf_counter() - start
+
+    def _get(self, queue: Queue, stage: str):
+        """Next item, waiting for input; _END if pipeline was stopped"""
+        start = perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    return queue.get(timeout=_POLL)
+                except Empty:
+                    continue
+            return _END
+        finally:
+            self.idle[stage]["starved"] += perf_counter() - start
+
+    def _decode(self, cap: cv2.VideoCapture, fps: int, sample_interval: float) -> None:
+        # Thread: read all frames, send sampled ones as (time, frame number, RGB frame)
+        try:
+            frame_count = 0
+            last_processed_time = -sample_interval  # Process first frame
+            while True:
+                with metrics.stage(metrics.DECODE):
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+
+                frame_count += 1
+                current_time = frame_count / fps
+
+                # Process frame if enough time has passed since last processing
+                if current_time - last_processed_time >= sample_interval:
+                    last_processed_time = current_time
+
+                    # Convert BGR to RGB for YOLO
+                    with metrics.stage(metrics.DECODE):
+                        self._frame_shape = frame.shape
+                        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    if self.roi is not None:
+                        with metrics.stage(metrics.ROI_CROP):
+                            rgb_frame = self.roi.crop(rgb_frame)
+                    if not self._put(self._frames, (current_time, frame_count, rgb_frame), DECODER):
+                        return
+            self._put(self._frames, _END, DECODER)
+        except Exception as e:
+            self._put(self._frames, _Failed(e), DECODER)
+
+    def _infer(self) -> None:
+        # Thread: run model on batches of decoded frames
+        try:
+            done = False
+            while not done:
+                item = self._get(self._frames, INFERENCE)
+                if item is _END or isinstance(item, _Failed):
+                    self._put(self._results, item, INFERENCE)
+                    return
+                batch = [item]
+                # Add frames that are already decoded, without waiting for more
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._frames.get_nowait()
+                    except Empty:
+                        break
+                    if item is _END or isinstance(item, _Failed):
+                        done = True
+                        break
+                    batch.append(item)
+
+                results = self.yolo_service.infer_batch([frame for _, _, frame in batch])
+                for (current_time, frame_count, _), result in zip(batch, results):
+                    if not self._put(self._results, (current_time, frame_count, result), INFERENCE):
+                        return
+                if done:
+                    self._put(self._results, item, INFERENCE)
+        except Exception as e:
+            self._put(self._results, _Failed(e), INFERENCE)
+
+    def run(self, cap: cv2.VideoCapture, fps: int, sample_interval: float) -> Iterator[Tuple[float, int, np.ndarray]]:
+        """
+        Analyze sampled frames of opened video
+        Yields (time in seconds, frame number, cow boxes) in frame order
+        """
+        # Stage threads record metrics/trace spans of the calling request
+        threads = [
+            threading.Thread(
+                target=copy_context().run, args=(self._decode, cap, fps, sample_interval),
+                name="video-decoder", daemon=True
+            ),
+            threading.Thread(target=copy_context().run, args=(self._infer,), name="video-inference", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(self._results, POSTPROCESS)
+                if item is _END:
+                    break
+                if isinstance(item, _Failed):
+                    raise item.error
+                current_time, frame_count, result = item
+                with metrics.stage(metrics.POSTPROCESS):
+                    boxes = self.yolo_service.result_boxes(result)
+                    if self.roi is not None:
+                        boxes = self.roi.to_frame(boxes, self._frame_shape)
+                yield current_time, frame_count, boxes
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self._record_idle()
+
+    def _record_idle(self) -> None:
+        for stage, reasons in self.idle.items():
+            for reason, seconds in reasons.items():
+                metrics.PIPELINE_IDLE_SECONDS.labels(stage, reason).inc(seconds)
+        logger.info("Pipeline idle time: " + ", ".join(
+            f"{stage} starved {reasons['starved']:.2f}s / blocked {reasons['blocked']:.2f}s"
+            for stage, reasons in self.idle.items()
+        ))
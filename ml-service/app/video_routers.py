@@ -1,60 +1,240 @@
 """
 Video processing routers
 """
-from fastapi import APIRouter, File, UploadFile, HTTPException, Request
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session
 from pathlib import Path
-from typing import Dict
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-import os
+from typing import Dict, List, Optional
 
-from .video_service import VideoService
+from .database import get_db
+from .video_service import MAX_VIDEO_SIZE, VideoService, VideoAnalysisService
+from .detection_store import DetectionStore
+from .file_streaming import RangeFileResponse
 from .services import YOLOService
+from .model import routed_model
+from .roi import rois
+from .admission import admission
+from .rate_limit import limiter
+from .resumable_uploads import ResumableUploadService, chunk_offset
+from .schemas import (
+    VideoAnalysisResponse,
+    VideoDetectionsResponse,
+    MessageResponse,
+    UploadCreateRequest,
+    UploadStatusResponse
+)
+from .serializers import JSON_MEDIA_TYPE, ColumnarResponse, negotiate
+from . import metrics, scheduling
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
-
-# Initialize services
-yolo_service = YOLOService()
-video_service = VideoService(upload_dir=Path("../uploads"), yolo_service=yolo_service)
+# Initialize services (video_service is used for file operations only)
+video_service = VideoService(upload_dir=Path("../uploads"))
+detection_store = DetectionStore()
+upload_service = ResumableUploadService(upload_dir=video_service.upload_dir, max_size=MAX_VIDEO_SIZE)
 
 # Create router
 router = APIRouter(prefix="/video", tags=["Video Processing"])
 
 
+def get_video_analysis_service(db: Session = Depends(get_db)) -> VideoAnalysisService:
+    """Dependency injection for VideoAnalysisService (stored analyses, no model)"""
+    return VideoAnalysisService(db, video_service, detection_store)
+
+
+def get_video_analyzer(
+    db: Session = Depends(get_db),
+    yolo_service: YOLOService = Depends(routed_model),
+    roi: Optional[str] = Query(None, description="Stored region of interest to analyze (see /admin/roi)")
+) -> VideoAnalysisService:
+    """Dependency injection for VideoAnalysisService running new analyses (model picked per request, 503 until loaded)"""
+    video_analyzer = VideoService(
+        upload_dir=video_service.upload_dir,
+        yolo_service=yolo_service,
+        roi=rois.require_mask(roi) if roi else None
+    )
+    return VideoAnalysisService(db, video_analyzer, detection_store)
+
+
+async def _analyze_saved_video(
+    request: Request,
+    service: VideoAnalysisService,
+    filename: str,
+    video_path: str,
+    sample_interval: float
+):
+    """Analyze video in the upload directory (no rendering, just detection data), store results, build response"""
+    analysis, summary, columns = await run_in_threadpool(
+        service.analyze_and_save, video_path, sample_interval=sample_interval
+    )
+    meta = {
+        **summary,
+        "analysis_id": analysis.id,
+        "video_filename": filename,
+        "model": service.video_service.yolo_service.name,
+        "roi": service.video_service.roi.name if service.video_service.roi else None,
+        "message": "Video analyzed successfully"
+    }
+    
+    with metrics.stage(metrics.SERIALIZE):
+        media_type = negotiate(request.headers.get("accept"))
+        if media_type != JSON_MEDIA_TYPE:
+            return ColumnarResponse(meta, columns.flat_columns(), media_type, status_code=201)
+        
+        # Plain floats/ints only, so json.dumps directly instead of jsonable_encoder
+        return JSONResponse(
+            status_code=201,
+            content={
+                **summary,
+                "detections_by_time": columns.to_records(),
+                **meta
+            },
+            headers={"Vary": "Accept"}
+        )
+
+
 @router.post("/analyze", response_model=Dict, status_code=201)
 @limiter.limit("5/minute")
 async def analyze_video(
     request: Request,
     file: UploadFile = File(...),
-    sample_interval: float = 1.0
+    sample_interval: float = 1.0,
+    service: VideoAnalysisService = Depends(get_video_analyzer)
 ):
     """
     Upload and analyze a video to detect cows
     
     - **file**: Video file (MP4, AVI, MOV, max 200MB, max 10 minutes duration)
     - **sample_interval**: Analyze frames every N seconds (default: 1.0 second)
+    - **latency_budget_ms** / **quality**: model choice per frame budget when several are loaded
+    - **roi**: only analyze this stored region of interest
     - **Rate limit**: 5 requests per minute per IP address
+    - **Admission**: 503 with Retry-After while batch work is over its share of capacity
     
     Returns analysis results with detection data for each timestamp.
     Video is saved for playback but no processed video is created.
+    Results are stored and can be fetched later from /video/analyses/{analysis_id}.
+    Send `Accept: application/x-cowcount-f32` or `application/msgpack`
+    to get detections as compact columns instead of JSON.
     """
+    metrics.set_endpoint("video_analyze")
+    scheduling.set_priority(scheduling.BATCH)
     try:
         # Validate video
         video_service.validate_video(file)
+        admission.check("video_analyze")
         
         # Save video
-        filename, video_path = await video_service.save_video(file)
+        with metrics.stage(metrics.UPLOAD_READ):
+            filename, video_path = await video_service.save_video(file)
         
-        # Analyze video (no rendering, just detection data)
-        result = video_service.analyze_video(video_path, sample_interval=sample_interval)
+        # Admission cost is the frames in flight, not the whole video
+        frames = video_service.estimate_frames(video_path, sample_interval)
+        try:
+            with admission.admit(video_service.admission_cost(frames), "video_analyze", runs=frames):
+                return await _analyze_saved_video(request, service, filename, video_path, sample_interval)
+        except HTTPException as e:
+            if e.status_code == 503:
+                # Shed: do not keep the upload
+                video_service.delete_video(filename)
+            raise
         
-        return {
-            **result,
-            "video_filename": filename,
-            "message": "Video analyzed successfully"
-        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error analyzing video: {str(e)}"
+        )
+
+
+def _upload_headers(state: Dict) -> Dict[str, str]:
+    """tus-style headers for upload state"""
+    return {
+        "Upload-Offset": str(state["offset"]),
+        "Upload-Length": str(state["size"]),
+        "Cache-Control": "no-store"
+    }
+
+
+@router.post("/uploads", response_model=UploadStatusResponse, status_code=201)
+@limiter.limit("20/minute")
+async def create_upload(request: Request, body: UploadCreateRequest):
+    """
+    Start a resumable video upload
+    
+    - **filename**: Original file name (extension must be a supported video format)
+    - **size**: Total size in bytes (max 200MB)
+    
+    Send the bytes with PUT /video/uploads/{upload_id} and an `Upload-Offset` header,
+    in any order and in parallel, then POST /video/uploads/{upload_id}/analyze.
+    """
+    video_service.validate_filename(body.filename)
+    state = await run_in_threadpool(upload_service.create, body.filename, body.size)
+    headers = _upload_headers(state)
+    headers["Location"] = f"/video/uploads/{state['upload_id']}"
+    return JSONResponse(status_code=201, content=state, headers=headers)
+
+
+@router.put("/uploads/{upload_id}", response_model=UploadStatusResponse)
+async def upload_chunk(upload_id: str, request: Request, offset: Optional[int] = None):
+    """
+    Write a chunk of a resumable upload
+    
+    - **Upload-Offset** header (or **offset** parameter): byte position of the request body
+    
+    The body is written in place as it arrives; after a dropped connection the
+    bytes that did arrive are kept (see `missing` in the response or GET).
+    """
+    state = await upload_service.write_chunk(upload_id, chunk_offset(request, offset), request)
+    return JSONResponse(content=state, headers=_upload_headers(state))
+
+
+@router.api_route("/uploads/{upload_id}", methods=["GET", "HEAD"], response_model=UploadStatusResponse)
+async def get_upload(upload_id: str, request: Request):
+    """
+    Resumable upload state
+    
+    `Upload-Offset` header: bytes received without gaps from the start.
+    Body (GET): received byte count and the ranges still missing.
+    """
+    state = upload_service.status(upload_service.get(upload_id))
+    if request.method == "HEAD":
+        return Response(headers=_upload_headers(state))
+    return JSONResponse(content=state, headers=_upload_headers(state))
+
+
+@router.delete("/uploads/{upload_id}", response_model=MessageResponse)
+async def abort_upload(upload_id: str):
+    """Discard resumable upload and its data"""
+    upload_service.abort(upload_id)
+    return {"message": "Upload deleted successfully"}
+
+
+@router.post("/uploads/{upload_id}/analyze", response_model=Dict, status_code=201)
+@limiter.limit("5/minute")
+async def analyze_upload(
+    upload_id: str,
+    request: Request,
+    sample_interval: float = 1.0,
+    service: VideoAnalysisService = Depends(get_video_analyzer)
+):
+    """
+    Analyze a completed resumable upload (same results as POST /video/analyze)
+    
+    - **sample_interval**: Analyze frames every N seconds (default: 1.0 second)
+    
+    409 while bytes are missing. The file is moved into place, not copied.
+    On 503 (server busy) the upload is kept, so the request can be retried.
+    """
+    metrics.set_endpoint("video_analyze")
+    scheduling.set_priority(scheduling.BATCH)
+    try:
+        staged_path = upload_service.staged_path(upload_id)
+        frames = video_service.estimate_frames(str(staged_path), sample_interval)
+        with admission.admit(video_service.admission_cost(frames), "video_analyze", runs=frames):
+            filename, video_path = upload_service.complete(upload_id)
+            return await _analyze_saved_video(request, service, filename, video_path, sample_interval)
         
     except HTTPException:
         raise
@@ -65,78 +245,128 @@ async def analyze_video(
         )
 
 
-@router.get("/stream/{filename}")
+@router.get("/analyses", response_model=List[VideoAnalysisResponse])
+async def get_analyses(
+    skip: int = 0,
+    limit: int = 100,
+    service: VideoAnalysisService = Depends(get_video_analysis_service)
+):
+    """
+    Get stored video analyses (summaries without detections)
+    
+    - **skip**: Number of records to skip (pagination)
+    - **limit**: Maximum number of records to return
+    """
+    analyses = service.get_history(skip=skip, limit=limit)
+    return [analysis.to_dict() for analysis in analyses]
+
+
+@router.get("/analyses/{analysis_id}", response_model=VideoAnalysisResponse)
+async def get_analysis(
+    analysis_id: int,
+    service: VideoAnalysisService = Depends(get_video_analysis_service)
+):
+    """
+    Get stored video analysis summary
+    
+    - **analysis_id**: Video analysis ID
+    """
+    return service.get_by_id(analysis_id).to_dict()
+
+
+@router.get("/analyses/{analysis_id}/detections", response_model=VideoDetectionsResponse)
+async def get_analysis_detections(
+    analysis_id: int,
+    request: Request,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    service: VideoAnalysisService = Depends(get_video_analysis_service)
+):
+    """
+    Get detections of a stored video analysis for a time window
+    
+    - **start**: Window start in seconds (inclusive, default: beginning of video)
+    - **end**: Window end in seconds (inclusive, default: end of video)
+    
+    Only the requested window is read from the stored detection arrays.
+    Compact columns are returned for `Accept: application/x-cowcount-f32` or `application/msgpack`.
+    """
+    columns = service.get_detections(analysis_id, start=start, end=end)
+    
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type != JSON_MEDIA_TYPE:
+        meta = {"analysis_id": analysis_id, "start": start, "end": end}
+        return ColumnarResponse(meta, columns.flat_columns(), media_type)
+    
+    return JSONResponse(
+        content={
+            "analysis_id": analysis_id,
+            "start": start,
+            "end": end,
+            "detections_by_time": columns.to_records()
+        },
+        headers={"Vary": "Accept"}
+    )
+
+
+@router.get("/analyses/{analysis_id}/clip", response_class=StreamingResponse)
+async def get_analysis_clip(
+    analysis_id: int,
+    start: float = Query(..., ge=0, description="Clip start in seconds"),
+    end: float = Query(..., gt=0, description="Clip end in seconds"),
+    service: VideoAnalysisService = Depends(get_video_analysis_service)
+):
+    """
+    Render an annotated MP4 clip of a stored video analysis
+    
+    - **start**, **end**: Time range in seconds
+    
+    Boxes and cow counts are drawn from the stored detections, the model is
+    not run again. The clip is streamed (fragmented MP4) while it is encoded.
+    Returns 503 while too many clips are being rendered.
+    """
+    renderer = service.clip(analysis_id, start, end)
+    return StreamingResponse(
+        renderer.stream(),
+        media_type="video/mp4",
+        headers={"Content-Disposition": f'attachment; filename="analysis-{analysis_id}-{start:g}-{end:g}.mp4"'}
+    )
+
+
+@router.delete("/analyses/{analysis_id}", response_model=MessageResponse)
+async def delete_analysis(
+    analysis_id: int,
+    service: VideoAnalysisService = Depends(get_video_analysis_service)
+):
+    """
+    Delete stored video analysis
+    The video file is removed by the storage collector once no analysis refers to it
+    
+    - **analysis_id**: Video analysis ID
+    """
+    service.delete(analysis_id)
+    return {"message": "Video analysis deleted successfully"}
+
+
+@router.api_route("/stream/{filename:path}", methods=["GET", "HEAD"])
 async def stream_video(filename: str, request: Request):
     """
     Stream original video file with Range request support for seeking
     
     - **filename**: Name of the video file
+    
+    Supports single, suffix and multi-range requests, If-Range and ETag
+    revalidation. Uses sendfile when the server supports zero-copy sends.
     """
-    file_path = Path("../uploads") / filename
+    file_path = video_service.video_path(filename)
     
-    if not file_path.exists():
+    if file_path is None:
         raise HTTPException(status_code=404, detail="Video file not found")
     
-    file_size = os.path.getsize(file_path)
-    range_header = request.headers.get("range")
-    
-    if range_header:
-        # Parse range header
-        range_match = range_header.replace("bytes=", "").split("-")
-        start = int(range_match[0]) if range_match[0] else 0
-        end = int(range_match[1]) if range_match[1] else file_size - 1
-        
-        # Ensure valid range
-        start = max(0, start)
-        end = min(end, file_size - 1)
-        content_length = end - start + 1
-        
-        def iter_file():
-            with open(file_path, "rb") as f:
-                f.seek(start)
-                remaining = content_length
-                while remaining > 0:
-                    chunk_size = min(8192, remaining)
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-        
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(content_length),
-            "Content-Type": "video/mp4",
-        }
-        
-        return StreamingResponse(
-            iter_file(),
-            status_code=206,
-            headers=headers,
-            media_type="video/mp4"
-        )
-    else:
-        # No range header, return full file
-        def iter_full_file():
-            with open(file_path, "rb") as f:
-                while chunk := f.read(8192):
-                    yield chunk
-        
-        headers = {
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(file_size),
-            "Content-Type": "video/mp4",
-        }
-        
-        return StreamingResponse(
-            iter_full_file(),
-            headers=headers,
-            media_type="video/mp4"
-        )
+    return RangeFileResponse(file_path, request.headers, method=request.method)
 
 
-@router.delete("/{filename}")
+@router.delete("/{filename:path}")
 async def delete_video(filename: str):
     """
     Delete video file
@@ -3,33 +3,57 @@ Video processing service for cow detection
 """
 import cv2
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 from fastapi import HTTPException, UploadFile
-from datetime import datetime
+from sqlalchemy.orm import Session
+import math
 import os
 import logging
 
 from .services import YOLOService
+from .repositories import VideoAnalysisRepository
+from .models import VideoAnalysis
+from .detection_store import DetectionStore, DetectionColumns
+from .video_pipeline import VIDEO_IN_FLIGHT_FRAMES, VideoPipeline
+from .roi import RoiMask
+from .clips import CLIP_MAX_SECONDS, ClipRenderer, hold_frames
+from . import storage
+from . import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_frames_processed = metrics.FRAMES_PROCESSED.labels("video")
+
+SUPPORTED_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.webm']
+
+# Largest accepted video (bytes)
+MAX_VIDEO_SIZE = 200 * 1024 * 1024
+
+# Uploads are written to disk in pieces of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class VideoService:
     """
     Service for video processing operations
     """
     
-    def __init__(self, upload_dir: Path, yolo_service: YOLOService):
+    def __init__(
+        self,
+        upload_dir: Path,
+        yolo_service: Optional[YOLOService] = None,
+        roi: Optional[RoiMask] = None
+    ):
         self.upload_dir = upload_dir
         self.upload_dir.mkdir(exist_ok=True)
         self.yolo_service = yolo_service
+        # Region of interest frames are cropped to before inference
+        self.roi = roi
     
     def validate_video(self, file: UploadFile) -> None:
         """Validate uploaded video file"""
-        SUPPORTED_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv', '.webm']
-        
         # Check content type
         if file.content_type and not file.content_type.startswith("video/"):
             raise HTTPException(
@@ -39,38 +63,46 @@ class VideoService:
         
         # Check file extension
         if file.filename:
-            ext = os.path.splitext(file.filename)[1].lower()
-            if ext not in SUPPORTED_EXTENSIONS:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid file extension: {ext}. Supported formats: {', '.join(SUPPORTED_EXTENSIONS)}"
-                )
+            self.validate_filename(file.filename)
+    
+    def validate_filename(self, filename: str) -> None:
+        """Reject unsupported video file extensions"""
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file extension: {ext}. Supported formats: {', '.join(SUPPORTED_EXTENSIONS)}"
+            )
     
     async def save_video(self, file: UploadFile) -> Tuple[str, str]:
         """
         Save uploaded video
         Returns: (filename, file_path)
         """
-        # Read file contents
-        contents = await file.read()
+        # Unique sharded name (see storage.py)
+        file_extension = os.path.splitext(file.filename)[1]
+        filename, file_path = storage.allocate(self.upload_dir, storage.VIDEOS, file_extension)
+        
+        # Copy in pieces instead of holding the whole video in memory
+        size = 0
+        with open(file_path, "xb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                # Validate file size (200MB max for videos)
+                if size > MAX_VIDEO_SIZE:
+                    break
+                f.write(chunk)
         
-        # Validate file size (200MB max for videos)
-        if len(contents) > 200 * 1024 * 1024:
+        if size > MAX_VIDEO_SIZE:
+            file_path.unlink()
             raise HTTPException(
                 status_code=400,
                 detail="Video file size exceeds 200MB limit."
             )
         
-        # Generate unique filename
-        timestamp = int(datetime.now().timestamp() * 1000)
-        file_extension = os.path.splitext(file.filename)[1]
-        filename = f"{timestamp}{file_extension}"
-        file_path = self.upload_dir / filename
-        
-        # Save file
-        with open(file_path, "wb") as f:
-            f.write(contents)
-        
         return filename, str(file_path)
     
     def analyze_video(self, video_path: str, sample_interval: float = 0.1) -> Dict:
@@ -85,6 +117,19 @@ class VideoService:
         Returns:
             Dictionary with analysis results and detection data per timestamp
         """
+        summary, columns = self.analyze_video_columns(video_path, sample_interval=sample_interval)
+        return {
+            **summary,
+            "detections_by_time": columns.to_records()
+        }
+    
+    def analyze_video_columns(self, video_path: str, sample_interval: float = 0.1) -> Tuple[Dict, DetectionColumns]:
+        """
+        Analyze video like analyze_video, but keep detections in columnar form
+        
+        Returns:
+            (summary without "detections_by_time", detection columns)
+        """
         cap = cv2.VideoCapture(video_path)
         
         if not cap.isOpened():
@@ -116,75 +161,36 @@ class VideoService:
         logger.info(f"Video duration: {duration_minutes:02d}:{duration_seconds:02d}, FPS: {fps}, Resolution: {width}x{height}")
         logger.info(f"Processing frames every {sample_interval} second(s)")
         
-        # Analyze frames
-        frame_count = 0
+        # Analyze frames (decode and inference run in their own threads, see video_pipeline.py)
         analyzed_count = 0
         total_cows_detected = 0
         max_cows_in_frame = 0
-        detections_by_time = []
-        last_processed_time = -sample_interval  # Process first frame
+        timestamps = []
+        frame_numbers = []
+        frame_boxes = []
         
+        frames = VideoPipeline(self.yolo_service, roi=self.roi).run(cap, fps, sample_interval)
         try:
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
+            for current_time, frame_count, boxes in frames:
+                cows_in_frame = len(boxes)
+                _frames_processed.inc()
+                
+                total_cows_detected += cows_in_frame
+                max_cows_in_frame = max(max_cows_in_frame, cows_in_frame)
+                analyzed_count += 1
                 
-                frame_count += 1
-                current_time = frame_count / fps
+                # Log progress with timestamp in MM:SS format
+                current_minutes = int(current_time // 60)
+                current_seconds = int(current_time % 60)
+                logger.info(f"Processing {current_minutes:02d}:{current_seconds:02d} - detected {cows_in_frame} cow(s)")
                 
-                # Process frame if enough time has passed since last processing
-                if current_time - last_processed_time >= sample_interval:
-                    last_processed_time = current_time
-                    
-                    # Convert BGR to RGB for YOLO
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Run YOLO detection
-                    results = self.yolo_service.model(rgb_frame)
-                    
-                    # Collect detections for this timestamp
-                    frame_detections = []
-                    cows_in_frame = 0
-                    
-                    for result in results:
-                        boxes = result.boxes
-                        for box in boxes:
-                            class_id = int(box.cls[0])
-                            class_name = self.yolo_service.model.names[class_id]
-                            
-                            if class_name.lower() == 'cow':
-                                cows_in_frame += 1
-                                confidence = float(box.conf[0])
-                                x1, y1, x2, y2 = map(float, box.xyxy[0].tolist())
-                                
-                                frame_detections.append({
-                                    "confidence": confidence,
-                                    "bbox": {
-                                        "x1": x1,
-                                        "y1": y1,
-                                        "x2": x2,
-                                        "y2": y2
-                                    }
-                                })
-                    
-                    total_cows_detected += cows_in_frame
-                    max_cows_in_frame = max(max_cows_in_frame, cows_in_frame)
-                    analyzed_count += 1
-                    
-                    # Log progress with timestamp in MM:SS format
-                    current_minutes = int(current_time // 60)
-                    current_seconds = int(current_time % 60)
-                    logger.info(f"Processing {current_minutes:02d}:{current_seconds:02d} - detected {cows_in_frame} cow(s)")
-                    
-                    detections_by_time.append({
-                        "timestamp": round(current_time, 2),
-                        "frame_number": frame_count,
-                        "cows_count": cows_in_frame,
-                        "detections": frame_detections
-                    })
+                timestamps.append(round(current_time, 2))
+                frame_numbers.append(frame_count)
+                frame_boxes.append(boxes)
             
         finally:
+            # Stop pipeline threads before releasing the capture they read from
+            frames.close()
             cap.release()
         
         avg_cows = total_cows_detected / analyzed_count if analyzed_count > 0 else 0
@@ -194,7 +200,7 @@ class VideoService:
         logger.info(f"Total cows detected: {total_cows_detected}, Max in frame: {max_cows_in_frame}, Average: {avg_cows:.2f}")
         
         return {
-            "video_filename": os.path.basename(video_path),
+            "video_filename": self.stored_name(video_path),
             "duration": round(duration, 2),
             "fps": fps,
             "width": width,
@@ -203,14 +209,124 @@ class VideoService:
             "analyzed_frames": analyzed_count,
             "total_cows_detected": total_cows_detected,
             "max_cows_in_frame": max_cows_in_frame,
-            "average_cows_per_frame": round(avg_cows, 2),
-            "detections_by_time": detections_by_time
-        }
+            "average_cows_per_frame": round(avg_cows, 2)
+        }, DetectionColumns.from_arrays(timestamps, frame_numbers, frame_boxes)
+    
+    def estimate_frames(self, video_path: str, sample_interval: float) -> int:
+        """Number of frames analyze_video will run through the model"""
+        cap = cv2.VideoCapture(video_path)
+        try:
+            fps = int(cap.get(cv2.CAP_PROP_FPS))
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        finally:
+            cap.release()
+        if fps <= 0 or total_frames <= 0:
+            return 1
+        duration = total_frames / fps
+        return max(1, min(total_frames, math.ceil(duration / max(sample_interval, 1 / fps))))
+    
+    @staticmethod
+    def admission_cost(frames: int) -> int:
+        """Model runs an analysis of `frames` frames keeps in flight at once (admission cost)"""
+        return min(frames, VIDEO_IN_FLIGHT_FRAMES)
+    
+    def stored_name(self, video_path: str) -> str:
+        """Name of video relative to upload directory (as stored in VideoAnalysis)"""
+        return Path(os.path.relpath(video_path, self.upload_dir)).as_posix()
+    
+    def video_path(self, filename: str) -> Optional[Path]:
+        """Path of stored video, None if missing, not a video name or outside the upload directory"""
+        if not storage.is_video_name(filename):
+            return None
+        file_path = storage.resolve(self.upload_dir, filename)
+        return file_path if file_path is not None and file_path.is_file() else None
     
     def delete_video(self, filename: str) -> bool:
-        """Delete video file"""
-        file_path = self.upload_dir / filename
-        if file_path.exists():
-            file_path.unlink()
-            return True
-        return False
+        """Delete video file (names of other stored files are refused)"""
+        if not storage.is_video_name(filename):
+            return False
+        return storage.remove(self.upload_dir, filename) > 0
+
+
+class VideoAnalysisService:
+    """
+    Service for stored video analyses
+    Orchestrates VideoService, Repository and DetectionStore
+    """
+    
+    def __init__(self, db: Session, video_service: VideoService, detection_store: DetectionStore):
+        self.repository = VideoAnalysisRepository(db, frame_counts=detection_store.frame_counts)
+        self.video_service = video_service
+        self.detection_store = detection_store
+    
+    def analyze_and_save(self, video_path: str, sample_interval: float) -> Tuple[VideoAnalysis, Dict, DetectionColumns]:
+        """
+        Analyze video and persist summary and columnar detections
+        Returns: (analysis, summary, detection columns)
+        """
+        summary, columns = self.video_service.analyze_video_columns(video_path, sample_interval=sample_interval)
+        
+        with metrics.stage(metrics.DB_WRITE):
+            analysis = self.repository.create(summary, sample_interval, frame_counts=columns.frames["cows_count"])
+            try:
+                self.detection_store.save(analysis.id, columns)
+            except Exception:
+                self.repository.delete(analysis.id)
+                raise
+        
+        return analysis, summary, columns
+    
+    def get_history(self, skip: int = 0, limit: int = 100) -> List[VideoAnalysis]:
+        """Get stored video analyses"""
+        return self.repository.get_all(skip=skip, limit=limit)
+    
+    def get_by_id(self, analysis_id: int) -> VideoAnalysis:
+        """Get video analysis by ID"""
+        analysis = self.repository.get_by_id(analysis_id)
+        if not analysis:
+            raise HTTPException(status_code=404, detail="Video analysis not found")
+        return analysis
+    
+    def get_detections(
+        self,
+        analysis_id: int,
+        start: Optional[float] = None,
+        end: Optional[float] = None
+    ) -> DetectionColumns:
+        """Get detections of analysis in time window [start, end] (seconds)"""
+        self.get_by_id(analysis_id)
+        if start is not None and end is not None and start > end:
+            raise HTTPException(status_code=400, detail="start must not be greater than end")
+        if not self.detection_store.exists(analysis_id):
+            raise HTTPException(status_code=404, detail="Detections for video analysis not found")
+        return self.detection_store.load_window(analysis_id, start=start, end=end)
+    
+    def clip(self, analysis_id: int, start: float, end: float) -> ClipRenderer:
+        """
+        Annotated clip of analysis for [start, end] (seconds), drawn from stored detections
+        The model is not run; the video file must still be stored
+        """
+        analysis = self.get_by_id(analysis_id)
+        if start < 0 or start >= end:
+            raise HTTPException(status_code=400, detail="start must be at least 0 and less than end")
+        if start >= analysis.duration:
+            raise HTTPException(status_code=400, detail=f"start is beyond the end of the video ({analysis.duration}s)")
+        end = min(end, analysis.duration)
+        if end - start > CLIP_MAX_SECONDS:
+            raise HTTPException(status_code=400, detail=f"Clip is longer than {CLIP_MAX_SECONDS:g} seconds")
+        if not self.detection_store.exists(analysis_id):
+            raise HTTPException(status_code=404, detail="Detections for video analysis not found")
+        video_path = self.video_service.video_path(analysis.video_filename)
+        if video_path is None:
+            raise HTTPException(status_code=404, detail="Video file of analysis not found")
+
+        # Boxes shown at start may come from an analyzed frame shortly before it
+        hold = hold_frames(analysis.sample_interval, analysis.fps) / analysis.fps
+        columns = self.detection_store.load_window(analysis_id, start=max(0.0, start - hold), end=end)
+        return ClipRenderer(video_path, columns, analysis.fps, analysis.sample_interval, start, end)
+    
+    def delete(self, analysis_id: int) -> None:
+        """Delete video analysis and its stored detections (video file is kept)"""
+        self.get_by_id(analysis_id)
+        self.detection_store.delete(analysis_id)
+        self.repository.delete(analysis_id)
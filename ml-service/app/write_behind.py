@@ -0,0 +1,312 @@
+"""
+Write-behind persistence of recognitions
+
+With WRITE_BEHIND enabled, /detect and ingestion do not write the database
+while the client waits. A recognition gets its id from a block reserved up
+front (id_sequences table, shared by all API processes), is appended to a
+journal file and queued, and the response goes out right away. A writer
+thread commits queued recognitions in batches (up to WRITE_BEHIND_BATCH rows,
+at least every WRITE_BEHIND_INTERVAL seconds), so SQLite sees one write
+transaction per batch instead of one per request.
+
+The journal is flushed (and fsync'ed with WRITE_BEHIND_FSYNC) before a
+recognition is acknowledged. Journal segments are deleted once their rows
+are committed. Shutdown commits everything queued; segments left behind by a
+crash are replayed at the next start (rows are inserted by id, so a replay
+never duplicates). Failed commits are retried with backoff, rows stay queued.
+
+Until its batch commits, a recognition is served from the queue by
+GET /detect/{id} of the same process; history and stats include it after the
+commit. All API processes must use the same setting: ids of normal inserts
+could collide with reserved ones.
+"""
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+import fcntl
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from .cache import RECOGNITIONS, response_cache
+from .database import SessionLocal
+from .models import Recognition
+from .repositories import IdSequenceRepository, RecognitionRepository
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+
+# Journal segments of queued recognitions
+WRITE_BEHIND_DIR = Path(os.getenv("WRITE_BEHIND_DIR", "./data/write_behind"))
+
+# Most rows per transaction / longest wait before a partial batch is committed (seconds)
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2"))
+
+# Submitters wait while this many rows are queued (database slower than requests)
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+
+# fsync journal before acknowledging (off: a power loss may lose the last batch)
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "true").lower() in ("1", "true", "yes")
+
+# Ids reserved per database round trip
+WRITE_BEHIND_ID_BLOCK = int(os.getenv("WRITE_BEHIND_ID_BLOCK", "100"))
+
+# Seconds shutdown waits for the queue to be committed (the rest is replayed on next start)
+WRITE_BEHIND_STOP_TIMEOUT = float(os.getenv("WRITE_BEHIND_STOP_TIMEOUT", "30"))
+
+SEQUENCE = "recognitions"
+
+# Newer segments may belong to a process that has not locked them yet
+_REPLAY_MIN_AGE = 5.0
+
+# Longest pause between retries of a failed commit (seconds)
+_RETRY_MAX = 30.0
+
+
+class _Segment:
+    """
+    Journal file of rows queued while it was current
+    Locked while open, so replay can tell it from segments of stopped processes
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self.file = os.fdopen(fd, "w")
+        # Rows not committed yet
+        self.outstanding = 0
+
+    def append(self, line: str, fsync: bool) -> None:
+        self.file.write(line)
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+
+    def delete(self) -> None:
+        # Unlink while still locked: replay must not pick it up in between
+        self.path.unlink(missing_ok=True)
+        self.file.close()
+
+
+def _read_segment(path: Path) -> Iterator[Dict]:
+    for line in path.read_text().splitlines():
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            # Torn last line of a crash (never acknowledged)
+            continue
+        row["created_at"] = datetime.fromisoformat(row["created_at"])
+        yield row
+
+
+class RecognitionWriter:
+    """
+    Journaled queue of recognitions and the thread committing it
+    """
+
+    def __init__(
+        self,
+        journal_dir: Path = WRITE_BEHIND_DIR,
+        batch_size: int = WRITE_BEHIND_BATCH,
+        interval: float = WRITE_BEHIND_INTERVAL,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        fsync: bool = WRITE_BEHIND_FSYNC,
+        id_block: int = WRITE_BEHIND_ID_BLOCK
+    ):
+        self.journal_dir = journal_dir
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.max_pending = max(1, max_pending)
+        self.fsync = fsync
+        self.id_block = max(1, id_block)
+        self.active = False
+        self.committed = 0
+        self.last_error: Optional[str] = None
+        self._cond = threading.Condition()
+        # id -> row, until committed
+        self._pending: Dict[int, Dict] = {}
+        # (row, accepted at, journal segment), not taken by a batch yet
+        self._queue: Deque[Tuple[Dict, float, _Segment]] = deque()
+        self._segment: Optional[_Segment] = None
+        self._segment_numbers = itertools.count()
+        self._segment_prefix = f"{os.getpid()}-{int(time.time() * 1000)}"
+        self._ids: Iterator[int] = iter(())
+        self._id_lock = threading.Lock()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Replay journals of stopped processes, then start the writer thread (blocking)"""
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.replay()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        self.active = True
+        logger.info(f"Write-behind enabled: batches of {self.batch_size}, every {self.interval}s")
+
+    def stop(self, timeout: float = WRITE_BEHIND_STOP_TIMEOUT) -> None:
+        """Stop accepting rows and commit the queue (blocking)"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self.active = False
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Write-behind: {len(self._pending)} recognitions not committed, left in journal")
+        self._thread = None
+
+    def _next_id(self) -> int:
+        with self._id_lock:
+            recognition_id = next(self._ids, None)
+            if recognition_id is None:
+                with SessionLocal() as db:
+                    first, end = IdSequenceRepository(db).reserve(SEQUENCE, Recognition.id, self.id_block)
+                self._ids = iter(range(first + 1, end))
+                recognition_id = first
+            return recognition_id
+
+    def submit(self, image_path: str, result: list, cows_count: int) -> Recognition:
+        """
+        Queue recognition and return it with its id (not attached to a session)
+        Blocking: returns once the row is journaled
+        """
+        row = {
+            "id": self._next_id(),
+            "image_path": image_path,
+            "result": result,
+            "cows_count": cows_count,
+            "created_at": datetime.utcnow()
+        }
+        line = json.dumps({**row, "created_at": row["created_at"].isoformat()}) + "\n"
+        with self._cond:
+            while self.active and len(self._queue) >= self.max_pending:
+                self._cond.wait()
+            if not self.active:
+                raise RuntimeError("Write-behind is not running")
+            if self._segment is None:
+                self._segment = _Segment(self.journal_dir / f"{self._segment_prefix}-{next(self._segment_numbers)}.jsonl")
+            self._segment.append(line, self.fsync)
+            self._segment.outstanding += 1
+            self._queue.append((row, time.monotonic(), self._segment))
+            self._pending[row["id"]] = row
+            metrics.WRITE_BEHIND_PENDING.inc()
+            # Writer sleeps until the first row (interval starts) or a full batch
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return Recognition(**row)
+
+    def get(self, recognition_id: int) -> Optional[Recognition]:
+        """Recognition acknowledged but not committed yet, None otherwise"""
+        with self._cond:
+            row = self._pending.get(recognition_id)
+        return Recognition(**row) if row is not None else None
+
+    def _take_batch(self) -> Optional[List[Tuple[Dict, float, _Segment]]]:
+        """Wait for a full batch, the interval or stop; None once stopped and drained"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                age = now - self._queue[0][1] if self._queue else 0.0
+                metrics.WRITE_BEHIND_LAG_SECONDS.set(age)
+                if self._queue and (len(self._queue) >= self.batch_size or age >= self.interval or self._stopping):
+                    break
+                if not self._queue and self._stopping:
+                    return None
+                self._cond.wait(self.interval - age if self._queue else None)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            # Later rows go to a new segment, so this one can go once its rows are committed
+            self._segment = None
+            self._cond.notify_all()
+            return batch
+
+    def _commit(self, batch: List[Tuple[Dict, float, _Segment]]) -> None:
+        rows = [row for row, _, _ in batch]
+        delay = self.interval or 0.1
+        while True:
+            try:
+                with metrics.stage(metrics.DB_WRITE), SessionLocal() as db:
+                    RecognitionRepository(db).create_many(rows)
+                break
+            except Exception as e:
+                metrics.WRITE_BEHIND_FAILURES.inc()
+                self.last_error = str(e)
+                logger.warning(f"Write-behind: commit of {len(rows)} recognitions failed, retrying: {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, _RETRY_MAX)
+
+        now = time.monotonic()
+        with self._cond:
+            for row, accepted_at, segment in batch:
+                del self._pending[row["id"]]
+                metrics.WRITE_BEHIND_COMMIT_DELAY_SECONDS.observe(now - accepted_at)
+                segment.outstanding -= 1
+                if segment.outstanding == 0:
+                    segment.delete()
+            self.committed += len(rows)
+        metrics.WRITE_BEHIND_PENDING.dec(len(rows))
+        metrics.WRITE_BEHIND_BATCH_ROWS.observe(len(rows))
+        response_cache.invalidate(RECOGNITIONS)
+
+    def _run(self) -> None:
+        metrics.set_endpoint("write_behind")
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                metrics.WRITE_BEHIND_LAG_SECONDS.set(0)
+                return
+            self._commit(batch)
+
+    def replay(self) -> int:
+        """Commit journal segments left by processes that did not finish; returns rows inserted"""
+        inserted = 0
+        for path in sorted(self.journal_dir.glob("*.jsonl")):
+            try:
+                if time.time() - path.stat().st_mtime < _REPLAY_MIN_AGE:
+                    continue
+                lock = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Owner is still running
+                    continue
+                if not path.exists():
+                    continue
+                rows = list(_read_segment(path))
+                with SessionLocal() as db:
+                    repository = RecognitionRepository(db)
+                    for i in range(0, len(rows), self.batch_size):
+                        inserted += len(repository.create_many(rows[i:i + self.batch_size]))
+                path.unlink()
+        if inserted:
+            logger.info(f"Write-behind: replayed {inserted} recognitions from journal")
+            response_cache.invalidate(RECOGNITIONS)
+        return inserted
+
+    def status(self) -> Dict:
+        with self._cond:
+            return {
+                "active": self.active,
+                "pending": len(self._pending),
+                "queued": len(self._queue),
+                "lag_seconds": round(time.monotonic() - self._queue[0][1], 3) if self._queue else 0.0,
+                "committed": self.committed,
+                "last_error": self.last_error
+            }
+
+
+# Global instance (started by the application lifespan when WRITE_BEHIND is set)
+recognition_writer = RecognitionWriter()
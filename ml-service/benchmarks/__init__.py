@@ -0,0 +1 @@
+# Benchmarks (run from ml-service directory: python -m benchmarks.<name>)
@@ -0,0 +1,289 @@
+"""
+Benchmark suite: image detection, video analysis and live stream round trips
+
+Runs offline on synthetic media (see benchmarks/synthetic.py):
+- detect_cows: YOLOService.detect_cows per image resolution
+- analyze_video: VideoService.analyze_video per resolution, duration and sample_interval
+- stream: /stream/video round trips through the in-process ASGI app, sending
+  frames the way the LiveCamera component does
+
+By default the model is a stub with a fixed inference latency, so results show
+the cost of everything around the network and are comparable across machines
+and library upgrades. Use --model real to include YOLO itself.
+
+Usage (from ml-service directory):
+    python -m benchmarks.bench_pipeline --output bench.json
+    python -m benchmarks.bench_pipeline --model real --output real.json
+    python -m benchmarks.bench_pipeline --baseline bench.json --fail-on-regression
+
+Results are JSON: {"environment": {...}, "results": [{"bench", "params", "metrics"}]}.
+Runs are compared on one metric per benchmark (PRIMARY_METRICS).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from . import stub_model
+from .synthetic import DEFAULT_RESOLUTIONS, make_data_url, make_rgb_image, make_video, parse_resolution
+
+# Metric used to compare runs, and whether higher is better
+PRIMARY_METRICS = {
+    "detect_cows": ("p50_ms", False),
+    "analyze_video": ("wall_s", False),
+    "stream": ("fps", True),
+}
+
+MEDIA_DIR = Path("./data/bench-media")
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary (milliseconds) of samples in seconds"""
+    ms = np.asarray(samples) * 1000
+    return {
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "min_ms": round(float(ms.min()), 3),
+    }
+
+
+def bench_detect(yolo_service, resolutions: List[str], repeat: int) -> List[dict]:
+    from PIL import Image
+
+    results = []
+    for resolution in resolutions:
+        width, height = parse_resolution(resolution)
+        image = Image.fromarray(make_rgb_image(width, height))
+        yolo_service.detect_cows(image)  # warm-up
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            yolo_service.detect_cows(image)
+            samples.append(time.perf_counter() - start)
+        metrics = summarize(samples)
+        metrics["images_per_s"] = round(1000 / metrics["mean_ms"], 2)
+        results.append({"bench": "detect_cows", "params": {"resolution": resolution}, "metrics": metrics})
+    return results
+
+
+def bench_video(
+    yolo_service,
+    media_dir: Path,
+    resolutions: List[str],
+    durations: List[float],
+    intervals: List[float],
+    fps: int
+) -> List[dict]:
+    from app.video_service import VideoService
+
+    media_dir.mkdir(parents=True, exist_ok=True)
+    video_service = VideoService(upload_dir=media_dir, yolo_service=yolo_service)
+    results = []
+    for resolution in resolutions:
+        width, height = parse_resolution(resolution)
+        for duration in durations:
+            path = make_video(media_dir / f"synthetic-{resolution}-{duration:g}s-{fps}fps.mp4", width, height, duration, fps)
+            for interval in intervals:
+                start = time.perf_counter()
+                summary = video_service.analyze_video(str(path), sample_interval=interval)
+                wall = time.perf_counter() - start
+                analyzed = summary["analyzed_frames"]
+                results.append({
+                    "bench": "analyze_video",
+                    "params": {"resolution": resolution, "duration_s": duration, "sample_interval": interval},
+                    "metrics": {
+                        "wall_s": round(wall, 4),
+                        "analyzed_frames": analyzed,
+                        "ms_per_analyzed_frame": round(wall * 1000 / max(analyzed, 1), 3),
+                        "realtime_factor": round(duration / wall, 2),
+                    }
+                })
+    return results
+
+
+def bench_stream(resolutions: List[str], frames: int, stream_format: str) -> List[dict]:
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.stream_routers import router
+
+    app = FastAPI()
+    app.include_router(router)
+
+    results = []
+    with TestClient(app) as client:
+        for resolution in resolutions:
+            width, height = parse_resolution(resolution)
+            messages = [
+                json.dumps({"type": "frame", "data": make_data_url(width, height, seed=i), "timestamp": i})
+                for i in range(min(frames, 8))
+            ]
+            with client.websocket_connect(f"/stream/video?format={stream_format}") as websocket:
+                receive = websocket.receive_json if stream_format == "json" else websocket.receive_bytes
+                for message in messages[:2]:  # warm-up
+                    websocket.send_text(message)
+                    receive()
+                samples = []
+                total_start = time.perf_counter()
+                for i in range(frames):
+                    start = time.perf_counter()
+                    websocket.send_text(messages[i % len(messages)])
+                    receive()
+                    samples.append(time.perf_counter() - start)
+                total = time.perf_counter() - total_start
+            metrics = summarize(samples)
+            metrics["fps"] = round(frames / total, 2)
+            results.append({
+                "bench": "stream",
+                "params": {"resolution": resolution, "format": stream_format},
+                "metrics": metrics
+            })
+    return results
+
+
+def environment(model: str) -> dict:
+    """Versions and machine info stored with results"""
+    versions = {}
+    for package in ("ultralytics", "torch", "opencv-python", "opencv-python-headless", "numpy", "pillow", "fastapi"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            pass
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "model": model,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+    }
+
+
+def _key(result: dict) -> str:
+    return result["bench"] + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[dict]:
+    """Compare primary metric of each result with the same benchmark in baseline"""
+    previous = {_key(result): result for result in baseline}
+    rows = []
+    for result in results:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        metric, higher_is_better = PRIMARY_METRICS[result["bench"]]
+        new_value, old_value = result["metrics"][metric], old["metrics"][metric]
+        if not old_value:
+            continue
+        change = (new_value - old_value) / old_value
+        worse = -change if higher_is_better else change
+        rows.append({
+            "bench": result["bench"],
+            "params": result["params"],
+            "metric": metric,
+            "baseline": old_value,
+            "current": new_value,
+            "change_pct": round(change * 100, 1),
+            "regression": worse > tolerance,
+        })
+    return rows
+
+
+def _csv(text: str, cast=str) -> list:
+    return [cast(item) for item in text.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["stub", "real"], default="stub", help="Stub (fixed latency) or real YOLO model")
+    parser.add_argument("--weights", default=os.getenv("MODEL_WEIGHTS", "yolov8n.pt"), help="Weights file for --model real")
+    parser.add_argument("--stub-latency-ms", type=float, default=20.0, help="Inference latency of stub model")
+    parser.add_argument("--benches", default="detect_cows,analyze_video,stream", help="Comma-separated benchmarks to run")
+    parser.add_argument("--resolutions", default=",".join(DEFAULT_RESOLUTIONS), help="Comma-separated WIDTHxHEIGHT")
+    parser.add_argument("--durations", default="5,20", help="Video durations in seconds")
+    parser.add_argument("--intervals", default="0.1,0.5,1.0", help="Video sample_interval values")
+    parser.add_argument("--video-fps", type=int, default=25, help="Frame rate of synthetic videos")
+    parser.add_argument("--repeat", type=int, default=10, help="Images per detect_cows measurement")
+    parser.add_argument("--stream-frames", type=int, default=50, help="Frames per stream measurement")
+    parser.add_argument("--stream-format", default="json", help="Stream result format (json, f32, msgpack)")
+    parser.add_argument("--media-dir", type=Path, default=MEDIA_DIR, help="Cache directory for synthetic videos")
+    parser.add_argument("--quick", action="store_true", help="Small matrix for smoke runs")
+    parser.add_argument("--output", type=Path, help="Write results JSON to file (use as future baseline)")
+    parser.add_argument("--baseline", type=Path, help="Compare with results JSON of earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown vs baseline")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regression")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.resolutions, args.durations, args.intervals = "640x480", "2", "0.5"
+        args.repeat, args.stream_frames = 3, 10
+
+    # Per-frame INFO logs of the video service would dominate the output
+    logging.disable(logging.INFO)
+
+    if args.model == "stub":
+        weights = stub_model.install(latency=args.stub_latency_ms / 1000)
+        model = f"stub ({args.stub_latency_ms:g} ms)"
+    else:
+        weights = args.weights
+        model = Path(weights).name
+
+    # Shared model, as loaded by the app lifespan (also used by /stream/video)
+    from app import model as shared_model
+    yolo_service = shared_model.load(weights=weights)
+
+    benches = _csv(args.benches)
+    resolutions = _csv(args.resolutions)
+    results = []
+    if "detect_cows" in benches:
+        results += bench_detect(yolo_service, resolutions, args.repeat)
+    if "analyze_video" in benches:
+        results += bench_video(
+            yolo_service, args.media_dir, resolutions,
+            _csv(args.durations, float), _csv(args.intervals, float), args.video_fps
+        )
+    if "stream" in benches:
+        results += bench_stream(resolutions, args.stream_frames, args.stream_format)
+
+    report = {"environment": environment(model), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    print(f"model: {model}")
+    for result in results:
+        params = " ".join(f"{k}={v}" for k, v in result["params"].items())
+        metrics = " ".join(f"{k}={v}" for k, v in result["metrics"].items())
+        print(f"{result['bench']:<14}{params:<60}{metrics}")
+
+    if not args.baseline:
+        return
+    baseline = json.loads(args.baseline.read_text())
+    rows = compare(results, baseline["results"], args.tolerance)
+    print(f"\nvs baseline {args.baseline} ({baseline['environment'].get('commit')}, {baseline['environment'].get('model')})")
+    for row in rows:
+        params = " ".join(f"{k}={v}" for k, v in row["params"].items())
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['bench']:<14}{params:<60}{row['metric']}: {row['baseline']} -> {row['current']} ({row['change_pct']:+.1f}%){flag}")
+    if args.fail_on_regression and any(row["regression"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: payload size and encode time of detection response formats
+
+Compares the current JSON path (nested dicts through FastAPI's jsonable_encoder)
+with the compact columnar encodings from app.serializers on a synthetic
+video analysis result.
+
+Usage (from ml-service directory):
+    python -m benchmarks.bench_serialization --frames 6000 --cows 5
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+from app.detection_store import DetectionColumns
+from app.serializers import (
+    F32_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    available_media_types,
+    encode
+)
+
+
+def make_columns(frames: int, cows: int, seed: int = 0) -> DetectionColumns:
+    """Synthetic analysis: `frames` sampled frames with 0..2*cows detections each"""
+    rng = np.random.default_rng(seed)
+    timestamps = [round(i * 0.1, 2) for i in range(frames)]
+    frame_numbers = [i * 3 + 1 for i in range(frames)]
+    boxes = []
+    for _ in range(frames):
+        n = int(rng.integers(0, 2 * cows + 1))
+        xy = rng.uniform(0, 1920, size=(n, 2)).astype(np.float32)
+        wh = rng.uniform(20, 400, size=(n, 2)).astype(np.float32)
+        conf = rng.uniform(0.25, 1.0, size=(n, 1)).astype(np.float32)
+        boxes.append(np.hstack([conf, xy, xy + wh]))
+    return DetectionColumns.from_arrays(timestamps, frame_numbers, boxes)
+
+
+def timed(func, repeat: int):
+    """Best-of-N wall time in milliseconds and last result"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def run(frames: int, cows: int, repeat: int) -> list:
+    columns = make_columns(frames, cows)
+    meta = {"analysis_id": 1, "analyzed_frames": frames}
+
+    cases = {
+        # What /video/analyze does today: build dicts, then jsonable_encoder + json.dumps
+        "json (records + jsonable_encoder)": lambda: json.dumps(
+            jsonable_encoder({**meta, "detections_by_time": columns.to_records()})
+        ).encode(),
+        "json (records only)": lambda: json.dumps(
+            {**meta, "detections_by_time": columns.to_records()}
+        ).encode(),
+        "f32": lambda: encode(F32_MEDIA_TYPE, meta, columns.flat_columns()),
+    }
+    if MSGPACK_MEDIA_TYPE in available_media_types():
+        cases["msgpack"] = lambda: encode(MSGPACK_MEDIA_TYPE, meta, columns.flat_columns())
+
+    rows = []
+    for name, func in cases.items():
+        ms, payload = timed(func, repeat)
+        rows.append({"format": name, "bytes": len(payload), "encode_ms": round(ms, 3)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=6000, help="Number of analyzed frames")
+    parser.add_argument("--cows", type=int, default=5, help="Average cows per frame")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions (best time is reported)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rows = run(args.frames, args.cows, args.repeat)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    baseline = rows[0]
+    print(f"{args.frames} frames, ~{args.cows} cows/frame")
+    print(f"{'format':<36}{'bytes':>12}{'ratio':>8}{'encode ms':>12}{'speedup':>9}")
+    for row in rows:
+        print(
+            f"{row['format']:<36}{row['bytes']:>12}"
+            f"{row['bytes'] / baseline['bytes']:>8.3f}"
+            f"{row['encode_ms']:>12.2f}"
+            f"{baseline['encode_ms'] / max(row['encode_ms'], 1e-6):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: video file streaming throughput and CPU cost per byte
+
+Drives the ASGI responses in-process with N concurrent "viewers" and compares:
+- legacy: the previous StreamingResponse generator reading 8 KB chunks
+- pread: RangeFileResponse on a server without zero-copy (1 MB pread chunks)
+- sendfile: RangeFileResponse with the "http.response.zerocopysend" extension,
+  emulated here by os.sendfile() into /dev/null
+
+Usage (from ml-service directory):
+    python -m benchmarks.bench_video_streaming --size-mb 256 --viewers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import Headers
+
+from app.file_streaming import RangeFileResponse
+
+
+def legacy_response(file_path: str) -> StreamingResponse:
+    """Previous stream_video implementation (full-file branch)"""
+    def iter_full_file():
+        with open(file_path, "rb") as f:
+            while chunk := f.read(8192):
+                yield chunk
+
+    return StreamingResponse(
+        iter_full_file(),
+        headers={"Accept-Ranges": "bytes", "Content-Length": str(os.path.getsize(file_path))},
+        media_type="video/mp4"
+    )
+
+
+class Sink:
+    """ASGI send() that discards body bytes, optionally emulating zero-copy sends"""
+
+    def __init__(self, devnull_fd: int):
+        self.devnull_fd = devnull_fd
+        self.bytes = 0
+
+    async def __call__(self, message: dict) -> None:
+        if message["type"] == "http.response.body":
+            self.bytes += len(message.get("body", b""))
+        elif message["type"] == "http.response.zerocopysend":
+            fd = message["file"].fileno()
+            offset, count = message["offset"], message["count"]
+            while count > 0:
+                sent = os.sendfile(self.devnull_fd, fd, offset, count)
+                offset += sent
+                count -= sent
+                self.bytes += sent
+
+
+async def _receive() -> dict:
+    # Client never disconnects (StreamingResponse listens for http.disconnect)
+    await asyncio.Event().wait()
+
+
+async def serve_one(mode: str, file_path: str, devnull_fd: int) -> int:
+    extensions = {"http.response.zerocopysend": {}} if mode == "sendfile" else {}
+    scope = {"type": "http", "method": "GET", "headers": [], "extensions": extensions}
+    if mode == "legacy":
+        response = legacy_response(file_path)
+    else:
+        response = RangeFileResponse(file_path, Headers(), method="GET")
+    sink = Sink(devnull_fd)
+    await response(scope, _receive, sink)
+    return sink.bytes
+
+
+async def run_mode(mode: str, file_path: str, viewers: int) -> dict:
+    devnull_fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        sizes = await asyncio.gather(*(serve_one(mode, file_path, devnull_fd) for _ in range(viewers)))
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        os.close(devnull_fd)
+
+    total_mb = sum(sizes) / (1024 * 1024)
+    return {
+        "mode": mode,
+        "viewers": viewers,
+        "total_mb": round(total_mb, 1),
+        "throughput_mb_s": round(total_mb / wall, 1),
+        # Includes worker-thread CPU of this process
+        "cpu_ms_per_gb": round(cpu * 1000 / (total_mb / 1024), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=128, help="Size of synthetic video file")
+    parser.add_argument("--viewers", type=int, default=4, help="Concurrent viewers")
+    parser.add_argument("--modes", default="legacy,pread,sendfile", help="Comma-separated modes to run")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as tmp:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            tmp.write(block)
+        tmp.flush()
+
+        results = [asyncio.run(run_mode(mode, tmp.name, args.viewers)) for mode in args.modes.split(",")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.size_mb} MB file, {args.viewers} concurrent viewers")
+    print(f"{'mode':<10}{'MB/s':>10}{'CPU ms/GB':>12}")
+    for row in results:
+        print(f"{row['mode']:<10}{row['throughput_mb_s']:>10}{row['cpu_ms_per_gb']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Load test against a running instance: concurrent uploads, video analyses and camera streams
+
+Mixes, for --duration seconds:
+- closed-loop POST /detect uploads (--uploads workers)
+- closed-loop POST /video/analyze submissions (--videos workers)
+- WebSocket camera clients (--streams) sending frames to /stream/video at
+  --fps, in the same format as the LiveCamera component (JSON with a JPEG
+  data URL, sent on a timer without waiting for results)
+
+Reports p50/p95/p99 latency, throughput, error and 429 rates per request kind,
+achieved FPS per stream and server memory (from /proc/<pid> with --server-pid,
+otherwise process_resident_memory_bytes from /metrics).
+
+--ramp runs several steps, scaling uploads and streams by each factor, to find
+the saturation point of one worker. Start the server with rate limits off,
+otherwise the per-IP limits (10/min on /detect) are what gets measured:
+
+    RATE_LIMIT_ENABLED=false uvicorn main:app --port 5007 --workers 1 &
+    python -m benchmarks.load_test --url http://localhost:5007 --ramp 1,2,4,8 --duration 30
+
+The 429 rate is reported separately. A step with more than 5% of any request
+kind rate limited is flagged and ends the ramp without a saturation verdict.
+"""
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+import websockets
+
+from .synthetic import make_data_url, make_jpeg, make_video, parse_resolution
+
+MEDIA_DIR = Path("./data/bench-media")
+
+
+class Recorder:
+    """Latencies and outcomes of one request kind"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ok = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    def add(self, seconds: float, status: Optional[int]) -> None:
+        if status is not None and 200 <= status < 300:
+            self.ok += 1
+            self.latencies.append(seconds)
+        elif status == 429:
+            self.rate_limited += 1
+        else:
+            self.errors += 1
+
+    def summary(self, duration: float) -> dict:
+        total = self.ok + self.errors + self.rate_limited
+        result = {
+            "requests": total,
+            "ok": self.ok,
+            "throughput_per_s": round(self.ok / duration, 2),
+            "error_rate": round(self.errors / total, 4) if total else 0.0,
+            "rate_limited_rate": round(self.rate_limited / total, 4) if total else 0.0,
+        }
+        if self.latencies:
+            ms = np.asarray(self.latencies) * 1000
+            for q in (50, 95, 99):
+                result[f"p{q}_ms"] = round(float(np.percentile(ms, q)), 1)
+        return result
+
+
+async def upload_worker(client: httpx.AsyncClient, image: bytes, deadline: float, recorder: Recorder) -> None:
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.post("/detect", files={"file": ("load.jpg", image, "image/jpeg")})
+            status = response.status_code
+        except httpx.HTTPError:
+            status = None
+        recorder.add(time.perf_counter() - start, status)
+        if status == 429:
+            await asyncio.sleep(0.5)
+
+
+async def video_worker(
+    client: httpx.AsyncClient,
+    video: bytes,
+    sample_interval: float,
+    deadline: float,
+    recorder: Recorder
+) -> None:
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.post(
+                "/video/analyze",
+                params={"sample_interval": sample_interval},
+                files={"file": ("load.mp4", video, "video/mp4")},
+                timeout=600
+            )
+            status = response.status_code
+        except httpx.HTTPError:
+            status = None
+        recorder.add(time.perf_counter() - start, status)
+        if status == 429:
+            await asyncio.sleep(1.0)
+
+
+async def camera_client(ws_url: str, frames: List[str], fps: float, deadline: float, recorder: Recorder) -> dict:
+    """Simulated LiveCamera session; returns achieved FPS"""
+    sent_at: Dict[int, float] = {}
+    received = 0
+    index = 0
+    started = finished = time.monotonic()
+    try:
+        async with websockets.connect(ws_url, max_size=None) as websocket:
+            async def receive():
+                nonlocal received
+                try:
+                    async for message in websocket:
+                        data = json.loads(message)
+                        sent = sent_at.pop(data.get("timestamp"), None)
+                        if data.get("type") == "detection" and sent is not None:
+                            received += 1
+                            recorder.add(time.perf_counter() - sent, 200)
+                        elif data.get("type") == "error":
+                            recorder.add(0.0, None)
+                except websockets.ConnectionClosed:
+                    pass
+
+            receiver = asyncio.create_task(receive())
+            started = next_send = time.monotonic()
+            while time.monotonic() < deadline:
+                sent_at[index] = time.perf_counter()
+                await websocket.send(json.dumps({"type": "frame", "data": frames[index % len(frames)], "timestamp": index}))
+                index += 1
+                next_send += 1 / fps
+                await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+            finished = time.monotonic()
+            # Give in-flight frames a moment, then count the rest as dropped
+            await asyncio.sleep(min(2.0, 5 / fps))
+            receiver.cancel()
+    except (OSError, websockets.WebSocketException):
+        recorder.add(0.0, None)
+    elapsed = finished - started
+    return {"sent": index, "received": received, "fps": round(received / elapsed, 2) if elapsed else 0.0}
+
+
+async def sample_memory(client: httpx.AsyncClient, server_pid: Optional[int], stop: asyncio.Event, samples: List[float]) -> None:
+    """Server resident memory (MB), once per second"""
+    while not stop.is_set():
+        rss = None
+        if server_pid:
+            try:
+                for line in Path(f"/proc/{server_pid}/status").read_text().splitlines():
+                    if line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) / 1024
+            except OSError:
+                pass
+        else:
+            try:
+                response = await client.get("/metrics")
+                for line in response.text.splitlines():
+                    if line.startswith("process_resident_memory_bytes"):
+                        rss = float(line.split()[-1]) / (1024 * 1024)
+            except httpx.HTTPError:
+                pass
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_step(args, uploads: int, streams: int, image: bytes, video: Optional[bytes], frames: List[str]) -> dict:
+    ws_url = args.url.replace("http", "ws", 1).rstrip("/") + "/stream/video"
+    deadline = time.monotonic() + args.duration
+    recorders = {"detect": Recorder(), "video_analyze": Recorder(), "stream": Recorder()}
+    memory: List[float] = []
+    stop = asyncio.Event()
+
+    limits = httpx.Limits(max_connections=uploads + args.videos + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=120, limits=limits) as client:
+        monitor = asyncio.create_task(sample_memory(client, args.server_pid, stop, memory))
+        started = time.monotonic()
+        tasks = [upload_worker(client, image, deadline, recorders["detect"]) for _ in range(uploads)]
+        if video is not None:
+            tasks += [
+                video_worker(client, video, args.sample_interval, deadline, recorders["video_analyze"])
+                for _ in range(args.videos)
+            ]
+        stream_tasks = [camera_client(ws_url, frames, args.fps, deadline, recorders["stream"]) for _ in range(streams)]
+        results = await asyncio.gather(asyncio.gather(*tasks), asyncio.gather(*stream_tasks))
+        duration = time.monotonic() - started
+        stop.set()
+        await monitor
+
+    stream_fps = [session["fps"] for session in results[1]]
+    report = {
+        "uploads": uploads,
+        "videos": args.videos if video is not None else 0,
+        "streams": streams,
+        "target_fps": args.fps,
+        "duration_s": round(duration, 1),
+        "requests": {name: recorder.summary(duration) for name, recorder in recorders.items()},
+        "stream_fps": {
+            "mean": round(float(np.mean(stream_fps)), 2) if stream_fps else None,
+            "min": round(float(np.min(stream_fps)), 2) if stream_fps else None,
+        },
+    }
+    if memory:
+        report["server_memory_mb"] = {
+            "start": round(memory[0], 1),
+            "peak": round(max(memory), 1),
+            "end": round(memory[-1], 1),
+        }
+    return report
+
+
+def print_step(report: dict) -> None:
+    print(
+        f"\n== uploads={report['uploads']} videos={report['videos']} streams={report['streams']} "
+        f"@{report['target_fps']:g} fps, {report['duration_s']} s"
+    )
+    print(f"{'kind':<15}{'ok':>7}{'/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err %':>7}{'429 %':>7}")
+    for name, summary in report["requests"].items():
+        if not summary["requests"]:
+            continue
+        print(
+            f"{name:<15}{summary['ok']:>7}{summary['throughput_per_s']:>8}"
+            f"{summary.get('p50_ms', '-'):>9}{summary.get('p95_ms', '-'):>9}{summary.get('p99_ms', '-'):>9}"
+            f"{summary['error_rate'] * 100:>7.1f}{summary['rate_limited_rate'] * 100:>7.1f}"
+        )
+    if report["streams"]:
+        print(f"stream fps: mean {report['stream_fps']['mean']}, min {report['stream_fps']['min']}")
+    if "server_memory_mb" in report:
+        memory = report["server_memory_mb"]
+        print(f"server memory MB: start {memory['start']}, peak {memory['peak']}, end {memory['end']}")
+
+
+# Share of 429 responses above which a step measures the rate limiter, not the server
+RATE_LIMITED_MAX = 0.05
+
+
+def rate_limited(report: dict) -> List[str]:
+    """Request kinds of a step that were rate limited too often to be meaningful"""
+    return [
+        name for name, summary in report["requests"].items()
+        if summary["requests"] and summary["rate_limited_rate"] > RATE_LIMITED_MAX
+    ]
+
+
+def saturated(report: dict, previous: Optional[dict]) -> bool:
+    """
+    Step is past saturation: streams fall below 90% of target FPS, errors appear, or throughput stops growing
+    Only meaningful for steps that were not rate limited (see rate_limited)
+    """
+    streams = report["requests"]["stream"]
+    if report["streams"] and (report["stream_fps"]["min"] or 0) < 0.9 * report["target_fps"]:
+        return True
+    if any(summary["error_rate"] > 0.01 for summary in report["requests"].values()):
+        return True
+    if previous is not None:
+        throughput = report["requests"]["detect"]["throughput_per_s"] + streams["throughput_per_s"]
+        before = previous["requests"]["detect"]["throughput_per_s"] + previous["requests"]["stream"]["throughput_per_s"]
+        return throughput < before * 1.05
+    return False
+
+
+async def main_async(args) -> List[dict]:
+    width, height = parse_resolution(args.resolution)
+    image = make_jpeg(width, height)
+    frames = [make_data_url(width, height, seed=i) for i in range(8)]
+    video = None
+    if args.videos:
+        path = make_video(MEDIA_DIR / f"synthetic-{args.resolution}-{args.video_seconds:g}s-25fps.mp4", width, height, args.video_seconds)
+        video = path.read_bytes()
+
+    reports = []
+    for factor in args.ramp:
+        report = await run_step(args, args.uploads * factor, args.streams * factor, image, video, frames)
+        report["rate_limited"] = rate_limited(report)
+        # Throughput capped by 429s says nothing about saturation
+        report["saturated"] = None if report["rate_limited"] else saturated(report, reports[-1] if reports else None)
+        print_step(report)
+        reports.append(report)
+        if report["rate_limited"]:
+            print(
+                f"\nStep x{factor} is rate limited ({', '.join(report['rate_limited'])}): "
+                "restart the server with RATE_LIMIT_ENABLED=false to measure saturation"
+            )
+            break
+        if report["saturated"] and len(args.ramp) > 1:
+            print(f"\nSaturation reached at step x{factor}")
+            break
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5007", help="Base URL of running instance")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per step")
+    parser.add_argument("--uploads", type=int, default=2, help="Concurrent /detect upload workers")
+    parser.add_argument("--videos", type=int, default=0, help="Concurrent /video/analyze workers")
+    parser.add_argument("--streams", type=int, default=2, help="Simulated camera clients")
+    parser.add_argument("--fps", type=float, default=10, help="Frames per second per camera (LiveCamera sends ~10)")
+    parser.add_argument("--resolution", default="1280x720", help="Image / frame / video resolution")
+    parser.add_argument("--video-seconds", type=float, default=10, help="Length of uploaded video")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="sample_interval for /video/analyze")
+    parser.add_argument("--ramp", default="1", help="Comma-separated factors applied to uploads and streams, one step each")
+    parser.add_argument("--server-pid", type=int, help="PID of server process for memory sampling")
+    parser.add_argument("--output", type=Path, help="Write step reports as JSON")
+    args = parser.parse_args()
+    args.ramp = [int(factor) for factor in args.ramp.split(",") if factor]
+
+    reports = asyncio.run(main_async(args))
+    if args.output:
+        args.output.write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Fixed-latency stand-in for the ultralytics YOLO model
+
+Lets benchmarks measure everything around the network (decode, post-processing,
+serialization, I/O, concurrency) with a constant, configurable inference cost,
+and run on machines without torch / model weights.
+
+`install()` must be called before the model is loaded: it registers
+a stub `ultralytics` module (and `torch`, if not installed) whose YOLO class
+returns results shaped like the real ones (`result.boxes.data` rows of
+[x1, y1, x2, y2, confidence, class_id]).
+"""
+import os
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+COW_CLASS_ID = 19
+
+
+class _Data:
+    """Tensor-like wrapper (.cpu().numpy())"""
+
+    def __init__(self, array: np.ndarray):
+        self._array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self) -> np.ndarray:
+        return self._array
+
+
+class _Boxes:
+    def __init__(self, rows: np.ndarray):
+        self.data = _Data(rows)
+
+
+class _Result:
+    def __init__(self, rows: np.ndarray):
+        self.boxes = _Boxes(rows)
+
+
+class StubYOLO:
+    """
+    YOLO replacement: sleeps `latency` seconds per image (GIL released, like
+    real inference in torch) and returns `cows` cow boxes plus one person box
+    """
+
+    latency = 0.02
+    cows = 5
+    names = {0: "person", 16: "dog", 19: "cow"}
+
+    def __init__(self, weights: str = "stub.pt", *args, **kwargs):
+        self.weights = weights
+
+    def __call__(self, source, *args, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        results = []
+        for image in images:
+            if self.latency:
+                time.sleep(self.latency)
+            results.append(_Result(self._boxes(np.asarray(image).shape)))
+        return results
+
+    def _boxes(self, shape) -> np.ndarray:
+        height, width = shape[:2]
+        rows = []
+        for i in range(self.cows):
+            x1 = width * (i + 0.1) / (self.cows + 1)
+            y1 = height * 0.3
+            rows.append([x1, y1, x1 + width * 0.12, y1 + height * 0.2, 0.5 + 0.4 * i / max(self.cows, 1), COW_CLASS_ID])
+        rows.append([0, 0, width * 0.1, height * 0.3, 0.9, 0])
+        return np.asarray(rows, dtype=np.float32)
+
+
+def install(latency: float = 0.02, cows: int = 5) -> str:
+    """
+    Register stub modules so `from ultralytics import YOLO` returns StubYOLO
+    Returns path of placeholder weights file (YOLOService only loads existing files)
+    """
+    StubYOLO.latency = latency
+    StubYOLO.cows = cows
+
+    ultralytics = types.ModuleType("ultralytics")
+    ultralytics.YOLO = StubYOLO
+    sys.modules["ultralytics"] = ultralytics
+
+    try:
+        import torch  # noqa: F401  (YOLOService patches torch.load)
+    except ImportError:
+        torch = types.ModuleType("torch")
+        torch.load = lambda *args, **kwargs: None
+        sys.modules["torch"] = torch
+
+    weights = os.path.join(tempfile.gettempdir(), "cowcount-stub.pt")
+    open(weights, "ab").close()
+    return weights
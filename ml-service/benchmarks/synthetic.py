@@ -0,0 +1,79 @@
+"""
+Synthetic, reproducible test media for benchmarks and load tests
+
+Images and videos are generated from a seed: a green "pasture" with brown
+ellipses moving across it, so JPEG/H.264 sizes and decode costs are close to
+real footage without shipping any media files.
+"""
+from pathlib import Path
+from typing import Tuple
+import base64
+
+import cv2
+import numpy as np
+
+DEFAULT_RESOLUTIONS = ["640x480", "1280x720", "1920x1080"]
+
+
+def parse_resolution(text: str) -> Tuple[int, int]:
+    """"1280x720" -> (1280, 720)"""
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+def make_frame(width: int, height: int, index: int = 0, cows: int = 5, seed: int = 0) -> np.ndarray:
+    """BGR frame with `cows` ellipses; `index` moves them (for video frames)"""
+    rng = np.random.default_rng(seed)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = (60, 140, 70)
+    # Low-amplitude noise so encoders cannot compress frames to nothing
+    noise = rng.integers(0, 24, size=(height // 8 + 1, width // 8 + 1, 1), dtype=np.uint8)
+    frame += cv2.resize(noise, (width, height), interpolation=cv2.INTER_NEAREST)[:, :, None]
+
+    for cow in range(cows):
+        cx0, cy0 = rng.uniform(0.1, 0.9, size=2)
+        vx, vy = rng.uniform(-0.002, 0.002, size=2)
+        cx = int(((cx0 + vx * index) % 1.0) * width)
+        cy = int(((cy0 + vy * index) % 1.0) * height)
+        axes = (max(4, width // 14), max(3, height // 16))
+        cv2.ellipse(frame, (cx, cy), axes, 0, 0, 360, (40, 70, 120), -1)
+        cv2.ellipse(frame, (cx + axes[0] // 3, cy - axes[1] // 4), (axes[0] // 3, axes[1] // 3), 0, 0, 360, (230, 230, 230), -1)
+    return frame
+
+
+def make_rgb_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """RGB image (as passed to YOLO)"""
+    return cv2.cvtColor(make_frame(width, height, seed=seed), cv2.COLOR_BGR2RGB)
+
+
+def make_jpeg(width: int, height: int, seed: int = 0, quality: int = 85) -> bytes:
+    """JPEG-encoded synthetic image"""
+    ok, buffer = cv2.imencode(".jpg", make_frame(width, height, seed=seed), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Cannot encode JPEG")
+    return buffer.tobytes()
+
+
+def make_data_url(width: int, height: int, seed: int = 0, quality: int = 70) -> str:
+    """Frame as sent by the LiveCamera component (canvas.toDataURL("image/jpeg", 0.7))"""
+    jpeg = make_jpeg(width, height, seed=seed, quality=quality)
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()
+
+
+def make_video(path: Path, width: int, height: int, seconds: float, fps: int = 25, seed: int = 0) -> Path:
+    """Write synthetic MP4 video (cached: reused if it already exists)"""
+    path = Path(path)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp.mp4")
+    writer = cv2.VideoWriter(str(tmp_path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError("Cannot open video writer (OpenCV built without MP4 support?)")
+    try:
+        for index in range(int(seconds * fps)):
+            writer.write(make_frame(width, height, index=index, seed=seed))
+    finally:
+        writer.release()
+    tmp_path.replace(path)
+    return path
@@ -1,34 +1,79 @@
 """
 Main application entry point
 """
-from fastapi import FastAPI, Request
+from time import perf_counter
+_imports_started = perf_counter()
+
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from contextlib import asynccontextmanager
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from sqlalchemy import text
+import asyncio
+import logging
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
-from app.database import init_db
+from app.database import SessionLocal, init_db
+from app.startup import startup_report
+from app import model
+from app.admission import admission
+from app.rate_limit import limiter
 from app.routers import router as detection_router
 from app.video_routers import router as video_router
 from app.stream_routers import router as stream_router
+from app.admin_routers import router as admin_router
+from app.storage_gc import STORAGE_GC_INTERVAL, collector
+from app.ingestion import ingestion
+from app.write_behind import WRITE_BEHIND, recognition_writer
+from app.tracing import ServerTimingMiddleware
+from app.profiling import ProfilerMiddleware
+from app import metrics
 
-# Initialize rate limiter with reasonable limits
-limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["1000/hour", "100/minute"]  # Global limits for all endpoints
-)
+startup_report.started = _imports_started
+startup_report.record("imports", perf_counter() - _imports_started)
+
+logger = logging.getLogger(__name__)
+
+async def load_model():
+    """Load and warm up shared model in a worker thread, then mark process ready"""
+    try:
+        await run_in_threadpool(model.load)
+        startup_report.mark_ready()
+    except Exception as e:
+        startup_report.mark_failed(str(e))
+    startup_report.log()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler"""
     # Startup
-    init_db()
+    with startup_report.phase("init_db"):
+        init_db()
+    # Batched recognition writes (replays journals of a crashed run first)
+    if WRITE_BEHIND:
+        with startup_report.phase("write_behind"):
+            await run_in_threadpool(recognition_writer.start)
+    # Model loads in the background: /health/live answers right away,
+    # /health/ready (and detection endpoints) once the model is warm
+    model_loader = asyncio.create_task(load_model())
+    # Retention and orphan cleanup of uploads (see storage_gc.py)
+    storage_gc = asyncio.create_task(collector.run_forever()) if STORAGE_GC_INTERVAL > 0 else None
+    # Server-side camera ingestion (waits for the model by itself)
+    await ingestion.start()
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    await ingestion.stop()
+    # Commit queued recognitions before the process exits
+    await run_in_threadpool(recognition_writer.stop)
+    model_loader.cancel()
+    if storage_gc:
+        storage_gc.cancel()
+    model.unload()
 
 # Create FastAPI application
 app = FastAPI(
@@ -51,8 +96,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Stage timings in Server-Timing header, on-demand profiling (see /admin/profile)
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(ProfilerMiddleware)
+
 # Create uploads directory
 UPLOAD_DIR = Path("../uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -64,6 +114,7 @@ app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
 app.include_router(detection_router)
 app.include_router(video_router)
 app.include_router(stream_router)
+app.include_router(admin_router)
 
 
 @app.get("/", tags=["Root"])
@@ -78,44 +129,110 @@ async def root(request: Request):
         "architecture": "Layered (Repository + Service + Router)",
         "security": {
             "rate_limiting": "Enabled - 10 req/min for processing, 1000 req/hour globally",
-            "ddos_protection": "Active"
+            "ddos_protection": "Active",
+            "admission_control": "503 with Retry-After when the inference backlog is full"
         },
         "endpoints": {
             "detect": "POST /detect - Upload and detect cows (10/min)",
             "video_analyze": "POST /video/analyze - Analyze video (5/min)",
+            "video_uploads": "POST /video/uploads - Resumable chunked video upload (PUT chunks, then POST /video/uploads/{id}/analyze)",
+            "video_analyses": "GET /video/analyses - Get stored video analyses",
+            "video_detections": "GET /video/analyses/{id}/detections?start=&end= - Get detections for time window",
             "history": "GET /detect/history - Get detection history",
+            "export": "GET /detect/export?format=csv|parquet - Stream whole history (optionally with detections)",
             "detail": "GET /detect/{id} - Get specific detection",
             "delete": "DELETE /detect/{id} - Delete detection",
             "stats": "GET /detect/stats/summary - Get statistics",
+            "rollups": "GET /detect/stats/rollups?resolution=hour|day|week - Cow counts per time bucket",
+            "sources": "GET /stream/sources - Server-side camera ingestion (subscribe: WS /stream/sources/{name})",
             "health": "GET /health - Health check",
+            "health_live": "GET /health/live - Liveness probe",
+            "health_ready": "GET /health/ready - Readiness probe with startup timings",
+            "metrics": "GET /metrics - Prometheus metrics",
             "docs": "GET /docs - Swagger UI documentation",
             "redoc": "GET /redoc - ReDoc documentation"
         }
     }
 
 
+def check_database() -> str:
+    """Run trivial query against database"""
+    try:
+        with SessionLocal() as db:
+            db.execute(text("SELECT 1"))
+        return "healthy"
+    except Exception as e:
+        return f"unhealthy: {str(e)}"
+
+
+def model_status() -> str:
+    """Model state for health responses"""
+    if startup_report.ready:
+        return "ready"
+    if startup_report.error:
+        return f"failed: {startup_report.error}"
+    return "loading"
+
+
 @app.get("/health", tags=["Health"])
 @limiter.limit("200/minute")
 async def health_check(request: Request):
     """
     Health check endpoint
+    Healthy only when the database answers and the model is loaded (503 otherwise)
     """
-    from app.database import SessionLocal
+    db_status = await run_in_threadpool(check_database)
+    healthy = db_status == "healthy" and startup_report.ready
     
-    # Check database connection
-    try:
-        db = SessionLocal()
-        db.execute("SELECT 1")
-        db.close()
-        db_status = "healthy"
-    except Exception as e:
-        db_status = f"unhealthy: {str(e)}"
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={
+            "status": "healthy" if healthy else "unhealthy",
+            "model": f"YOLOv8 ({model_status()})",
+            "database": db_status,
+            "upload_dir": str(UPLOAD_DIR.absolute()),
+            "rate_limiting": "enabled",
+            "ddos_protection": "active",
+            "admission": admission.status(),
+            "scheduler": model.current().scheduler.status() if model.current() else None,
+            "models": model.router().status() if model.router() else [],
+            "write_behind": recognition_writer.status() if WRITE_BEHIND else None
+        }
+    )
+
+
+@app.get("/health/live", tags=["Health"])
+async def liveness():
+    """
+    Liveness probe - the process is up and serving requests (no dependencies checked)
+    """
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags=["Health"])
+async def readiness():
+    """
+    Readiness probe - model loaded and warmed up, database reachable (503 otherwise)
+    Includes startup timing report
+    """
+    db_status = await run_in_threadpool(check_database) if startup_report.ready else "not checked"
+    ready = startup_report.ready and db_status == "healthy"
     
-    return {
-        "status": "healthy",
-        "model": "YOLOv8",
-        "database": db_status,
-        "upload_dir": str(UPLOAD_DIR.absolute()),
-        "rate_limiting": "enabled",
-        "ddos_protection": "active"
-    }
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not ready",
+            "model": model_status(),
+            "database": db_status,
+            "startup": startup_report.to_dict()
+        }
+    )
+
+
+@app.get("/metrics", tags=["Health"], include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Prometheus metrics (stage latencies, queue depth, frames, sessions)
+    """
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
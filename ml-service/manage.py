@@ -0,0 +1,136 @@
+"""
+Management commands
+
+Usage:
+    python manage.py backfill-renditions [--force] [--workers N]
+    python manage.py inference-server [--workers N] [--socket PATH] [--weights PATH]
+    python manage.py autotune [--seconds S] [--size PX] [--weights PATH] [--output PATH]
+    python manage.py storage-gc [--dry-run]
+    python manage.py rebuild-rollups
+"""
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.cpu_tuning import CPU_TUNING_FILE, autotune
+from app.database import SessionLocal, init_db
+from app.detection_store import DetectionStore
+from app.inference_pool import INFERENCE_SOCKET, InferenceServer
+from app.models import Recognition
+from app.renditions import RenditionService
+from app.rollups import RollupService
+from app.storage_gc import StorageCollector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("manage")
+
+UPLOAD_DIR = Path("../uploads")
+
+
+def backfill_renditions(args):
+    """Generate missing thumbnails/previews for all stored recognitions"""
+    init_db()
+    rendition_service = RenditionService(upload_dir=UPLOAD_DIR)
+
+    db = SessionLocal()
+    try:
+        filenames = [row[0] for row in db.query(Recognition.image_path).all()]
+    finally:
+        db.close()
+
+    def process(filename):
+        if not (UPLOAD_DIR / filename).exists():
+            return "missing"
+        try:
+            created = rendition_service.generate(filename, force=args.force)
+        except Exception as e:
+            logger.warning(f"Cannot generate renditions for {filename}: {str(e)}")
+            return "failed"
+        return "generated" if created else "skipped"
+
+    counts = {"generated": 0, "skipped": 0, "missing": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for i, status in enumerate(pool.map(process, filenames), start=1):
+            counts[status] += 1
+            if i % 100 == 0:
+                logger.info(f"Processed {i}/{len(filenames)} images")
+
+    logger.info(f"Backfill complete: {counts}")
+
+
+def inference_server(args):
+    """Run pool of inference worker processes for API processes with INFERENCE_SERVER set"""
+    InferenceServer(socket_path=args.socket, workers=args.workers, weights=args.weights).serve()
+
+
+def autotune_cpu(args):
+    """Benchmark thread / worker / affinity combinations, store best settings per profile"""
+    report = autotune(args.weights, seconds=args.seconds, size=args.size, output=Path(args.output))
+    for profile in ("throughput", "latency"):
+        best = report[profile]
+        logger.info(
+            f"Best for {profile}: {best['settings']} "
+            f"({best['throughput_fps']} fps, p50 {best['p50_ms']} ms)"
+        )
+    logger.info(f"Settings written to {args.output}")
+
+
+def storage_gc(args):
+    """Apply upload retention, remove orphaned files and rows"""
+    init_db()
+    report = StorageCollector(upload_dir=UPLOAD_DIR).run(dry_run=args.dry_run)
+    if "skipped" in report:
+        logger.error(report["skipped"])
+        return
+    for reason, deleted in report["deleted"].items():
+        logger.info(f"{reason}: {deleted['files']} files ({deleted['bytes']} bytes), {deleted['rows']} rows")
+    for kind, usage in report["usage"].items():
+        logger.info(f"{kind}: {usage['files']} files, {usage['bytes']} bytes")
+    logger.info(f"Free space: {report['disk']['free_bytes']} bytes")
+
+
+def rebuild_rollups(args):
+    """Recompute hourly/daily/weekly cow count rollups from stored rows"""
+    init_db()
+    with SessionLocal() as db:
+        counts = RollupService(db).rebuild(DetectionStore())
+    logger.info(f"Rollups rebuilt: {counts} hourly buckets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cow Detection System management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill = subparsers.add_parser("backfill-renditions", help="Generate thumbnails/previews for existing uploads")
+    backfill.add_argument("--force", action="store_true", help="Regenerate existing renditions")
+    backfill.add_argument("--workers", type=int, default=4, help="Number of parallel workers")
+    backfill.set_defaults(func=backfill_renditions)
+
+    server = subparsers.add_parser("inference-server", help="Run multi-process inference server")
+    server.add_argument("--workers", type=int, default=0, help="Inference worker processes (default: tuned value or CPU count)")
+    server.add_argument("--socket", default=INFERENCE_SOCKET, help="Unix socket path")
+    server.add_argument("--weights", default=os.getenv("MODEL_WEIGHTS", "yolov8n.pt").split(",")[0], help="Model weights file (default: first of MODEL_WEIGHTS)")
+    server.set_defaults(func=inference_server)
+
+    tune = subparsers.add_parser("autotune", help="Find best CPU thread / affinity settings for inference")
+    tune.add_argument("--seconds", type=float, default=10.0, help="Measurement time per combination")
+    tune.add_argument("--size", type=int, default=640, help="Synthetic frame size in pixels")
+    tune.add_argument("--weights", default=os.getenv("MODEL_WEIGHTS", "yolov8n.pt").split(",")[0], help="Model weights file (default: first of MODEL_WEIGHTS)")
+    tune.add_argument("--output", default=str(CPU_TUNING_FILE), help="Tuning file to write")
+    tune.set_defaults(func=autotune_cpu)
+
+    gc = subparsers.add_parser("storage-gc", help="Apply upload retention and remove orphaned files")
+    gc.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    gc.set_defaults(func=storage_gc)
+
+    rollups = subparsers.add_parser("rebuild-rollups", help="Recompute cow count rollups from stored rows")
+    rollups.set_defaults(func=rebuild_rollups)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()